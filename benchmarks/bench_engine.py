@@ -0,0 +1,111 @@
+"""Compares single query latency of Model.predict against the EmbeddingEngine, e.g.:
+
+    python -m benchmarks.bench_engine --model models/model-1.9646-044-0.6771-0.8939.npz --threads 1 8 32
+
+Without --model an untrained contextual autoencoder is used, latency doesn't depend on the weights.
+"""
+import os
+import time
+import tempfile
+import argparse
+import threading
+import numpy as np
+import tensorflow as tf
+
+from inference.engine import EmbeddingEngine
+from training.checkpointsaver import load_checkpoint, write_checkpoint
+from training.contextualmodel import contextual_autoencoder, model_input_encoding
+from utils.consts import ALL_AGENTS, ALL_MAPS, ALL_STATS, MODEL_AGENTS, MODEL_MAPS
+
+N_STATS = 2 * len(ALL_STATS)
+
+def untrained_checkpoint() -> str:
+    hparams = { "input_processing_size": 64, "output_processing_size": 64, "layer_a_size": 256, "layer_b_size": 128, "latent_size": 16, "activation": "relu" }
+    model = contextual_autoencoder(hparams, len(ALL_MAPS), len(ALL_AGENTS), N_STATS, input_encoding="index")
+
+    fd, path = tempfile.mkstemp(suffix=".npz")
+    os.close(fd)
+    write_checkpoint(path, model.get_weights(), model.to_json())
+    return path
+
+def random_queries(n: int, seed: int = 0) -> list[tuple]:
+    rng = np.random.default_rng(seed)
+    return [
+        (list(rng.choice(MODEL_AGENTS, size=4, replace=False)), str(rng.choice(MODEL_MAPS)), rng.normal(50, 20, size=(4, N_STATS)))
+        for _ in range(n)
+    ]
+
+def percentiles(latencies: list[float]) -> str:
+    latencies_ms = 1000 * np.array(latencies)
+    return f"p50 {np.percentile(latencies_ms, 50):>7.2f} ms  p99 {np.percentile(latencies_ms, 99):>7.2f} ms"
+
+def bench_predict(model: tf.keras.Model, queries: list[tuple]) -> list[float]:
+    """What main.py style code does, one Model.predict call per query"""
+    codes = { agent: i for i, agent in enumerate(MODEL_AGENTS) }
+    map_codes = { map_name: i for i, map_name in enumerate(MODEL_MAPS) }
+    onehot = model_input_encoding(model) == "onehot"
+
+    latencies = []
+    for agents, map_name, stats in queries:
+        start = time.perf_counter()
+        x_agents = np.array([[codes[agent] for agent in agents]])
+        x_maps = np.array([map_codes[map_name]])
+        if onehot:
+            x_agents, x_maps = np.eye(len(MODEL_AGENTS))[x_agents], np.eye(len(MODEL_MAPS))[x_maps]
+        model.predict([x_agents, x_maps, stats[None, :].astype(np.float32)], verbose=0)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def bench_engine(engine: EmbeddingEngine, queries: list[tuple], n_threads: int) -> tuple[list[float], float]:
+    """Every thread sends its share of the queries one at a time, returns the latencies and queries/sec"""
+    latencies = []
+    lock = threading.Lock()
+
+    def client(client_queries):
+        client_latencies = []
+        for query in client_queries:
+            start = time.perf_counter()
+            engine.query(*query)
+            client_latencies.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(client_latencies)
+
+    threads = [threading.Thread(target=client, args=(queries[i::n_threads],)) for i in range(n_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(queries) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding engine latency benchmark")
+    parser.add_argument("--model", default=None, type=str, help="Model checkpoint, an untrained model is used otherwise")
+    parser.add_argument("--queries", default=2000, type=int, help="Number of queries sent to the engine")
+    parser.add_argument("--predict-queries", default=200, type=int, help="Number of queries sent to Model.predict, it's slow")
+    parser.add_argument("--threads", nargs="+", default=[1, 8, 32], type=int, help="Numbers of concurrent clients")
+    parser.add_argument("--max-delay", default=0.002, type=float, help="Micro-batch deadline of the engine in seconds")
+    args = parser.parse_args()
+
+    model_path = args.model or untrained_checkpoint()
+    queries = random_queries(args.queries)
+
+    latencies = bench_predict(load_checkpoint(model_path), queries[:args.predict_queries])
+    print(f" > {'Model.predict':<28} {percentiles(latencies)}")
+
+    for n_threads in args.threads:
+        # A new engine each time so nothing comes from the cache
+        with EmbeddingEngine(model_path, np.zeros(N_STATS), np.ones(N_STATS), max_delay=args.max_delay) as engine:
+            latencies, qps = bench_engine(engine, queries, n_threads)
+        print(f" > {f'engine, {n_threads} clients':<28} {percentiles(latencies)}  {qps:>8.0f} queries/s")
+
+    with EmbeddingEngine(model_path, np.zeros(N_STATS), np.ones(N_STATS), max_delay=args.max_delay) as engine:
+        bench_engine(engine, queries, 1)
+        latencies, qps = bench_engine(engine, queries, 1)
+    print(f" > {'engine, cached':<28} {percentiles(latencies)}  {qps:>8.0f} queries/s")
+
+    if args.model is None:
+        os.remove(model_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Compares rows/sec and peak RSS of the chunked JSONL reader against the original line-by-line loader.
+
+Every loader runs in its own process so their peak RSS don't mix, e.g.:
+
+    python -m benchmarks.bench_ingest --path data/comps.jsonl --scale 20 --workers 1 4
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+import numpy as np
+
+from training.jsonlreader import read_jsonl
+from utils.consts import ALL_STATS
+
+def legacy_load(path: str) -> int:
+    """Original DatasetFactory._load_data, kept here as the baseline"""
+    def get_player_data(player_info):
+        player_data = []
+        for metric in ALL_STATS:
+            player_data.append(player_info[metric]["atk"])
+            player_data.append(player_info[metric]["def"])
+        return player_data
+
+    all_agents, all_maps, all_stats, all_meta = [], [], [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f.readlines():
+            data = json.loads(line)
+            for team in (data["team_a"], data["team_b"]):
+                all_agents.append([player["agent"] for player in team["players"]])
+                all_maps.append([data["map_name"] for _ in range(5)])
+                all_stats.append([get_player_data(player) for player in team["players"]])
+
+            score_a = float(data["team_a"]["score"])
+            score_b = float(data["team_b"]["score"])
+            total_rounds = score_a + score_b
+            all_meta.append({ "match_id": data["match_id"], "game_id": data["game_id"], "team": data["team_a"]["team"], "wr": score_a / total_rounds })
+            all_meta.append({ "match_id": data["match_id"], "game_id": data["game_id"], "team": data["team_b"]["team"], "wr": score_b / total_rounds })
+
+    agents, maps, stats = np.array(all_agents), np.array(all_maps), np.array(all_stats)
+    return agents.shape[0]
+
+def run_loader(path: str, loader: str, workers: int) -> dict:
+    """Runs one loader in this process and returns its measurements"""
+    start = time.perf_counter()
+    if loader == "legacy":
+        n_rows = legacy_load(path)
+    else:
+        columns, _ = read_jsonl(path, workers=workers)
+        n_rows = columns["maps"].shape[0]
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in KB on Linux, worker processes are accounted for in RUSAGE_CHILDREN
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return { "rows": n_rows, "seconds": elapsed, "peak_rss_mb": peak_rss / 1024 }
+
+def scaled_copy(path: str, scale: int) -> str:
+    """Writes a temporary file with the contents of path repeated scale times"""
+    with open(path, "rb") as f:
+        content = f.read()
+    if not content.endswith(b"\n"):
+        content += b"\n"
+
+    fd, scaled_path = tempfile.mkstemp(suffix=".jsonl")
+    with os.fdopen(fd, "wb") as f:
+        for _ in range(scale):
+            f.write(content)
+    return scaled_path
+
+def main():
+    parser = argparse.ArgumentParser(description="JSONL ingestion benchmark")
+    parser.add_argument("--path", default="data/comps.jsonl", type=str, help="Scraped compositions file")
+    parser.add_argument("--scale", default=1, type=int, help="Number of times the file is repeated")
+    parser.add_argument("--workers", nargs="+", default=[1], type=int, help="Worker counts of the chunked reader to benchmark")
+    parser.add_argument("--run", nargs=2, metavar=("LOADER", "WORKERS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process mode, measures a single loader
+    if args.run is not None:
+        print(json.dumps(run_loader(args.path, args.run[0], int(args.run[1]))))
+        return
+
+    path = scaled_copy(args.path, args.scale) if args.scale > 1 else args.path
+    try:
+        runs = [("legacy", 1)] + [("chunked", workers) for workers in args.workers]
+        for loader, workers in runs:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_ingest", "--path", path, "--run", loader, str(workers)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+
+            name = loader if loader == "legacy" else f"{loader} x{workers}"
+            print(f" > {name:<12} {result['rows']:>9} rows  {result['rows'] / result['seconds']:>10.0f} rows/s  {result['peak_rss_mb']:>8.1f} MB peak RSS")
+    finally:
+        if path != args.path:
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compares queries/sec and recall of the IVF index against exact blocked search and naive brute force.
+
+Runs on synthetic clustered 16-d embeddings by default, or on an embedding store, e.g.:
+
+    python -m benchmarks.bench_knn --rows 2000000 --nprobe 1 4 16
+    python -m benchmarks.bench_knn --store data/embeddings.store
+"""
+import time
+import argparse
+import numpy as np
+
+from inference.embeddingstore import EmbeddingStore
+from inference.knnindex import METRICS, IVFIndex, exact_search
+
+def synthetic_embeddings(n_rows: int, dim: int, n_clusters: int = 256, seed: int = 42) -> np.ndarray:
+    """Gaussian blobs, closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    vectors = np.empty((n_rows, dim), dtype=np.float32)
+    for start in range(0, n_rows, 1 << 20):
+        end = min(n_rows, start + (1 << 20))
+        vectors[start:end] = centers[rng.integers(0, n_clusters, end - start)] + 0.3 * rng.normal(size=(end - start, dim))
+    return vectors
+
+def naive_search(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """One full distance row per query, what a straightforward implementation does"""
+    indices = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        distances = np.sum((vectors - query) ** 2, axis=1)
+        top = np.argpartition(distances, k - 1)[:k]
+        indices[i] = top[np.argsort(distances[top])]
+    return indices
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(a[a >= 0]) & set(b)) / len(b) for a, b in zip(found, truth)]))
+
+def timed(fn, n_queries: int) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = fn()
+    return n_queries / (time.perf_counter() - start), result
+
+def main():
+    parser = argparse.ArgumentParser(description="Nearest neighbour search benchmark")
+    parser.add_argument("--store", default=None, type=str, help="Embedding store to search, synthetic embeddings are used otherwise")
+    parser.add_argument("--rows", default=1000000, type=int, help="Number of synthetic embeddings")
+    parser.add_argument("--dim", default=16, type=int, help="Size of the synthetic embeddings")
+    parser.add_argument("--queries", default=1000, type=int, help="Number of queries")
+    parser.add_argument("--naive-queries", default=20, type=int, help="Number of queries run through naive brute force, it's slow")
+    parser.add_argument("-k", default=10, type=int, help="Number of neighbours")
+    parser.add_argument("--metric", default="l2", choices=METRICS)
+    parser.add_argument("--lists", default=None, type=int, help="Number of clusters of the index")
+    parser.add_argument("--nprobe", nargs="+", default=[1, 2, 4, 8, 16, 32], type=int, help="Probe counts to benchmark")
+    args = parser.parse_args()
+
+    if args.store is not None:
+        vectors = np.asarray(EmbeddingStore.open(args.store).embeddings, dtype=np.float32)
+    else:
+        vectors = synthetic_embeddings(args.rows, args.dim)
+
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), size=args.queries, replace=False)] + 0.01 * rng.normal(size=(args.queries, vectors.shape[1])).astype(np.float32)
+    print(f"{len(vectors)} embeddings of size {vectors.shape[1]}, {args.queries} queries, k={args.k}, metric={args.metric}")
+
+    if args.metric == "l2":
+        n_naive = min(args.naive_queries, args.queries)
+        qps, _ = timed(lambda: naive_search(vectors, queries[:n_naive], args.k), n_naive)
+        print(f" > {'naive brute force':<24} {qps:>10.1f} queries/s")
+
+    qps, (_, truth) = timed(lambda: exact_search(vectors, queries, args.k, args.metric), args.queries)
+    print(f" > {'exact blocked':<24} {qps:>10.1f} queries/s  recall 1.000")
+
+    start = time.perf_counter()
+    index = IVFIndex.build(vectors, n_lists=args.lists, metric=args.metric)
+    print(f" > IVF build with {index.n_lists} clusters in {time.perf_counter() - start:.2f} s")
+
+    for nprobe in args.nprobe:
+        qps, (_, found) = timed(lambda nprobe=nprobe: index.search(queries, args.k, nprobe), args.queries)
+        print(f" > {f'IVF nprobe={nprobe}':<24} {qps:>10.1f} queries/s  recall {recall(found, truth):.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Checks that all match page parsers give identical results and times them on recorded pages.
+
+The pages are read from a page cache filled by a previous run of scrapdata.py, e.g.:
+
+    python -m benchmarks.bench_parser --cache-dir data/pagecache
+
+Exits with an error if any page is parsed differently by the parsers.
+"""
+import sys
+import time
+import argparse
+
+from benchmarks.recordedserver import RecordedPageServer
+from scraping.vlrscraper import VLRScraper, MATCH_PARSERS
+
+def parse_all(scraper: VLRScraper, pages: dict[str, bytes]) -> tuple[dict, float]:
+    """Parses all pages and returns the results (or the raised error) by match ID and the elapsed time"""
+    results = {}
+    start = time.perf_counter()
+    for match_id, content in pages.items():
+        try:
+            results[match_id] = scraper._parse_match_page(match_id, content)
+        except Exception as e: # pylint: disable=broad-except
+            results[match_id] = type(e)
+    return results, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Match page parsers parity check and benchmark")
+    parser.add_argument("--cache-dir", default="data/pagecache", type=str, help="Page cache with the recorded pages")
+    parser.add_argument("--limit", default=1000, type=int, help="Max number of match pages to parse")
+    args = parser.parse_args()
+
+    # The server is only used to list the recorded pages, nothing is downloaded
+    server = RecordedPageServer(args.cache_dir)
+    pages = {}
+    for url in server.recorded_urls(kind="match")[:args.limit]:
+        pages[url.rsplit("/", 1)[-1]] = server.cache.get(url, ignore_ttl=True)
+
+    if len(pages) == 0:
+        parser.error(f"No recorded match pages in {args.cache_dir}")
+
+    results = {}
+    print(f"Parsing {len(pages)} match pages")
+    for backend in MATCH_PARSERS:
+        results[backend], elapsed = parse_all(VLRScraper(parser=backend), pages)
+        print(f" > {backend:<6} {elapsed:8.2f} s  {len(pages) / elapsed:8.1f} pages/s")
+
+    reference, *others = MATCH_PARSERS
+    mismatches = [
+        (backend, match_id)
+        for backend in others
+        for match_id in pages
+        if results[backend][match_id] != results[reference][match_id]
+    ]
+
+    for backend, match_id in mismatches:
+        print(f"   > Match {match_id} parsed differently by {backend} and {reference}")
+
+    if len(mismatches) > 0:
+        sys.exit(1)
+    print("All parsers returned identical results")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Compares fixed concurrency without retries against the adaptive request scheduler on a faulty local server, e.g.:
+
+    python -m benchmarks.bench_scheduler --pages 400 --capacity 8 --max-in-flight 16 --error-rate 0.05
+
+The server slows down past its capacity, throttles past max-in-flight and randomly fails requests, see
+FaultyPageServer. Only downloads are timed, pages that were not recorded are served a placeholder so no
+page cache is needed.
+"""
+import time
+import tempfile
+import argparse
+import concurrent.futures
+
+from benchmarks.recordedserver import FaultyPageServer
+from scraping.scheduler import AIMDController, TokenBucket, RequestScheduler
+from scraping.vlrscraper import VLRScraper
+
+def run(base_url: str, match_ids: list[int], threads: int, scheduler: RequestScheduler | None) -> tuple[float, int]:
+    """Downloads every match page and returns the elapsed time and the number of pages that failed"""
+    scraper = VLRScraper(base_url=base_url, max_connections=threads, scheduler=scheduler)
+
+    def download(match_id):
+        try:
+            scraper._get_page(scraper._match_url(match_id), kind="match")
+            return True
+        except Exception: # pylint: disable=broad-except
+            return False
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        ok = list(executor.map(download, match_ids))
+    return time.perf_counter() - start, ok.count(False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Adaptive request scheduler benchmark")
+    parser.add_argument("--cache-dir", default=None, type=str, help="Page cache with recorded pages, placeholders are served otherwise")
+    parser.add_argument("--pages", default=400, type=int, help="Number of match pages to download")
+    parser.add_argument("--threads", default=32, type=int, help="Threads, the fixed concurrency and the max of the scheduler")
+    parser.add_argument("--latency", default=0.05, type=float, help="Latency of the server under its capacity")
+    parser.add_argument("--capacity", default=8, type=int, help="Requests in flight before the server slows down")
+    parser.add_argument("--max-in-flight", default=16, type=int, help="Requests in flight before the server throttles")
+    parser.add_argument("--max-rate", default=None, type=float, help="Requests per second before the server throttles")
+    parser.add_argument("--error-rate", default=0.05, type=float, help="Fraction of requests failing with a 503")
+    parser.add_argument("--rate", default=1000.0, type=float, help="Rate limit of the scheduler")
+    args = parser.parse_args()
+
+    cache_dir = args.cache_dir or tempfile.mkdtemp()
+    match_ids = list(range(100000, 100000 + args.pages))
+    server_options = dict(
+        latency=args.latency, capacity=args.capacity, max_in_flight=args.max_in_flight, max_rate=args.max_rate,
+        error_rate=args.error_rate, retry_after=0.2, fallback=b"<html></html>"
+    )
+
+    print(f"{args.pages} pages, server capacity {args.capacity}, throttling past {args.max_in_flight} in flight, {100 * args.error_rate:.0f}% errors")
+    with FaultyPageServer(cache_dir, **server_options) as server:
+        elapsed, failed = run(server.url, match_ids, args.threads, None)
+        print(f" > fixed {args.threads:>3} threads    {elapsed:8.2f} s  {args.pages / elapsed:8.1f} pages/s  {failed:>5} failed  {dict(server.counts)}")
+
+    with FaultyPageServer(cache_dir, **server_options) as server:
+        scheduler = RequestScheduler(AIMDController(initial=4, max_limit=args.threads), TokenBucket(args.rate), max_attempts=5, backoff=0.1)
+        elapsed, failed = run(server.url, match_ids, args.threads, scheduler)
+        print(f" > adaptive scheduler {elapsed:8.2f} s  {args.pages / elapsed:8.1f} pages/s  {failed:>5} failed  {dict(server.counts)}")
+        print(f"   {scheduler.summary()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Benchmarks the threaded and the asyncio scraping engines against a local server replaying recorded vlr.gg pages.
+
+The pages are read from a page cache filled by a previous run of scrapdata.py, e.g.:
+
+    python -m benchmarks.bench_scraper --cache-dir data/pagecache --latency 0.05
+
+Only downloads are timed by default since parsing costs the same on both engines, use --parse to include it.
+"""
+import time
+import asyncio
+import argparse
+import concurrent.futures
+
+from benchmarks.recordedserver import RecordedPageServer
+from scraping.vlrscraper import VLRScraper
+from scraping.asyncvlrscraper import AsyncVLRScraper
+
+def bench_threads(base_url: str, match_ids: list[str], threads: int, parse: bool) -> float:
+    """Scrapes all matches with a thread pool and returns the elapsed time"""
+    scraper = VLRScraper(base_url=base_url, max_connections=threads)
+
+    def scrape(match_id):
+        if parse:
+            return scraper.get_match_info(match_id)
+        return scraper._get_page(scraper._match_url(match_id), kind="match")
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(scrape, match_ids))
+    return time.perf_counter() - start
+
+def bench_async(base_url: str, match_ids: list[str], connections: int, parse: bool) -> float:
+    """Scrapes all matches with the asyncio engine and returns the elapsed time"""
+    async def run():
+        async with AsyncVLRScraper(base_url=base_url, max_connections_per_host=connections) as scraper:
+            async def scrape(match_id):
+                if parse:
+                    return await scraper.get_match_info(match_id)
+                return await scraper._get_page(scraper._match_url(match_id), kind="match")
+
+            await asyncio.gather(*(scrape(match_id) for match_id in match_ids))
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Scraping engines benchmark")
+    parser.add_argument("--cache-dir", default="data/pagecache", type=str, help="Page cache with the recorded pages")
+    parser.add_argument("--latency", default=0.05, type=float, help="Simulated server latency in seconds")
+    parser.add_argument("--limit", default=500, type=int, help="Max number of match pages to scrape")
+    parser.add_argument("--threads", default=12, type=int, help="Threads of the threaded engine")
+    parser.add_argument("--connections", default=64, type=int, help="Connections per host of the asyncio engine")
+    parser.add_argument("--parse", action="store_true", help="Also parse the downloaded pages")
+    args = parser.parse_args()
+
+    with RecordedPageServer(args.cache_dir, latency=args.latency) as server:
+        match_urls = server.recorded_urls(kind="match")[:args.limit]
+        match_ids = [url.rsplit("/", 1)[-1] for url in match_urls]
+        if len(match_ids) == 0:
+            parser.error(f"No recorded match pages in {args.cache_dir}")
+
+        results = {
+            f"threads ({args.threads})": bench_threads(server.url, match_ids, args.threads, args.parse),
+            f"asyncio ({args.connections} conns)": bench_async(server.url, match_ids, args.connections, args.parse),
+        }
+
+    print(f"{len(match_ids)} match pages, {args.latency * 1000:.0f} ms simulated latency")
+    for engine, elapsed in results.items():
+        print(f" > {engine:<24} {elapsed:8.2f} s  {len(match_ids) / elapsed:8.1f} pages/s")
+
+if __name__ == "__main__":
+    main()
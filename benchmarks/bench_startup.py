@@ -0,0 +1,66 @@
+"""Measures the startup time of every command of cli.py and checks it stays within a budget, e.g.:
+
+    python -m benchmarks.bench_startup --budget 1.0
+
+Each command runs with --help in a fresh interpreter, which is everything a command does before its
+own work. Exits with status 1 if a command goes over the budget or imports one of HEAVY_MODULES,
+so it can run as a regression check.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+
+from cli import COMMANDS
+
+# Modules that take seconds to import, only the main of a command may import them
+HEAVY_MODULES = ["tensorflow", "tensorboard", "keras", "sklearn", "pandas", "matplotlib", "seaborn", "aiohttp"]
+
+PROBE = """
+import sys, json
+import cli
+try:
+    cli.main(sys.argv[1:])
+except SystemExit:
+    pass
+print(json.dumps(sorted(name for name in {heavy} if name in sys.modules)))
+"""
+
+def run_command(argv: list[str], root: str) -> tuple[float, list[str]]:
+    """Returns the wall time of a command in a fresh interpreter and the heavy modules it imported"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(heavy=HEAVY_MODULES), *argv],
+        cwd=root, capture_output=True, text=True, check=True
+    )
+    elapsed = time.perf_counter() - start
+    return elapsed, json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time check of the commands")
+    parser.add_argument("--budget", default=1.0, type=float, help="Max median startup time of a command in seconds")
+    parser.add_argument("--repeat", default=5, type=int, help="Number of runs of each command")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    baseline, _ = run_command([], root)
+
+    failed = False
+    for argv in [["--help"], *([name, "--help"] for name in COMMANDS)]:
+        runs = [run_command(argv, root) for _ in range(args.repeat)]
+        median = float(np.median([elapsed for elapsed, _ in runs]))
+        heavy = runs[-1][1]
+
+        ok = median <= args.budget and len(heavy) == 0
+        failed |= not ok
+        status = "ok" if ok else "FAIL"
+        print(f" > {' '.join(argv):<28} {1000 * median:>7.0f} ms {status:>5}  {', '.join(heavy)}")
+
+    print(f"Budget {1000 * args.budget:.0f} ms, interpreter and cli.py alone take {1000 * baseline:.0f} ms")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import random
+import threading
+import collections
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from scraping.pagecache import PageCache
+
+class RecordedPageServer:
+    """Local HTTP server that stands in for vlr.gg by serving pages recorded in a PageCache.
+
+    Use it as a context manager, the server runs on a background thread and `url` is its base URL.
+    """
+
+    def __init__(self, cache_dir: str, latency: float = 0.0, recorded_base_url: str = "https://www.vlr.gg"):
+        self.cache = PageCache(cache_dir)
+        self.latency = latency
+        self.recorded_base_url = recorded_base_url.rstrip("/")
+        self._server: ThreadingHTTPServer = None
+        self._thread: threading.Thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def recorded_urls(self, kind: str = None) -> list[str]:
+        """Returns all the recorded URLs, optionally only of one kind (match, event)"""
+        urls = []
+        index_dir = os.path.join(self.cache.cache_dir, "index")
+        for root, _, files in os.walk(index_dir):
+            for name in files:
+                with open(os.path.join(root, name), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                if kind is None or entry["kind"] == kind:
+                    urls.append(entry["url"])
+        return sorted(urls)
+
+    def respond(self, handler: BaseHTTPRequestHandler) -> tuple[int, bytes]:
+        """Returns the status and body for a request. Subclasses may override it to inject faults"""
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        content = self.cache.get(self.recorded_base_url + handler.path, ignore_ttl=True)
+        if content is None:
+            return 404, b"Not found"
+        return 200, content
+
+    def __enter__(self):
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 so clients can keep their connections alive
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                # respond() may set it, the handler is reused by the requests of a kept alive connection
+                self.retry_after = None
+                status, body = owner.respond(self)
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                if self.retry_after is not None:
+                    self.send_header("Retry-After", str(self.retry_after))
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+class FaultyPageServer(RecordedPageServer):
+    """RecordedPageServer that behaves like an overloaded, rate limited site.
+
+    Latency grows with the number of requests in flight past `capacity`, requests past `max_in_flight` or
+    over `max_rate` per second get a 429 with a Retry-After, and a random `error_rate` of requests fail with
+    a 503. URLs that were not recorded are served `fallback` when given, so only downloads can be tested
+    without a page cache.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        latency: float = 0.05,
+        capacity: int = 8,
+        max_in_flight: int = 16,
+        max_rate: float = None,
+        error_rate: float = 0.0,
+        retry_after: float = 1.0,
+        fallback: bytes = None,
+        seed: int = 0,
+        recorded_base_url: str = "https://www.vlr.gg"
+    ):
+        super().__init__(cache_dir, latency=latency, recorded_base_url=recorded_base_url)
+        self.capacity = capacity
+        self.max_in_flight = max_in_flight
+        self.max_rate = max_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.fallback = fallback
+        self.counts = collections.Counter()
+        self._in_flight = 0
+        self._recent = collections.deque()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def respond(self, handler: BaseHTTPRequestHandler) -> tuple[int, bytes]:
+        with self._lock:
+            now = time.monotonic()
+            while len(self._recent) > 0 and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            throttled = self._in_flight >= self.max_in_flight or (self.max_rate is not None and len(self._recent) >= self.max_rate)
+            failed = self._rng.random() < self.error_rate
+            if not throttled:
+                self._in_flight += 1
+                self._recent.append(now)
+                in_flight = self._in_flight
+
+        if throttled:
+            self.counts[429] += 1
+            handler.retry_after = self.retry_after
+            return 429, b"Too many requests"
+
+        try:
+            time.sleep(self.latency * max(1.0, in_flight / self.capacity))
+            if failed:
+                self.counts[503] += 1
+                return 503, b"Service unavailable"
+
+            content = self.cache.get(self.recorded_base_url + handler.path, ignore_ttl=True) or self.fallback
+            if content is None:
+                self.counts[404] += 1
+                return 404, b"Not found"
+            self.counts[200] += 1
+            return 200, content
+        finally:
+            with self._lock:
+                self._in_flight -= 1
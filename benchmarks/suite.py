@@ -0,0 +1,278 @@
+"""Runs every benchmark on a synthetic corpus and saves the results as JSON, e.g.:
+
+    python -m benchmarks.suite --games 20000 --out results/bench.json
+    python -m benchmarks.suite --games 20000 --out results/new.json --compare results/bench.json
+
+Each benchmark runs in its own process, so its peak RSS is its own, and reports the best of --repeat
+timed runs after an untimed setup. With --compare, exits with status 1 if a benchmark got slower or
+used more memory than the given threshold.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import importlib.metadata
+
+from benchmarks.synthcorpus import generate_corpus
+
+# Layer sizes in the middle of the search space of train.py
+HPARAMS = {
+    "input_processing_size": 32,
+    "output_processing_size": 32,
+    "layer_a_size": 192,
+    "layer_b_size": 64,
+    "latent_size": 16,
+    "dropout": 0.2,
+    "optimizer": "adam",
+    "activation": "relu",
+}
+
+# Packages whose version is saved with the results
+PACKAGES = ["numpy", "scikit-learn", "tensorflow", "lxml", "beautifulsoup4"]
+
+class Skipped(Exception):
+    """Raised by the setup of a benchmark that can't run here"""
+
+def bench_parse(args: argparse.Namespace):
+    """Match pages parsed from the page cache of a previous scrape"""
+    from benchmarks.recordedserver import RecordedPageServer
+    from scraping.vlrscraper import VLRScraper
+
+    if args.cache_dir is None or not os.path.isdir(args.cache_dir):
+        raise Skipped("no --cache-dir with recorded pages")
+
+    server = RecordedPageServer(args.cache_dir)
+    pages = { url.rsplit("/", 1)[-1]: server.cache.get(url, ignore_ttl=True) for url in server.recorded_urls(kind="match") }
+    if len(pages) == 0:
+        raise Skipped(f"no recorded match pages in {args.cache_dir}")
+
+    # The parser scrapdata.py uses by default
+    scraper = VLRScraper(parser="lxml")
+    def run():
+        for match_id, content in pages.items():
+            scraper._parse_match_page(match_id, content)
+    return len(pages), run
+
+def bench_load(args: argparse.Namespace):
+    """Compositions read from the corpus by DatasetFactory._load_data"""
+    from training.datasetfactory import DatasetFactory
+
+    factory = DatasetFactory(args.corpus)
+    n_rows = len(factory._load_data()[1])
+    return n_rows, factory._load_data
+
+def bench_preprocess(args: argparse.Namespace):
+    """Compositions encoded and scaled by DatasetFactory._preprocess_data"""
+    from training.datasetfactory import DatasetFactory
+    from train import input_encoding
+
+    factory = DatasetFactory(args.corpus)
+    agents, maps, stats, _ = factory._load_data()
+    return len(maps), lambda: factory._preprocess_data(agents, maps, stats, input_encoding)
+
+def bench_generate_dataset(args: argparse.Namespace):
+    """Compositions turned into held out player examples by DatasetFactory.generate_dataset"""
+    from training.datasetfactory import DatasetFactory
+    from train import input_encoding
+
+    factory = DatasetFactory(args.corpus)
+    n_rows = len(factory._load_data()[1])
+    return n_rows, lambda: factory.generate_dataset(as_tf_dataset=False, encoding=input_encoding)
+
+def bench_train_step(args: argparse.Namespace):
+    """Examples of forward and backward passes with Model.train_on_batch"""
+    model, (x, y) = _model_and_examples(args)
+    batches = [
+        ([inputs[start : start + args.batch_size] for inputs in x], [outputs[start : start + args.batch_size] for outputs in y])
+        for start in range(0, len(y[0]) - args.batch_size + 1, args.batch_size)
+    ][:args.steps]
+
+    # The first call traces the train function
+    model.train_on_batch(*batches[0])
+    def run():
+        for inputs, outputs in batches:
+            model.train_on_batch(inputs, outputs)
+    return len(batches) * args.batch_size, run
+
+def bench_forward(args: argparse.Namespace):
+    """Examples of the agent and stat outputs with Model.predict"""
+    model, (x, _) = _model_and_examples(args)
+    model.predict(x, batch_size=args.inference_batch_size, verbose=0)
+    return len(x[0]), lambda: model.predict(x, batch_size=args.inference_batch_size, verbose=0)
+
+def bench_encode(args: argparse.Namespace):
+    """Examples embedded by the latent encoder of embed.py"""
+    from inference.embedder import latent_encoder
+
+    model, (x, _) = _model_and_examples(args)
+    encoder = latent_encoder(model)
+    encoder.predict(x, batch_size=args.inference_batch_size, verbose=0)
+    return len(x[0]), lambda: encoder.predict(x, batch_size=args.inference_batch_size, verbose=0)
+
+def bench_encode_numpy(args: argparse.Namespace):
+    """Examples embedded by the NumPy runtime of exportmodel.py"""
+    from inference.numpyexport import to_numpy_model
+    from training.checkpointsaver import write_checkpoint
+
+    model, (x, _) = _model_and_examples(args)
+    fd, path = tempfile.mkstemp(suffix=".npz")
+    os.close(fd)
+    try:
+        write_checkpoint(path, model.get_weights(), model.to_json())
+        numpy_model, _ = to_numpy_model(path)
+    finally:
+        os.remove(path)
+    return len(x[0]), lambda: numpy_model.encode(x, batch_size=args.inference_batch_size)
+
+BENCHMARKS = {
+    "parse": bench_parse,
+    "load": bench_load,
+    "preprocess": bench_preprocess,
+    "generate_dataset": bench_generate_dataset,
+    "train_step": bench_train_step,
+    "forward": bench_forward,
+    "encode": bench_encode,
+    "encode_numpy": bench_encode_numpy,
+}
+
+def _model_and_examples(args: argparse.Namespace):
+    """Returns a compiled untrained model and the training examples of the corpus, speed doesn't depend on the weights"""
+    from training.datasetfactory import DatasetFactory
+    from train import ContextualAutoencoder, agent_loss, input_encoding
+
+    (x, y), _, _, _ = DatasetFactory(args.corpus).generate_dataset(as_tf_dataset=False, encoding=input_encoding)
+    model = ContextualAutoencoder(HPARAMS)
+    model.compile(optimizer=HPARAMS["optimizer"], loss={ "agent": agent_loss, "stat": "mse" })
+    return model, (list(x), list(y))
+
+def run_benchmark(name: str, args: argparse.Namespace) -> dict:
+    """Runs one benchmark in this process and returns its measurements"""
+    try:
+        n_items, run = BENCHMARKS[name](args)
+    except Skipped as e:
+        return { "skipped": str(e) }
+
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    # ru_maxrss is in KB on Linux, worker processes are accounted for in RUSAGE_CHILDREN
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return { "items": n_items, "seconds": min(times), "items_per_s": n_items / min(times), "peak_rss_mb": peak_rss / 1024 }
+
+def environment() -> dict:
+    """Returns what the results depend on besides the code"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "packages": versions,
+    }
+
+def compare(results: dict, reference: dict, threshold: float) -> bool:
+    """Prints the changes from the reference results and returns whether any benchmark regressed"""
+    regressed = False
+    for name, result in results.items():
+        old = reference.get(name)
+        if "skipped" in result or old is None or "skipped" in old:
+            continue
+
+        speed = result["items_per_s"] / old["items_per_s"] - 1
+        memory = result["peak_rss_mb"] / old["peak_rss_mb"] - 1
+        failed = speed < -threshold or memory > threshold
+        regressed |= failed
+        print(f" > {name:<18} {100 * speed:>+7.1f}% items/s  {100 * memory:>+7.1f}% peak RSS  {'REGRESSION' if failed else 'ok'}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite on a synthetic corpus")
+    parser.add_argument("--benchmarks", nargs="+", default=list(BENCHMARKS), choices=list(BENCHMARKS), help="Benchmarks to run")
+    parser.add_argument("--corpus", default=None, type=str, help="Compositions file, a synthetic one is generated by default")
+    parser.add_argument("--games", default=20000, type=int, help="Number of games of the synthetic corpus")
+    parser.add_argument("--seed", default=42, type=int, help="Seed of the synthetic corpus")
+    parser.add_argument("--cache-dir", default=None, type=str, help="Page cache with recorded pages for the parse benchmark")
+    parser.add_argument("--repeat", default=3, type=int, help="Timed runs of every benchmark, the best one is kept")
+    parser.add_argument("--batch-size", default=32, type=int, help="Batch size of the train step benchmark")
+    parser.add_argument("--steps", default=500, type=int, help="Max number of batches of the train step benchmark")
+    parser.add_argument("--inference-batch-size", default=8192, type=int, help="Batch size of the inference benchmarks")
+    parser.add_argument("--out", default=None, type=str, help="JSON file the results are saved to")
+    parser.add_argument("--compare", default=None, type=str, help="JSON results of a previous run to check for regressions")
+    parser.add_argument("--threshold", default=0.1, type=float, help="Relative slowdown or memory growth counted as a regression")
+    parser.add_argument("--run", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process mode, runs a single benchmark
+    if args.run is not None:
+        print(json.dumps(run_benchmark(args.run, args)))
+        return
+
+    corpus = args.corpus
+    if corpus is None:
+        fd, corpus = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        generate_corpus(corpus, args.games, args.seed)
+
+    # Everything but the benchmark selection and output options is passed on to the children
+    child_args = [
+        "--corpus", corpus, "--repeat", str(args.repeat), "--batch-size", str(args.batch_size),
+        "--steps", str(args.steps), "--inference-batch-size", str(args.inference_batch_size),
+        *(["--cache-dir", args.cache_dir] if args.cache_dir is not None else []),
+    ]
+
+    results = {}
+    try:
+        for name in args.benchmarks:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.suite", *child_args, "--run", name],
+                check=True, capture_output=True, text=True
+            ).stdout
+            results[name] = result = json.loads(output.strip().splitlines()[-1])
+
+            if "skipped" in result:
+                print(f" > {name:<18} skipped, {result['skipped']}")
+            else:
+                print(f" > {name:<18} {result['items']:>9} items  {result['seconds']:>8.3f} s  {result['items_per_s']:>12.0f} items/s  {result['peak_rss_mb']:>8.1f} MB peak RSS")
+    finally:
+        if args.corpus is None:
+            os.remove(corpus)
+
+    report = {
+        "created_at": time.time(),
+        "environment": environment(),
+        "config": { "corpus": args.corpus, "games": None if args.corpus else args.games, "seed": args.seed, **{ name: vars(args)[name] for name in ("repeat", "batch_size", "steps", "inference_batch_size") } },
+        "results": results,
+    }
+    if args.out is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            reference = json.load(f)
+        print(f"Compared to {args.compare} (commit {reference['environment']['git_commit']})")
+        sys.exit(1 if compare(results, reference["results"], args.threshold) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Generates a synthetic comps.jsonl with the schema of scrapdata.py output, at any scale, e.g.:
+
+    python -m benchmarks.synthcorpus --games 1000000 -o data/synth.jsonl --workers 8
+
+Teams pick compositions with one agent of every role plus a flex pick, from pick rates that depend on the
+map, and popular compositions are played much more than others like in pro play. Stats are drawn per side
+from the rounds played on it and the role of the agent, so they are consistent with each other. The same
+seed gives the same file whatever the number of workers.
+"""
+import sys
+import argparse
+import functools
+import multiprocessing as mp
+import numpy as np
+
+from utils.consts import ALL_AGENTS, ALL_MAPS
+
+ROLES = {
+    "duelist": ["Jett", "Raze", "Reyna", "Phoenix", "Neon", "Yoru"],
+    "controller": ["Astra", "Brimstone", "Omen", "Viper"],
+    "initiator": ["Breach", "Fade", "Kayo", "Skye", "Sova"],
+    "sentinel": ["Chamber", "Cypher", "Killjoy", "Sage"],
+}
+
+# Rough pick rates of pro play, multiplied by MAP_PICKS on some maps
+PICK_RATES = {
+    "Jett": 9, "Raze": 4, "Reyna": 0.5, "Phoenix": 0.7, "Neon": 2, "Yoru": 0.5,
+    "Astra": 3, "Brimstone": 2, "Omen": 4, "Viper": 5,
+    "Breach": 2.5, "Fade": 4, "Kayo": 3.5, "Skye": 4, "Sova": 6,
+    "Chamber": 6, "Cypher": 2.5, "Killjoy": 5, "Sage": 1.5,
+}
+MAP_PICKS = {
+    "Bind": { "Brimstone": 3, "Raze": 2.5, "Skye": 1.5, "Viper": 1.5 },
+    "Breeze": { "Viper": 3, "Cypher": 2, "Kayo": 2 },
+    "Icebox": { "Viper": 3, "Sage": 3, "Sova": 1.5 },
+    "Fracture": { "Brimstone": 2, "Breach": 2.5, "Neon": 2 },
+    "Pearl": { "Astra": 2, "Viper": 1.5, "Fade": 1.5 },
+    "Split": { "Raze": 2.5, "Astra": 1.5, "Cypher": 1.5 },
+    "Haven": { "Breach": 1.5, "Killjoy": 1.5 },
+    "Ascent": { "Sova": 1.5, "Killjoy": 1.5 },
+}
+MAP_RATES = { "Ascent": 1.2, "Bind": 1.0, "Breeze": 0.8, "Haven": 1.1, "Icebox": 1.0, "Pearl": 0.9, "Fracture": 0.7, "Split": 1.1 }
+
+# Mean kills, assists and first kills / deaths per round of every role
+ROLE_RATES = {
+    "duelist": { "kills": 0.82, "assists": 0.18, "fk": 0.16, "fd": 0.15 },
+    "controller": { "kills": 0.66, "assists": 0.34, "fk": 0.07, "fd": 0.07 },
+    "initiator": { "kills": 0.68, "assists": 0.38, "fk": 0.08, "fd": 0.09 },
+    "sentinel": { "kills": 0.70, "assists": 0.22, "fk": 0.09, "fd": 0.08 },
+}
+
+COMPOSITIONS_PER_MAP = 512
+# Games of a match are never split across chunks, matches are 3 games
+CHUNK_SIZE = 3 * 3334
+
+@functools.lru_cache(maxsize=4)
+def composition_bank(seed: int) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the compositions (n_maps, COMPOSITIONS_PER_MAP, 5) as ALL_AGENTS codes and how often each is played"""
+    rng = np.random.default_rng(seed)
+    agent_roles = { agent: role for role, agents in ROLES.items() for agent in agents }
+    bank = np.zeros((len(ALL_MAPS), COMPOSITIONS_PER_MAP, 5), dtype=np.int64)
+    for m, map_name in enumerate(ALL_MAPS):
+        rates = { agent: rate * MAP_PICKS.get(map_name, {}).get(agent, 1) for agent, rate in PICK_RATES.items() }
+        for c in range(COMPOSITIONS_PER_MAP):
+            # One agent of every role, the fifth one from any role
+            comp = []
+            for role in [*ROLES, None]:
+                candidates = [agent for agent in (ROLES[role] if role else agent_roles) if agent not in comp]
+                weights = np.array([rates[agent] for agent in candidates])
+                comp.append(candidates[rng.choice(len(candidates), p=weights / weights.sum())])
+            bank[m, c] = rng.permutation([ALL_AGENTS.index(agent) for agent in comp])
+
+    # A few compositions are played most of the time on every map
+    popularity = 1 / np.arange(1, COMPOSITIONS_PER_MAP + 1) ** 1.1
+    return bank, popularity / popularity.sum()
+
+def generate_chunk(chunk: int, n_games: int, seed: int, n_teams: int) -> bytes:
+    """Returns the JSON lines of games chunk * CHUNK_SIZE to chunk * CHUNK_SIZE + n_games"""
+    bank, popularity = composition_bank(seed)
+    rng = np.random.default_rng([seed, chunk])
+    first_game = chunk * CHUNK_SIZE
+
+    # Matches are 3 games played by the same teams
+    game_index = first_game + np.arange(n_games)
+    match_ids = 1000 + game_index // 3
+    first_team = rng.integers(n_teams, size=n_games // 3 + 1)
+    second_team = (first_team + rng.integers(1, n_teams, size=n_games // 3 + 1)) % n_teams
+    teams = np.stack([first_team, second_team], axis=1)[match_ids - match_ids[0]]
+
+    map_rates = np.array([MAP_RATES[map_name] for map_name in ALL_MAPS])
+    maps = rng.choice(len(ALL_MAPS), size=n_games, p=map_rates / map_rates.sum())
+    comps = bank[maps[:, None], rng.choice(COMPOSITIONS_PER_MAP, size=(n_games, 2), p=popularity)]
+
+    # 13 rounds to the winner, overtime is won by 2
+    loser_rounds = rng.choice(12, size=n_games, p=_loser_round_rates())
+    overtime = rng.random(n_games) < 0.08
+    loser_rounds = np.where(overtime, 12 + rng.geometric(0.5, size=n_games) - 1, loser_rounds)
+    winner_rounds = np.where(overtime, loser_rounds + 2, 13)
+    team_a_wins = rng.random(n_games) < 0.5
+    scores = np.stack([np.where(team_a_wins, winner_rounds, loser_rounds), np.where(team_a_wins, loser_rounds, winner_rounds)], axis=1)
+
+    # Rounds played on each side, the first 12 on one side and the rest on the other
+    total_rounds = scores.sum(axis=1)
+    side_rounds = np.stack([np.minimum(total_rounds, 12), np.maximum(total_rounds - 12, 1)], axis=1)
+    stats = _player_stats(rng, comps, side_rounds, scores)
+
+    # Python ints and strings, formatting numpy scalars one by one is several times slower
+    stats = stats.reshape(n_games, 2, 5, -1).tolist()
+    teams, scores, comps = teams.tolist(), scores.tolist(), comps.tolist()
+
+    lines = []
+    for g in range(n_games):
+        team_lines = []
+        for t in range(2):
+            team = teams[g][t]
+            players = ", ".join(
+                PLAYER_TEMPLATE.format(f"P{team:05d}{p}", f"T{team:05d}", ALL_AGENTS[comps[g][t][p]], *stats[g][t][p])
+                for p in range(5)
+            )
+            team_lines.append(f'{{"team": "Team {team:05d}", "score": "{scores[g][t]}", "players": [{players}]}}')
+        lines.append(
+            f'{{"match_id": "{match_ids[g]}", "game_id": "{10000 + game_index[g]}", "map_name": "{ALL_MAPS[maps[g]]}", '
+            f'"team_a": {team_lines[0]}, "team_b": {team_lines[1]}}}\n'
+        )
+    return "".join(lines).encode("utf-8")
+
+def generate_corpus(path: str, n_games: int, seed: int = 42, workers: int = 1, n_teams: int = None) -> None:
+    """Writes n_games synthetic games to a jsonl file, generated CHUNK_SIZE games at a time by worker processes"""
+    n_teams = n_teams or max(20, n_games // 100)
+    chunks = [(chunk, min(CHUNK_SIZE, n_games - start), seed, n_teams) for chunk, start in enumerate(range(0, n_games, CHUNK_SIZE))]
+
+    with open(path, "wb") as f:
+        if workers <= 1:
+            for chunk in chunks:
+                f.write(generate_chunk(*chunk))
+        else:
+            with mp.get_context("spawn").Pool(workers) as pool:
+                for content in pool.imap(_generate_chunk, chunks):
+                    f.write(content)
+
+def _generate_chunk(args: tuple) -> bytes:
+    return generate_chunk(*args)
+
+def _loser_round_rates() -> np.ndarray:
+    # Close games are more common than stomps
+    rates = np.array([0.5, 1, 2, 3, 4.5, 6, 7.5, 8.5, 9.5, 10, 10, 9.5])
+    return rates / rates.sum()
+
+STAT_NAMES = ["acs", "kills", "deaths", "assists", "kast", "adr", "hs", "fk", "fd"]
+
+# A player line, formatted with the player, team and agent names then the atk and def value of every stat
+PLAYER_TEMPLATE = "{{{{\"player\": \"{{}}\", \"team\": \"{{}}\", \"agent\": \"{{}}\", {}}}}}".format(
+    ", ".join(f'"{name}": {{{{"atk": {{}}, "def": {{}}}}}}' for name in STAT_NAMES)
+)
+
+def _player_stats(rng: np.random.Generator, comps: np.ndarray, side_rounds: np.ndarray, scores: np.ndarray) -> np.ndarray:
+    """Returns int stats (n_games, 2, 5, len(STAT_NAMES), 2 sides)"""
+    agent_roles = { agent: role for role, agents in ROLES.items() for agent in agents }
+    role_rates = { name: np.array([ROLE_RATES[agent_roles[agent]][name] for agent in ALL_AGENTS]) for name in ("kills", "assists", "fk", "fd") }
+
+    # (n_games, 2 teams, 5 players, 2 sides)
+    shape = (*comps.shape, 2)
+    rounds = np.broadcast_to(side_rounds[:, None, None, :], shape).astype(np.float64)
+
+    # Players of the team that won more rounds kill more and die less
+    share = (scores / scores.sum(axis=1, keepdims=True))[:, :, None, None]
+    skill = rng.lognormal(0, 0.2, size=comps.shape)[..., None]
+
+    kills = rng.poisson(role_rates["kills"][comps][..., None] * rounds * skill * (0.6 + 0.8 * share))
+    deaths = np.minimum(rng.poisson(0.72 * rounds * (1.4 - 0.8 * share)), rounds.astype(np.int64))
+    assists = rng.poisson(role_rates["assists"][comps][..., None] * rounds * (0.6 + 0.8 * share))
+    fk = rng.poisson(role_rates["fk"][comps][..., None] * rounds * skill)
+    fd = rng.poisson(role_rates["fd"][comps][..., None] * rounds)
+
+    kills_per_round = kills / rounds
+    adr = np.clip(kills_per_round * 140 + rng.normal(25, 15, size=kills.shape), 10, 400)
+    acs = np.clip(adr * 1.05 + kills_per_round * 55 + rng.normal(0, 12, size=kills.shape), 20, 600)
+    kast = np.clip(rng.normal(72, 9, size=kills.shape) + 10 * (share - 0.5), 20, 100)
+    hs = np.clip(rng.normal(25, 7, size=kills.shape), 0, 80)
+
+    return np.rint(np.stack([acs, kills, deaths, assists, kast, adr, hs, fk, fd], axis=3)).astype(np.int64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic scraped compositions generator")
+    parser.add_argument("--games", "-n", default=10000, type=int, help="Number of games")
+    parser.add_argument("--outpath", "-o", default="data/synth.jsonl", type=str, help="Output .jsonl file")
+    parser.add_argument("--seed", default=42, type=int)
+    parser.add_argument("--workers", "-w", default=1, type=int, help="Number of generating processes")
+    parser.add_argument("--teams", default=None, type=int, help="Number of teams, one per 100 games by default")
+    args = parser.parse_args()
+
+    generate_corpus(args.outpath, args.games, args.seed, args.workers, args.teams)
+    print(f"Wrote {args.games} games to {args.outpath}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
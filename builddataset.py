@@ -0,0 +1,30 @@
+import time
+import argparse
+
+from training.jsonlreader import convert_jsonl
+from utils import metrics
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--inpath", "-i", default="data/comps.jsonl", type=str, help="Path of the scraped compositions file")
+    parser.add_argument("--outpath", "-o", default="data/comps.store", type=str, help="Directory of the output store")
+    parser.add_argument("--workers", "-w", default=1, type=int, help="Number of processes used to read the input file")
+    metrics.add_arguments(parser)
+
+def main(args: argparse.Namespace):
+    """Main function"""
+
+    print(f"Converting {args.inpath} to {args.outpath}")
+
+    with metrics.session("build-dataset", args.metrics_dir):
+        start = time.perf_counter()
+        with metrics.timer("dataset_stage_seconds", stage="convert"):
+            store = convert_jsonl(args.inpath, args.outpath, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        metrics.inc("dataset_rows", len(store), stage="convert")
+
+    print(f"Wrote {len(store)} team compositions from {len(store.teams)} teams in {elapsed:.2f} s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts scraped compositions into a memory-mapped binary store")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,42 @@
+"""Single entry point of every script, e.g.:
+
+    python cli.py scrape -o data/comps.jsonl --async
+    python cli.py build-dataset -i data/comps.jsonl -o data/comps.store
+    python cli.py train -i data/comps.store
+    python cli.py embed -m models/model.npz -i data/comps.store
+    python cli.py plot -s data/embeddings.store --map Fracture
+
+The scripts only import heavy dependencies (TensorFlow, sklearn, pandas...) inside their main, and only the
+script of the given command is imported, so startup and --help stay fast.
+"""
+import sys
+import argparse
+import importlib
+
+# Command -> (script module, description)
+COMMANDS = {
+    "scrape": ("scrapdata", "Scrapes team compositions from vlr.gg"),
+    "build-dataset": ("builddataset", "Converts scraped compositions into a memory-mapped binary store"),
+    "train": ("train", "Searches hyperparameters of the contextual autoencoder"),
+    "embed": ("embed", "Embeds every scraped composition with a trained model into a memory-mapped store"),
+    "export": ("exportmodel", "Exports a trained model to a .npz that runs with NumPy only"),
+    "recommend": ("recommend", "Builds or queries the table of 5th agent recommendations"),
+    "plot": ("main", "Plots the embeddings of a trained model"),
+}
+
+def main(argv: list[str] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if len(argv) > 0 else None
+
+    parser = argparse.ArgumentParser(description="VALORANT agent embeddings")
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="command")
+    for name, (module, description) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=description, description=description)
+        if name == command:
+            importlib.import_module(module).add_arguments(subparser)
+
+    args = parser.parse_args(argv)
+    importlib.import_module(COMMANDS[args.command][0]).main(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import time
+import argparse
+
+from inference.embeddingstore import EMBEDDING_DTYPES
+from inference.knnindex import METRICS, IVFIndex
+from utils import metrics
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--model", "-m", required=True, type=str, help="Path of the model checkpoint")
+    parser.add_argument("--inpath", "-i", default="data/comps.jsonl", type=str, help="Scraped compositions file or store")
+    parser.add_argument("--outpath", "-o", default="data/embeddings.store", type=str, help="Directory of the embedding store")
+    parser.add_argument("--dtype", default="float16", choices=EMBEDDING_DTYPES, help="dtype the embeddings are stored with")
+    parser.add_argument("--batch-size", default=8192, type=int, help="Number of examples per inference batch")
+    parser.add_argument("--index", default=None, type=str, help="Directory where an IVF nearest neighbour index of the store is built")
+    parser.add_argument("--index-lists", default=None, type=int, help="Number of clusters of the index, sqrt of the number of embeddings by default")
+    parser.add_argument("--index-metric", default="l2", choices=METRICS, help="Distance used by the index")
+    parser.add_argument("--rebuild", action="store_true", help="Replaces the store instead of appending the new compositions")
+    metrics.add_arguments(parser)
+
+def main(args: argparse.Namespace):
+    """Main function"""
+
+    # Imports TensorFlow
+    from inference.embedder import export_embeddings
+
+    with metrics.session("embed", args.metrics_dir):
+        print(f"Embedding {args.inpath} with {args.model} into {args.outpath}")
+
+        start = time.perf_counter()
+        with metrics.timer("embed_stage_seconds", stage="embed"):
+            store, n_new = export_embeddings(args.model, args.inpath, args.outpath, dtype=args.dtype, batch_size=args.batch_size, rebuild=args.rebuild)
+        elapsed = time.perf_counter() - start
+        metrics.inc("embed_rows", n_new)
+
+        print(f"Added {n_new} embeddings in {elapsed:.2f} s, the store has {len(store)} embeddings of model {store.model_hash[:12]}")
+
+        if args.index is not None and len(store) == 0:
+            print(f"The store is empty, no index was built in {args.index}")
+        elif args.index is not None:
+            start = time.perf_counter()
+            with metrics.timer("embed_stage_seconds", stage="index"):
+                index = IVFIndex.build(store.embeddings, n_lists=args.index_lists, metric=args.index_metric)
+            index.save(args.index, store=store)
+            elapsed = time.perf_counter() - start
+
+            print(f"Built an index with {index.n_lists} clusters in {args.index} in {elapsed:.2f} s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embeds every scraped composition with a trained model into a memory-mapped store")
+    add_arguments(parser)
+    main(parser.parse_args())
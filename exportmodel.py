@@ -0,0 +1,27 @@
+import time
+import argparse
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--model", "-m", required=True, type=str, help="Path of the model checkpoint")
+    parser.add_argument("--outpath", "-o", default=None, type=str, help="Path of the exported model, next to the checkpoint by default")
+    parser.add_argument("--atol", default=1e-4, type=float, help="Largest difference allowed between the outputs of both models")
+
+def main(args: argparse.Namespace):
+    """Main function"""
+
+    # Imports TensorFlow
+    from inference.numpyexport import export_numpy_model
+
+    outpath = args.outpath or f"{args.model.rstrip('/').removesuffix('.npz').removesuffix('.h5')}.numpy.npz"
+    print(f"Exporting {args.model} to {outpath}")
+
+    start = time.perf_counter()
+    numpy_model, error = export_numpy_model(args.model, outpath, atol=args.atol)
+    elapsed = time.perf_counter() - start
+
+    print(f"Exported {len(numpy_model.graph['ops'])} ops in {elapsed:.2f} s, largest difference with the Keras model is {error:.2e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exports a trained model to a .npz that runs with NumPy only")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,99 @@
+import os
+import hashlib
+import numpy as np
+import tensorflow as tf
+
+from inference.embeddingstore import EmbeddingStore
+from training.checkpointsaver import load_checkpoint, load_checkpoint_arrays
+from training.contextualmodel import model_input_encoding
+from training.datasetfactory import DatasetFactory
+from training.jsonlreader import open_compositions
+from utils.consts import ALL_AGENTS, ALL_MAPS
+
+def latent_encoder(model: tf.keras.Model) -> tf.keras.Model:
+    """Returns the part of a contextual autoencoder that outputs the embeddings"""
+    return tf.keras.models.Model(inputs=model.input, outputs=model.get_layer("latent").output)
+
+def checkpoint_hash(path: str) -> str:
+    """Returns the sha256 of a checkpoint file, or of every file of a checkpoint directory"""
+    digest = hashlib.sha256()
+    paths = [path]
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+
+    for file_path in paths:
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+def export_embeddings(
+    model_path: str,
+    comps_path: str,
+    store_path: str,
+    dtype: str = "float16",
+    block_size: int = 8192,
+    batch_size: int = 8192,
+    rebuild: bool = False,
+    ingest_workers: int = 1
+) -> tuple[EmbeddingStore, int]:
+    """Embeds every composition that is not in the store yet and returns the store and the number of new rows.
+
+    Compositions are read and embedded block_size at a time, each giving 5 rows (one per held out player).
+    A new store normalizes the stats like the training data of the checkpoint, with the mean and scale saved
+    in it, checkpoints saved without them fall back to a normalization fitted on comps_path. An existing store
+    is only appended to if it was built from the same checkpoint, and its stats normalization is reused so
+    old and new rows are comparable. rebuild starts a new store instead.
+    """
+    model = load_checkpoint(model_path)
+    model_hash = checkpoint_hash(model_path)
+    encoding = model_input_encoding(model)
+    encoder = latent_encoder(model)
+
+    comps = open_compositions(comps_path, workers=ingest_workers)
+    dataset_factory = DatasetFactory(comps_path)
+
+    if os.path.exists(os.path.join(store_path, "header.json")) and not rebuild:
+        store = EmbeddingStore.open(store_path)
+        if store.model_hash != model_hash:
+            raise ValueError(f"{store_path} holds embeddings of another checkpoint, rebuild it to embed with {model_path}")
+        if store.maps != ALL_MAPS or store.agents != ALL_AGENTS:
+            raise ValueError(f"{store_path} was built with other agents or maps than utils/consts.py, rebuild it")
+    else:
+        arrays = load_checkpoint_arrays(model_path)
+        if "stats_mean" in arrays and "stats_scale" in arrays:
+            stats_mean, stats_scale = arrays["stats_mean"], arrays["stats_scale"]
+        else:
+            print(f"{model_path} has no stats normalization, fitting one on {comps_path}")
+            scaler = dataset_factory.fit_stats_scaler(comps.stats, block_size)
+            stats_mean, stats_scale = scaler.mean_, scaler.scale_
+        latent_size = encoder.output_shape[-1]
+        store = EmbeddingStore.create(store_path, model_hash, latent_size, dtype, stats_mean, stats_scale)
+
+    # Compositions are keyed by match, game and team name, team codes differ between stores
+    done = store.keys()
+    match_ids = np.asarray(comps.columns["match_id"])
+    game_ids = np.asarray(comps.columns["game_id"])
+    teams = np.asarray(comps.teams, dtype=object)[np.asarray(comps.columns["team"])] if len(comps.teams) > 0 else np.array([], dtype=object)
+    rows = np.array([
+        i for i, key in enumerate(zip(match_ids.tolist(), game_ids.tolist(), teams.tolist()))
+        if key not in done
+    ], dtype=np.int64)
+
+    stats_mean, stats_scale = store.stats_mean, store.stats_scale
+    for start in range(0, len(rows), block_size):
+        block = rows[start : start + block_size]
+        inputs = dataset_factory.holdout_inputs(comps.agents[block], comps.maps[block], comps.stats[block], stats_mean, stats_scale, encoding)
+        embeddings = encoder.predict(list(inputs), batch_size=batch_size, verbose=0)
+
+        store.append(
+            embeddings,
+            np.repeat(match_ids[block], 5),
+            np.repeat(game_ids[block], 5),
+            np.repeat(teams[block], 5).tolist(),
+            np.tile(np.arange(5), len(block)),
+            np.repeat(comps.maps[block], 5),
+            np.asarray(comps.agents[block]).reshape(-1)
+        )
+
+    return store, 5 * len(rows)
@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import numpy as np
+
+from utils.consts import ALL_AGENTS, ALL_MAPS
+
+# Bump whenever the layout of the store changes, old stores must then be rebuilt
+FORMAT_VERSION = 2
+
+# dtype of each key column, the store holds one row per held out player of each team composition
+KEY_COLUMNS = {
+    "match_id": np.int64, # (n,)
+    "game_id": np.int64,  # (n,)
+    "team": np.int32,     # (n,) indices into the store "teams" list
+    "holdout": np.int8,   # (n,) position of the held out player in the composition
+    "map": np.int8,       # (n,) indices into the store "maps" list
+    "agent": np.int8,     # (n,) agent of the held out player, indices into the store "agents" list
+}
+
+EMBEDDING_DTYPES = ["float16", "float32"]
+
+class EmbeddingStore:
+    """Append-only store of the latent embeddings of a model, one raw binary file per column in a directory.
+
+    Columns are memory-mapped, so opening a store doesn't depend on its size. The header holds the number
+    of rows, the hash of the checkpoint the embeddings came from and the stats normalization they were
+    computed with, so new games can be appended later with exactly the same preprocessing. The header is
+    rewritten last on every append, anything after its row count is an append that didn't finish.
+    """
+
+    def __init__(self, path: str, header: dict, columns: dict[str, np.ndarray]):
+        self.path = path
+        self.header = header
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return self.header["n_rows"]
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self.columns["embeddings"]
+
+    @property
+    def model_hash(self) -> str:
+        return self.header["model_hash"]
+
+    @property
+    def teams(self) -> list[str]:
+        return self.header["teams"]
+
+    @property
+    def maps(self) -> list[str]:
+        return self.header["maps"]
+
+    @property
+    def agents(self) -> list[str]:
+        return self.header["agents"]
+
+    @property
+    def created_at(self) -> float | None:
+        """When the store was created, tells apart stores rebuilt in the same directory"""
+        return self.header.get("created_at")
+
+    @property
+    def stats_mean(self) -> np.ndarray:
+        return np.array(self.header["stats_mean"])
+
+    @property
+    def stats_scale(self) -> np.ndarray:
+        return np.array(self.header["stats_scale"])
+
+    @classmethod
+    def create(cls, path: str, model_hash: str, latent_size: int, dtype: str, stats_mean: np.ndarray, stats_scale: np.ndarray) -> "EmbeddingStore":
+        """Creates an empty store, replacing any store already in path"""
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unknown embedding dtype '{dtype}', expected one of {EMBEDDING_DTYPES}")
+
+        os.makedirs(path, exist_ok=True)
+        for name in ["embeddings", *KEY_COLUMNS]:
+            open(os.path.join(path, f"{name}.bin"), "wb").close()
+
+        header = {
+            "format_version": FORMAT_VERSION,
+            "n_rows": 0,
+            "created_at": time.time(),
+            "model_hash": model_hash,
+            "latent_size": latent_size,
+            "dtype": dtype,
+            "stats_mean": np.asarray(stats_mean).tolist(),
+            "stats_scale": np.asarray(stats_scale).tolist(),
+            "teams": [],
+            "maps": ALL_MAPS,
+            "agents": ALL_AGENTS,
+        }
+        _write_header(path, header)
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path: str) -> "EmbeddingStore":
+        """Opens a store, memory-mapping its columns"""
+        with open(os.path.join(path, "header.json"), "r", encoding="utf-8") as f:
+            header = json.load(f)
+
+        if header["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {header['format_version']} but {FORMAT_VERSION} is expected, rebuild it with embed.py")
+
+        n_rows = header["n_rows"]
+        columns = { "embeddings": _map_column(path, "embeddings", np.dtype(header["dtype"]), (n_rows, header["latent_size"])) }
+        for name, dtype in KEY_COLUMNS.items():
+            columns[name] = _map_column(path, name, np.dtype(dtype), (n_rows,))
+
+        return cls(path, header, columns)
+
+    def append(
+        self,
+        embeddings: np.ndarray,
+        match_ids: np.ndarray,
+        game_ids: np.ndarray,
+        teams: list[str],
+        holdouts: np.ndarray,
+        maps: np.ndarray,
+        agents: np.ndarray
+    ) -> None:
+        """Appends rows to the store, teams are given by name and maps / agents as codes of ALL_MAPS / ALL_AGENTS"""
+        team_codes = { team: i for i, team in enumerate(self.header["teams"]) }
+        new_columns = {
+            "embeddings": np.asarray(embeddings, dtype=self.header["dtype"]).reshape(-1, self.header["latent_size"]),
+            "match_id": match_ids,
+            "game_id": game_ids,
+            "team": [team_codes.setdefault(team, len(team_codes)) for team in teams],
+            "holdout": holdouts,
+            "map": maps,
+            "agent": agents,
+        }
+
+        n_new = new_columns["embeddings"].shape[0]
+        dtypes = { "embeddings": np.dtype(self.header["dtype"]), **KEY_COLUMNS }
+        for name, dtype in dtypes.items():
+            data = np.ascontiguousarray(new_columns[name], dtype=dtype)
+            if data.shape[0] != n_new:
+                raise ValueError(f"Column {name} has {data.shape[0]} rows but embeddings have {n_new}")
+
+            # Drops whatever an unfinished append left after the last committed row
+            with open(os.path.join(self.path, f"{name}.bin"), "r+b") as f:
+                f.truncate(len(self) * _row_bytes(dtype, self.header["latent_size"] if name == "embeddings" else None))
+                f.seek(0, os.SEEK_END)
+                f.write(data.tobytes())
+
+        self.header["n_rows"] += n_new
+        self.header["teams"] = list(team_codes)
+        _write_header(self.path, self.header)
+
+        reopened = EmbeddingStore.open(self.path)
+        self.header, self.columns = reopened.header, reopened.columns
+
+    def keys(self) -> set[tuple[int, int, str]]:
+        """Returns the (match_id, game_id, team) of every composition in the store"""
+        teams = self.header["teams"]
+        return {
+            (match_id, game_id, teams[team])
+            for match_id, game_id, team in zip(self.columns["match_id"].tolist(), self.columns["game_id"].tolist(), self.columns["team"].tolist())
+        }
+
+    def meta(self, rows: np.ndarray = None) -> list[dict]:
+        """Returns the metadata of the given rows (all by default)"""
+        rows = slice(None) if rows is None else rows
+        match_ids = self.columns["match_id"][rows].tolist()
+        game_ids = self.columns["game_id"][rows].tolist()
+        teams = self.columns["team"][rows].tolist()
+        holdouts = self.columns["holdout"][rows].tolist()
+        maps = self.columns["map"][rows].tolist()
+        agents = self.columns["agent"][rows].tolist()
+
+        return [
+            {
+                "match_id": str(match_id),
+                "game_id": str(game_id),
+                "team": self.teams[team],
+                "holdout": holdout,
+                "map": self.maps[map_code],
+                "agent": self.agents[agent],
+            }
+            for match_id, game_id, team, holdout, map_code, agent in zip(match_ids, game_ids, teams, holdouts, maps, agents)
+        ]
+
+def _map_column(path: str, name: str, dtype: np.dtype, shape: tuple) -> np.ndarray:
+    # np.memmap can't map empty files
+    if shape[0] == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(os.path.join(path, f"{name}.bin"), dtype=dtype, mode="r", shape=shape)
+
+def _row_bytes(dtype, width: int = None) -> int:
+    return np.dtype(dtype).itemsize * (width or 1)
+
+def _write_header(path: str, header: dict) -> None:
+    tmp_path = os.path.join(path, "header.json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(header, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(path, "header.json"))
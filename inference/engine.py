@@ -0,0 +1,229 @@
+import time
+import queue
+import threading
+import collections
+import concurrent.futures
+from dataclasses import dataclass
+
+import numpy as np
+import tensorflow as tf
+
+from inference.embedder import checkpoint_hash
+from inference.embeddingstore import EmbeddingStore
+from training.checkpointsaver import load_checkpoint
+from training.contextualmodel import model_input_encoding
+from utils.consts import ALL_STATS, MODEL_AGENTS, MODEL_MAPS
+
+@dataclass
+class EngineResult:
+    # Latent embedding, probability of each agent being the missing one and its predicted raw stats
+    embedding: np.ndarray
+    agent_probabilities: dict[str, float]
+    stats: np.ndarray
+
+class EmbeddingEngine:
+    """Answers "what is this composition missing" queries with a model loaded once.
+
+    The encoder and both heads run in a single tf.function with a fixed input signature, so it's
+    traced once. Concurrent `query` calls are merged into micro-batches, a batch runs as soon as it
+    has max_batch_size queries or max_delay seconds after its first query. Results are kept in an
+    LRU cache keyed on the canonical form of the query: players sorted by agent and stats rounded
+    to stats_decimals, which is also what the model is fed so cached and fresh results are the same.
+
+    Stats of a player are the 2 * len(ALL_STATS) raw values [atk, def] of every stat of ALL_STATS,
+    normalized with stats_mean and stats_scale (the normalization the model was trained with).
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        stats_mean: np.ndarray,
+        stats_scale: np.ndarray,
+        max_batch_size: int = 64,
+        max_delay: float = 0.002,
+        cache_size: int = 4096,
+        stats_decimals: int = 2
+    ):
+        self.model_path = model_path
+        self.stats_mean = np.asarray(stats_mean, dtype=np.float32)
+        self.stats_scale = np.asarray(stats_scale, dtype=np.float32)
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.cache_size = cache_size
+        self.stats_decimals = stats_decimals
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self._agent_codes = { agent: i for i, agent in enumerate(MODEL_AGENTS) }
+        self._map_codes = { map_name: i for i, map_name in enumerate(MODEL_MAPS) }
+        self._n_stats = 2 * len(ALL_STATS)
+
+        self._cache = collections.OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread: threading.Thread = None
+        self._thread_lock = threading.Lock()
+
+        self._infer = self._compile(load_checkpoint(model_path))
+
+    @classmethod
+    def from_store(cls, model_path: str, store_path: str, **kwargs) -> "EmbeddingEngine":
+        """Creates an engine with the stats normalization of an embedding store built from the same checkpoint"""
+        store = EmbeddingStore.open(store_path)
+        if store.model_hash != checkpoint_hash(model_path):
+            raise ValueError(f"{store_path} holds embeddings of another checkpoint than {model_path}")
+        return cls(model_path, store.stats_mean, store.stats_scale, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        """Stops the batching thread, queries still pending are answered first"""
+        with self._thread_lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def query(self, agents: list[str], map_name: str, stats: np.ndarray) -> EngineResult:
+        """Returns the outputs of the model for a 4 player composition, waiting for it to run in a micro-batch"""
+        key, inputs = self._canonicalize(agents, map_name, stats)
+        result = self._cache_get(key)
+        if result is not None:
+            return result
+
+        self._start()
+        future = concurrent.futures.Future()
+        self._queue.put((key, inputs, future))
+        return future.result()
+
+    def query_batch(self, agents: list[list[str]], maps: list[str], stats: np.ndarray) -> list[EngineResult]:
+        """Returns the outputs of the model for many compositions at once, without going through the batching thread"""
+        canonical = [self._canonicalize(*query) for query in zip(agents, maps, stats)]
+        results = [self._cache_get(key) for key, _ in canonical]
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if len(missing) > 0:
+            computed = self._run_batch([canonical[i][1] for i in missing])
+            for i, result in zip(missing, computed):
+                self._cache_put(canonical[i][0], result)
+                results[i] = result
+        return results
+
+    def _compile(self, model: tf.keras.Model):
+        outputs_model = tf.keras.models.Model(inputs=model.input, outputs=[model.get_layer("latent").output, *model.outputs])
+        onehot = model_input_encoding(model) == "onehot"
+        n_agents, n_maps = len(MODEL_AGENTS), len(MODEL_MAPS)
+
+        @tf.function(input_signature=(
+            tf.TensorSpec(shape=(None, 4), dtype=tf.int32),
+            tf.TensorSpec(shape=(None,), dtype=tf.int32),
+            tf.TensorSpec(shape=(None, 4, self._n_stats), dtype=tf.float32),
+        ))
+        def infer(agents, maps, stats):
+            if onehot:
+                agents = tf.one_hot(agents, n_agents)
+                maps = tf.one_hot(maps, n_maps)
+            return outputs_model([agents, maps, stats], training=False)
+
+        # Traced here so the first query doesn't pay for it
+        infer(np.zeros((1, 4), dtype=np.int32), np.zeros(1, dtype=np.int32), np.zeros((1, 4, self._n_stats), dtype=np.float32))
+        return infer
+
+    def _canonicalize(self, agents: list[str], map_name: str, stats: np.ndarray) -> tuple[tuple, tuple]:
+        """Returns the cache key of a query and its model inputs"""
+        try:
+            agent_codes = [self._agent_codes[agent] for agent in agents]
+            map_code = self._map_codes[map_name]
+        except KeyError as e:
+            raise ValueError(f"Unknown agent or map {e}") from e
+
+        stats = np.round(np.asarray(stats, dtype=np.float64).reshape(4, self._n_stats), self.stats_decimals)
+        order = sorted(range(4), key=lambda i: (agent_codes[i], tuple(stats[i])))
+        agent_codes = [agent_codes[i] for i in order]
+        stats = stats[order]
+
+        key = (tuple(agent_codes), map_code, stats.tobytes())
+        inputs = (agent_codes, map_code, ((stats - self.stats_mean) / self.stats_scale).astype(np.float32))
+        return key, inputs
+
+    def _run_batch(self, inputs: list[tuple]) -> list[EngineResult]:
+        agents = np.array([agent_codes for agent_codes, _, _ in inputs], dtype=np.int32)
+        maps = np.array([map_code for _, map_code, _ in inputs], dtype=np.int32)
+        stats = np.stack([player_stats for _, _, player_stats in inputs])
+
+        embeddings, agent_probabilities, predicted_stats = (output.numpy() for output in self._infer(agents, maps, stats))
+        return [
+            EngineResult(
+                embedding=embeddings[i],
+                agent_probabilities=dict(zip(MODEL_AGENTS, agent_probabilities[i].tolist())),
+                stats=predicted_stats[i] * self.stats_scale + self.stats_mean
+            )
+            for i in range(len(inputs))
+        ]
+
+    def _start(self) -> None:
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="EmbeddingEngine", daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            # Waits for more queries until the batch is full or the deadline of its first query
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            # The same composition may be asked more than once in a batch
+            unique = {}
+            for key, inputs, _ in batch:
+                unique.setdefault(key, inputs)
+
+            try:
+                results = dict(zip(unique, self._run_batch(list(unique.values()))))
+            except Exception as e: # pylint: disable=broad-except
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for key, result in results.items():
+                self._cache_put(key, result)
+            for key, _, future in batch:
+                future.set_result(results[key])
+
+    def _cache_get(self, key: tuple) -> EngineResult | None:
+        with self._cache_lock:
+            result = self._cache.get(key)
+            if result is None:
+                self.cache_misses += 1
+                return None
+
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return result
+
+    def _cache_put(self, key: tuple, result: EngineResult) -> None:
+        with self._cache_lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
@@ -0,0 +1,262 @@
+import os
+import json
+import numpy as np
+
+from inference.embeddingstore import EmbeddingStore
+
+# Bump whenever the layout of a saved index changes, old indexes must then be rebuilt
+FORMAT_VERSION = 1
+
+METRICS = ["l2", "cosine"]
+
+def exact_search(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    metric: str = "l2",
+    mask: np.ndarray = None,
+    block_size: int = 65536
+) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the distances and row indices (both (n_queries, k), best first) of the k nearest vectors of each query.
+
+    vectors are read block_size rows at a time, so they can be memory-mapped. Rows where mask is False
+    are never returned, missing neighbours have index -1 and distance inf.
+    """
+    queries = _prepare(queries, metric)
+    best_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+    best_indices = np.full((len(queries), k), -1, dtype=np.int64)
+
+    for start in range(0, len(vectors), block_size):
+        block = _prepare(vectors[start : start + block_size], metric)
+        distances = _squared_distances(queries, block)
+        if mask is not None:
+            distances[:, ~np.asarray(mask[start : start + block_size], dtype=bool)] = np.inf
+
+        indices = np.broadcast_to(np.arange(start, start + len(block)), distances.shape)
+        best_distances, best_indices = _merge_top_k(best_distances, best_indices, distances, indices, k)
+
+    return _finish(best_distances, best_indices, metric)
+
+class IVFIndex:
+    """Inverted file index, vectors are clustered with k-means and a query only scans the nprobe closest clusters.
+
+    More probes means better recall and slower queries, nprobe = n_lists is the same as an exact search.
+    Vectors are kept grouped by cluster so every probe reads a contiguous slice.
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, row_ids: np.ndarray, vectors: np.ndarray, metric: str, header: dict = None):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.row_ids = row_ids
+        self.vectors = vectors
+        self.metric = metric
+        self.header = header or {}
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self.row_ids)
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        n_lists: int = None,
+        metric: str = "l2",
+        n_iterations: int = 10,
+        sample_size: int = 64,
+        block_size: int = 65536,
+        seed: int = 42
+    ) -> "IVFIndex":
+        """Builds an index with n_lists clusters (sqrt of the number of rows by default), at most one per row.
+
+        k-means is trained on at most sample_size points per cluster, then every vector is assigned to its closest centroid.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}")
+
+        n_rows = len(vectors)
+        if n_rows == 0:
+            raise ValueError("Can't build an index without vectors")
+
+        # A cluster needs at least one row to start from
+        n_lists = min(n_lists or max(1, int(np.sqrt(n_rows))), n_rows)
+        rng = np.random.default_rng(seed)
+
+        sample_rows = np.sort(rng.choice(n_rows, size=min(n_rows, n_lists * sample_size), replace=False))
+        sample = _prepare(vectors[sample_rows], metric)
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+        for _ in range(n_iterations):
+            assignments = _assign(sample, centroids, block_size)
+            sums = np.stack([np.bincount(assignments, weights=sample[:, j], minlength=n_lists) for j in range(sample.shape[1])], axis=1)
+            counts = np.bincount(assignments, minlength=n_lists)
+
+            # Empty clusters are restarted on random points
+            empty = counts == 0
+            centroids = np.where(empty[:, None], sample[rng.choice(len(sample), size=n_lists)], sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+
+        assignments = np.concatenate([
+            _assign(_prepare(vectors[start : start + block_size], metric), centroids, block_size)
+            for start in range(0, n_rows, block_size)
+        ])
+
+        row_ids = np.argsort(assignments, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))])
+        grouped = np.empty((n_rows, centroids.shape[1]), dtype=np.float32)
+        for start in range(0, n_rows, block_size):
+            grouped[start : start + block_size] = _prepare(vectors[row_ids[start : start + block_size]], metric)
+
+        return cls(centroids, offsets, row_ids, grouped, metric)
+
+    def search(self, queries: np.ndarray, k: int = 10, nprobe: int = 8, mask: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        """Same as `exact_search`, but only scanning the nprobe clusters closest to each query"""
+        queries = _prepare(queries, self.metric)
+        nprobe = min(nprobe, self.n_lists)
+        probes = np.argpartition(_squared_distances(queries, self.centroids), nprobe - 1, axis=1)[:, :nprobe]
+
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, query in enumerate(queries):
+            slices = [slice(self.offsets[probe], self.offsets[probe + 1]) for probe in probes[i]]
+            candidates = np.concatenate([self.row_ids[s] for s in slices])
+            candidate_vectors = np.concatenate([self.vectors[s] for s in slices])
+
+            if mask is not None:
+                keep = np.asarray(mask, dtype=bool)[candidates]
+                candidates, candidate_vectors = candidates[keep], candidate_vectors[keep]
+
+            candidate_distances = _squared_distances(query[None, :], candidate_vectors)
+            distances[i : i + 1], indices[i : i + 1] = _merge_top_k(distances[i : i + 1], indices[i : i + 1], candidate_distances, candidates[None, :], k)
+
+        return _finish(distances, indices, self.metric)
+
+    def save(self, path: str, store: EmbeddingStore = None) -> None:
+        """Saves the index to a directory, tagged with the store it was built from if given"""
+        os.makedirs(path, exist_ok=True)
+        for name in ("centroids", "offsets", "row_ids", "vectors"):
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+
+        self.header = {
+            "format_version": FORMAT_VERSION,
+            "metric": self.metric,
+            "n_lists": self.n_lists,
+            "n_rows": len(self),
+            "model_hash": store.model_hash if store is not None else None,
+        }
+
+        # The header goes last so an index is never readable while half written
+        with open(os.path.join(path, "header.json"), "w", encoding="utf-8") as f:
+            json.dump(self.header, f)
+
+    @classmethod
+    def load(cls, path: str, store: EmbeddingStore = None, mmap: bool = True) -> "IVFIndex":
+        """Loads a saved index, checking it was built from the given store"""
+        with open(os.path.join(path, "header.json"), "r", encoding="utf-8") as f:
+            header = json.load(f)
+
+        if header["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {header['format_version']} but {FORMAT_VERSION} is expected, rebuild it")
+
+        if store is not None and (header["model_hash"] != store.model_hash or header["n_rows"] != len(store)):
+            raise ValueError(f"{path} was not built from the current {store.path}, rebuild it")
+
+        mmap_mode = "r" if mmap else None
+        arrays = { name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ("centroids", "offsets", "row_ids", "vectors") }
+        return cls(metric=header["metric"], header=header, **arrays)
+
+class EmbeddingSearch:
+    """k-NN queries over the embeddings of a store, filtered by its metadata.
+
+    Searches are exact unless an IVF index built from the store is given.
+    """
+
+    def __init__(self, store: EmbeddingStore, index: IVFIndex = None, metric: str = "l2"):
+        self.store = store
+        self.index = index
+        self.metric = index.metric if index is not None else metric
+
+    @classmethod
+    def open(cls, store_path: str, index_path: str = None, metric: str = "l2") -> "EmbeddingSearch":
+        store = EmbeddingStore.open(store_path)
+        index = IVFIndex.load(index_path, store=store) if index_path is not None else None
+        return cls(store, index, metric)
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int = 10,
+        maps: list[str] = None,
+        teams: list[str] = None,
+        agents: list[str] = None,
+        nprobe: int = 8
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the distances and store rows of the k nearest embeddings of each query"""
+        mask = metadata_mask(self.store, maps, teams, agents)
+        queries = np.atleast_2d(queries)
+        if self.index is None:
+            return exact_search(self.store.embeddings, queries, k, self.metric, mask)
+        return self.index.search(queries, k, nprobe, mask)
+
+    def neighbours(self, query: np.ndarray, k: int = 10, **filters) -> list[dict]:
+        """Returns the metadata and distance of the k nearest neighbours of a single embedding"""
+        distances, rows = self.search(query, k, **filters)
+        found = rows[0] >= 0
+        return [
+            { **meta, "row": int(row), "distance": float(distance) }
+            for meta, row, distance in zip(self.store.meta(rows[0][found]), rows[0][found], distances[0][found])
+        ]
+
+def metadata_mask(store: EmbeddingStore, maps: list[str] = None, teams: list[str] = None, agents: list[str] = None) -> np.ndarray | None:
+    """Returns the rows of a store played on one of the maps, by one of the teams and with one of the held out agents"""
+    mask = None
+    for column, names, known in (("map", maps, store.maps), ("team", teams, store.teams), ("agent", agents, store.agents)):
+        if names is None:
+            continue
+
+        codes = [known.index(name) for name in names if name in known]
+        column_mask = np.isin(store.columns[column], codes)
+        mask = column_mask if mask is None else mask & column_mask
+    return mask
+
+def _prepare(vectors: np.ndarray, metric: str) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if metric == "cosine":
+        # Squared l2 distances between unit vectors rank the same as cosine distances
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+    return vectors
+
+def _squared_distances(queries: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    distances = -2 * queries @ vectors.T
+    distances += np.einsum("ij,ij->i", queries, queries)[:, None]
+    distances += np.einsum("ij,ij->i", vectors, vectors)[None, :]
+    return np.maximum(distances, 0)
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, block_size: int) -> np.ndarray:
+    return np.concatenate([
+        np.argmin(_squared_distances(vectors[start : start + block_size], centroids), axis=1)
+        for start in range(0, len(vectors), block_size)
+    ])
+
+def _merge_top_k(best_distances, best_indices, distances, indices, k: int):
+    """Merges new candidates into the running (unsorted) top k of each query"""
+    if distances.shape[1] > k:
+        top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        distances = np.take_along_axis(distances, top, axis=1)
+        indices = np.take_along_axis(indices, top, axis=1)
+
+    distances = np.concatenate([best_distances, distances], axis=1)
+    indices = np.concatenate([best_indices, indices], axis=1)
+    top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(distances, top, axis=1), np.take_along_axis(indices, top, axis=1)
+
+def _finish(distances: np.ndarray, indices: np.ndarray, metric: str) -> tuple[np.ndarray, np.ndarray]:
+    order = np.argsort(distances, axis=1, kind="stable")
+    distances = np.take_along_axis(distances, order, axis=1)
+    indices = np.take_along_axis(indices, order, axis=1)
+    indices[np.isinf(distances)] = -1
+
+    # Squared l2 distances between unit vectors are 2 * cosine distances
+    distances = distances / 2 if metric == "cosine" else np.sqrt(distances)
+    return distances, indices
@@ -0,0 +1,150 @@
+import numpy as np
+import tensorflow as tf
+
+from inference.embedder import checkpoint_hash, latent_encoder
+from inference.numpymodel import ACTIVATIONS, FORMAT_VERSION, NumpyModel
+from training.checkpointsaver import load_checkpoint
+from training.contextualmodel import model_input_encoding
+
+def export_numpy_model(model_path: str, out_path: str, atol: float = 1e-4, n_parity: int = 1024, seed: int = 0) -> tuple[NumpyModel, float]:
+    """Exports a trained contextual autoencoder to a NumPy model file, see `to_numpy_model`"""
+    numpy_model, error = to_numpy_model(model_path, atol, n_parity, seed)
+    numpy_model.save(out_path)
+    return numpy_model, error
+
+def to_numpy_model(model_path: str, atol: float = 1e-4, n_parity: int = 1024, seed: int = 0) -> tuple[NumpyModel, float]:
+    """Converts a trained contextual autoencoder to a NumPy model and returns it with its largest parity error.
+
+    Dropout layers are dropped and every BatchNormalization is folded into the Dense layer that consumes
+    it. The model applies BatchNormalization after the activation, so it can't go into the Dense layer
+    before it, but it is an affine map of the input of the next one: W (x * s + t) + b = (s W) x + (t W + b).
+    The export fails with a ValueError if the outputs or the embeddings differ by more than atol from the
+    Keras model on n_parity random inputs.
+    """
+    model = load_checkpoint(model_path)
+    graph, arrays = _convert(model)
+    graph["model_hash"] = checkpoint_hash(model_path)
+    numpy_model = NumpyModel(graph, arrays)
+
+    error = parity_error(model, numpy_model, n_parity, seed)
+    if error > atol:
+        raise ValueError(f"NumPy model of {model_path} differs from it by {error:.2e}, more than {atol:.2e}")
+    return numpy_model, error
+
+def parity_error(model: tf.keras.Model, numpy_model: NumpyModel, n_examples: int = 1024, seed: int = 0) -> float:
+    """Returns the largest absolute difference between the outputs and embeddings of both models on random inputs"""
+    rng = np.random.default_rng(seed)
+    agents_shape, maps_shape, stats_shape = (tuple(x.shape[1:]) for x in model.inputs)
+    if model_input_encoding(model) == "index":
+        n_agents, n_maps = model.get_layer("agent_onehot").input_dim, model.get_layer("map_onehot").input_dim
+        agents = rng.integers(0, n_agents, size=(n_examples, *agents_shape)).astype(np.int32)
+        maps = rng.integers(0, n_maps, size=n_examples).astype(np.int32)
+    else:
+        agents = np.eye(agents_shape[-1], dtype=np.float32)[rng.integers(0, agents_shape[-1], size=(n_examples, *agents_shape[:-1]))]
+        maps = np.eye(maps_shape[-1], dtype=np.float32)[rng.integers(0, maps_shape[-1], size=n_examples)]
+    stats = rng.normal(size=(n_examples, *stats_shape)).astype(np.float32)
+
+    inputs = [agents, maps, stats]
+    expected = [*model.predict(inputs, verbose=0), latent_encoder(model).predict(inputs, verbose=0)]
+    found = [*numpy_model.predict(inputs), numpy_model.encode(inputs)]
+    return float(max(np.max(np.abs(a - b)) for a, b in zip(expected, found)))
+
+def _convert(model: tf.keras.Model) -> tuple[dict, dict[str, np.ndarray]]:
+    ops, arrays = [], {}
+
+    # Tensors are kept as (name, scale, shift), scale and shift being a pending affine map of the
+    # last axis that is folded into the next Dense layer, or None
+    tensors = {}
+
+    def materialize(name):
+        source, scale, shift = tensors[name]
+        if scale is None:
+            return source
+
+        arrays[f"{name}/scale"], arrays[f"{name}/shift"] = scale, shift
+        ops.append({ "kind": "affine", "inputs": [source], "output": name, "params": { "scale": f"{name}/scale", "shift": f"{name}/shift" } })
+        tensors[name] = (name, None, None)
+        return name
+
+    # Layers are in topological order, the layers feeding each one are found from its input tensors
+    for layer in model.layers:
+        name, class_name = layer.name, type(layer).__name__
+
+        if class_name == "InputLayer":
+            tensors[name] = (name, None, None)
+            continue
+        inputs = _source_layers(layer.input)
+
+        if class_name == "Dropout":
+            tensors[name] = tensors[inputs[0]]
+
+        elif class_name == "BatchNormalization":
+            source, scale, shift = tensors[inputs[0]]
+            weights = layer.get_weights()
+            gamma = weights.pop(0) if layer.scale else 1.0
+            beta = weights.pop(0) if layer.center else 0.0
+            moving_mean, moving_variance = weights
+
+            bn_scale = (gamma / np.sqrt(moving_variance + layer.epsilon)).astype(np.float32)
+            bn_shift = (beta - moving_mean * bn_scale).astype(np.float32)
+            if scale is None:
+                tensors[name] = (source, bn_scale, bn_shift)
+            else:
+                tensors[name] = (source, scale * bn_scale, shift * bn_scale + bn_shift)
+
+        elif class_name == "Dense":
+            activation = tf.keras.activations.serialize(layer.activation)
+            if activation not in ACTIVATIONS:
+                raise ValueError(f"Activation '{activation}' of layer {name} has no NumPy implementation")
+
+            source, scale, shift = tensors[inputs[0]]
+            kernel, bias = layer.get_weights() if layer.use_bias else (layer.get_weights()[0], np.zeros(layer.units, dtype=np.float32))
+            if scale is not None:
+                bias = shift @ kernel + bias
+                kernel = scale[:, None] * kernel
+
+            arrays[f"{name}/kernel"], arrays[f"{name}/bias"] = kernel.astype(np.float32), bias.astype(np.float32)
+            ops.append({ "kind": "dense", "inputs": [source], "output": name, "params": { "kernel": f"{name}/kernel", "bias": f"{name}/bias", "activation": activation } })
+            tensors[name] = (name, None, None)
+
+        elif class_name == "Concatenate":
+            if layer.axis not in (-1, 1):
+                raise ValueError(f"Layer {name} doesn't concatenate on the last axis")
+
+            parts = [tensors[part] for part in inputs]
+            ops.append({ "kind": "concatenate", "inputs": [source for source, _, _ in parts], "output": name })
+            if all(scale is None for _, scale, _ in parts):
+                tensors[name] = (name, None, None)
+            else:
+                sizes = [model.get_layer(part).output.shape[-1] for part in inputs]
+                scale = np.concatenate([part_scale if part_scale is not None else np.ones(size, dtype=np.float32) for (_, part_scale, _), size in zip(parts, sizes)])
+                shift = np.concatenate([part_shift if part_shift is not None else np.zeros(size, dtype=np.float32) for (_, _, part_shift), size in zip(parts, sizes)])
+                tensors[name] = (name, scale, shift)
+
+        elif class_name == "Flatten":
+            ops.append({ "kind": "flatten", "inputs": [materialize(inputs[0])], "output": name })
+            tensors[name] = (name, None, None)
+
+        elif class_name == "Embedding":
+            arrays[f"{name}/table"] = layer.get_weights()[0].astype(np.float32)
+            ops.append({ "kind": "gather", "inputs": [materialize(inputs[0])], "output": name, "params": { "table": f"{name}/table" } })
+            tensors[name] = (name, None, None)
+
+        else:
+            raise ValueError(f"Layer {name} of type {class_name} has no NumPy implementation")
+
+    outputs = [materialize(output) for output in _source_layers(model.outputs)]
+    if "latent" in tensors:
+        materialize("latent")
+
+    return {
+        "format_version": FORMAT_VERSION,
+        "input_encoding": model_input_encoding(model),
+        "inputs": _source_layers(model.inputs),
+        "outputs": outputs,
+        "ops": ops,
+    }, arrays
+
+def _source_layers(tensors) -> list[str]:
+    """Returns the names of the layers that output the given tensors, the Keras history has the same layout in Keras 2 and 3"""
+    return [tensor._keras_history[0].name for tensor in tf.nest.flatten(tensors)] # pylint: disable=protected-access
@@ -0,0 +1,94 @@
+import json
+import numpy as np
+
+# Bump whenever the layout of an exported model changes, old exports must then be redone
+FORMAT_VERSION = 1
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+    "tanh": np.tanh,
+    "softmax": lambda x: _softmax(x),
+}
+
+class NumpyModel:
+    """A contextual autoencoder exported by `inference.numpyexport`, run with NumPy only.
+
+    The model is a list of ops over named tensors, evaluated in order. Inputs are the same as the
+    Keras model: [agents, maps, stats], either one-hot or index encoded like the model was built with.
+    """
+
+    def __init__(self, graph: dict, arrays: dict[str, np.ndarray]):
+        self.graph = graph
+        self.arrays = arrays
+
+    @classmethod
+    def load(cls, path: str) -> "NumpyModel":
+        with np.load(path) as data:
+            graph = json.loads(str(data["graph"]))
+            arrays = { name: data[name] for name in data.files if name != "graph" }
+
+        if graph["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {graph['format_version']} but {FORMAT_VERSION} is expected, export it again")
+        return cls(graph, arrays)
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez(f, graph=np.array(json.dumps(self.graph)), **self.arrays)
+
+    @property
+    def input_encoding(self) -> str:
+        return self.graph["input_encoding"]
+
+    @property
+    def model_hash(self) -> str:
+        """Hash of the checkpoint this model was exported from"""
+        return self.graph["model_hash"]
+
+    def predict(self, inputs: list[np.ndarray], batch_size: int = 8192) -> list[np.ndarray]:
+        """Returns the [agent, stat] outputs of the model"""
+        return self._run_batched(inputs, self.graph["outputs"], batch_size)
+
+    def encode(self, inputs: list[np.ndarray], batch_size: int = 8192) -> np.ndarray:
+        """Returns the output of the latent layer"""
+        return self._run_batched(inputs, ["latent"], batch_size)[0]
+
+    def run(self, inputs: list[np.ndarray], outputs: list[str]) -> list[np.ndarray]:
+        """Evaluates the named tensors for a batch of inputs, only running the ops they depend on"""
+        tensors = dict(zip(self.graph["inputs"], inputs))
+        needed = set(outputs)
+        for op in reversed(self.graph["ops"]):
+            if op["output"] in needed:
+                needed.update(op["inputs"])
+
+        for op in self.graph["ops"]:
+            if op["output"] in needed:
+                tensors[op["output"]] = self._run_op(op, [tensors[name] for name in op["inputs"]])
+        return [tensors[name] for name in outputs]
+
+    def _run_batched(self, inputs: list[np.ndarray], outputs: list[str], batch_size: int) -> list[np.ndarray]:
+        inputs = [np.asarray(x) for x in inputs]
+        batches = [self.run([x[start : start + batch_size] for x in inputs], outputs) for start in range(0, len(inputs[0]), batch_size)]
+        if len(batches) == 0:
+            batches = [self.run(inputs, outputs)]
+        return [np.concatenate(parts) for parts in zip(*batches)]
+
+    def _run_op(self, op: dict, inputs: list[np.ndarray]) -> np.ndarray:
+        kind, params = op["kind"], op.get("params", {})
+        if kind == "dense":
+            x = inputs[0].astype(np.float32, copy=False) @ self.arrays[params["kernel"]] + self.arrays[params["bias"]]
+            return ACTIVATIONS[params["activation"]](x)
+        if kind == "affine":
+            return inputs[0] * self.arrays[params["scale"]] + self.arrays[params["shift"]]
+        if kind == "gather":
+            return self.arrays[params["table"]][inputs[0].astype(np.int64)]
+        if kind == "flatten":
+            return inputs[0].reshape(len(inputs[0]), -1)
+        if kind == "concatenate":
+            return np.concatenate(inputs, axis=-1)
+        raise ValueError(f"Unknown op '{kind}'")
+
+def _softmax(x: np.ndarray) -> np.ndarray:
+    x = np.exp(x - x.max(axis=-1, keepdims=True))
+    return x / x.sum(axis=-1, keepdims=True)
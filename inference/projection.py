@@ -0,0 +1,223 @@
+import os
+import json
+import numpy as np
+
+from inference.embeddingstore import EmbeddingStore
+
+# Bump whenever the layout of a saved projection changes, old projections are then refitted
+FORMAT_VERSION = 2
+
+# Columns of the store the projected rows are aggregated by
+AGGREGATE_COLUMNS = ["team", "map", "agent"]
+
+class Projection:
+    """Projection of embeddings on their first principal components"""
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray, explained_variance_ratio: np.ndarray):
+        self.mean = mean
+        self.components = components
+        self.explained_variance_ratio = explained_variance_ratio
+
+    @property
+    def n_components(self) -> int:
+        return len(self.components)
+
+    @classmethod
+    def fit(cls, embeddings: np.ndarray, n_components: int = 2, block_size: int = 65536) -> "Projection":
+        """Fits the principal components in one pass over blocks of rows, so memory-mapped embeddings are never fully loaded.
+
+        Only the latent_size x latent_size covariance is accumulated and diagonalized, which gives the exact PCA.
+        """
+        n_rows, latent_size = embeddings.shape
+        if n_rows == 0:
+            raise ValueError("Can't fit a projection without embeddings")
+
+        # Sums are taken around the mean of the first block, so a large mean doesn't eat the precision of the covariance
+        shift = np.asarray(embeddings[:block_size], dtype=np.float64).mean(axis=0)
+        total = np.zeros(latent_size)
+        outer = np.zeros((latent_size, latent_size))
+        for start in range(0, n_rows, block_size):
+            block = np.asarray(embeddings[start : start + block_size], dtype=np.float64) - shift
+            total += block.sum(axis=0)
+            outer += block.T @ block
+
+        centered_mean = total / n_rows
+        covariance = outer / n_rows - np.outer(centered_mean, centered_mean)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:n_components]
+
+        # Signs are arbitrary, the largest coefficient of every component is made positive so refits give the same picture
+        components = eigenvectors[:, order].T
+        components *= np.sign(components[np.arange(len(components)), np.argmax(np.abs(components), axis=1)])[:, None]
+
+        explained_variance_ratio = eigenvalues[order] / max(eigenvalues.sum(), np.finfo(np.float64).tiny)
+        return cls(shift + centered_mean, components, explained_variance_ratio)
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        return ((np.asarray(embeddings, dtype=np.float64) - self.mean) @ self.components.T).astype(np.float32)
+
+class ProjectedStore:
+    """Projected coordinates of every row of an embedding store, with their sums per team, map and held out agent.
+
+    Kept in a "projection" directory of the store. The basis is fitted once per store, so once per checkpoint,
+    and rows appended to the store later are projected with it without refitting. Coordinates are a raw
+    binary file that only grows, aggregates hold the count and coordinate sums of every (team, map, agent)
+    seen, from which `aggregate` derives any coarser grouping without going over the rows.
+    """
+
+    def __init__(self, path: str, store: EmbeddingStore, projection: Projection, header: dict, aggregates: dict[str, np.ndarray]):
+        self.path = path
+        self.store = store
+        self.projection = projection
+        self.header = header
+        self.aggregates = aggregates
+        self.coords = _map_coords(path, header["n_rows"], projection.n_components)
+
+    def __len__(self) -> int:
+        return self.header["n_rows"]
+
+    @classmethod
+    def open(cls, store: EmbeddingStore, n_components: int = 2, refit: bool = False, block_size: int = 65536) -> "ProjectedStore":
+        """Opens the projection of a store, fitting it if there is none or it doesn't match the store, and projects new rows"""
+        path = os.path.join(store.path, "projection")
+        header = None
+        if not refit and os.path.exists(os.path.join(path, "header.json")):
+            with open(os.path.join(path, "header.json"), "r", encoding="utf-8") as f:
+                header = json.load(f)
+
+        if header is None or not _matches(header, store, n_components):
+            projected = cls.create(store, n_components, block_size)
+        else:
+            with np.load(os.path.join(path, "basis.npz")) as data:
+                projection = Projection(data["mean"], data["components"], data["explained_variance_ratio"])
+            with np.load(os.path.join(path, "aggregates.npz")) as data:
+                aggregates = { name: data[name] for name in data.files if name != "n_rows" }
+                aggregated_rows = int(data["n_rows"])
+            projected = cls(path, store, projection, header, aggregates)
+
+            # Aggregates of more or fewer rows than the header are from an update that didn't finish
+            if aggregated_rows != header["n_rows"]:
+                projected.aggregates = _empty_aggregates(n_components)
+                for block_start in range(0, len(projected), block_size):
+                    rows = slice(block_start, min(len(projected), block_start + block_size))
+                    projected._aggregate(rows, projected.coords[rows])
+                projected._commit()
+
+        projected.update(block_size)
+        return projected
+
+    @classmethod
+    def create(cls, store: EmbeddingStore, n_components: int = 2, block_size: int = 65536) -> "ProjectedStore":
+        """Fits a new projection of a store, replacing any existing one, without projecting any row yet"""
+        path = os.path.join(store.path, "projection")
+        os.makedirs(path, exist_ok=True)
+
+        projection = Projection.fit(store.embeddings, n_components, block_size)
+        np.savez(os.path.join(path, "basis.npz"), mean=projection.mean, components=projection.components, explained_variance_ratio=projection.explained_variance_ratio)
+        open(os.path.join(path, "coords.bin"), "wb").close()
+
+        header = {
+            "format_version": FORMAT_VERSION,
+            "model_hash": store.model_hash,
+            "store_created_at": store.created_at,
+            "n_components": n_components,
+            "n_fitted": len(store),
+            "n_rows": 0,
+        }
+        aggregates = _empty_aggregates(n_components)
+        projected = cls(path, store, projection, header, aggregates)
+        projected._commit()
+        return projected
+
+    def update(self, block_size: int = 65536) -> int:
+        """Projects the rows appended to the store since the last update and returns how many there were"""
+        start, end = len(self), len(self.store)
+        if start == end:
+            return 0
+
+        with open(os.path.join(self.path, "coords.bin"), "r+b") as f:
+            # Drops whatever an unfinished update left after the last committed row
+            f.truncate(start * self.projection.n_components * np.dtype(np.float32).itemsize)
+            f.seek(0, os.SEEK_END)
+
+            for block_start in range(start, end, block_size):
+                rows = slice(block_start, min(end, block_start + block_size))
+                coords = self.projection.transform(self.store.embeddings[rows])
+                f.write(coords.tobytes())
+                self._aggregate(rows, coords)
+
+        self.header["n_rows"] = end
+        self._commit()
+        self.coords = _map_coords(self.path, end, self.projection.n_components)
+        return end - start
+
+    def aggregate(self, by: list[str]) -> dict[str, np.ndarray]:
+        """Returns the codes of every group of rows with the same values of the `by` columns, their count and mean coordinates"""
+        unknown = set(by) - set(AGGREGATE_COLUMNS)
+        if len(unknown) > 0:
+            raise ValueError(f"Can't aggregate by {sorted(unknown)}, expected some of {AGGREGATE_COLUMNS}")
+
+        groups = _group(self.aggregates, list(by))
+        return { **{ name: groups[name] for name in by }, "count": groups["count"], "mean": groups["sums"] / groups["count"][:, None] }
+
+    def _aggregate(self, rows: slice, coords: np.ndarray) -> None:
+        """Adds the projected coordinates of rows of the store to the aggregates"""
+        block = { name: np.asarray(self.store.columns[name][rows], dtype=np.int64) for name in AGGREGATE_COLUMNS }
+        block["count"] = np.ones(len(coords), dtype=np.int64)
+        block["sums"] = np.asarray(coords, dtype=np.float64)
+        self.aggregates = _group(_concatenate(self.aggregates, block), AGGREGATE_COLUMNS)
+
+    def _commit(self) -> None:
+        # Replaced whole and tagged with the rows they cover, a crash before the header is written leaves
+        # aggregates that don't match it, which `open` rebuilds from the committed coordinates
+        tmp_path = os.path.join(self.path, "aggregates.npz.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, n_rows=self.header["n_rows"], **self.aggregates)
+        os.replace(tmp_path, os.path.join(self.path, "aggregates.npz"))
+
+        # The header goes last, rows past its row count are from an update that didn't finish
+        tmp_path = os.path.join(self.path, "header.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.header, f)
+        os.replace(tmp_path, os.path.join(self.path, "header.json"))
+
+def _matches(header: dict, store: EmbeddingStore, n_components: int) -> bool:
+    return (
+        header["format_version"] == FORMAT_VERSION
+        and header["model_hash"] == store.model_hash
+        and header["store_created_at"] == store.created_at
+        and header["n_components"] == n_components
+        and header["n_rows"] <= len(store)
+    )
+
+def _map_coords(path: str, n_rows: int, n_components: int) -> np.ndarray:
+    # np.memmap can't map empty files
+    if n_rows == 0:
+        return np.empty((0, n_components), dtype=np.float32)
+    return np.memmap(os.path.join(path, "coords.bin"), dtype=np.float32, mode="r", shape=(n_rows, n_components))
+
+def _empty_aggregates(n_components: int) -> dict[str, np.ndarray]:
+    return {
+        **{ name: np.zeros(0, dtype=np.int64) for name in AGGREGATE_COLUMNS },
+        "count": np.zeros(0, dtype=np.int64),
+        "sums": np.zeros((0, n_components)),
+    }
+
+def _concatenate(a: dict[str, np.ndarray], b: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    return { name: np.concatenate([a[name], b[name]]) for name in a }
+
+def _group(table: dict[str, np.ndarray], by: list[str]) -> dict[str, np.ndarray]:
+    """Sums the counts and coordinate sums of the rows of a table with the same `by` columns"""
+    if len(table["count"]) == 0:
+        return { **{ name: table[name] for name in by }, "count": table["count"], "sums": table["sums"] }
+
+    keys = np.stack([table[name] for name in by], axis=1)
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    sums = np.stack([np.bincount(inverse, weights=table["sums"][:, j], minlength=len(unique)) for j in range(table["sums"].shape[1])], axis=1)
+    return {
+        **{ name: unique[:, i] for i, name in enumerate(by) },
+        "count": np.bincount(inverse, weights=table["count"], minlength=len(unique)).astype(np.int64),
+        "sums": sums,
+    }
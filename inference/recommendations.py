@@ -0,0 +1,179 @@
+import os
+import json
+import math
+import itertools
+import numpy as np
+
+from inference.numpymodel import NumpyModel
+from training.compstore import CompositionStore
+from utils.consts import ALL_AGENTS, MODEL_AGENTS, MODEL_MAPS
+
+# Bump whenever the layout of the table changes, old tables must then be rebuilt
+FORMAT_VERSION = 1
+
+# BINOMIALS[n, k] = C(n, k), enough for the combinatorial number system rank of 4 agent codes
+BINOMIALS = np.array([[math.comb(n, k) for k in range(5)] for n in range(len(MODEL_AGENTS) + 1)], dtype=np.int64)
+
+def combination_rank(codes) -> int:
+    """Returns the position of a set of 4 distinct agent codes in colexicographic order, in [0, C(n_agents, 4))"""
+    c0, c1, c2, c3 = sorted(codes)
+    return int(BINOMIALS[c0, 1] + BINOMIALS[c1, 2] + BINOMIALS[c2, 3] + BINOMIALS[c3, 4])
+
+def all_combinations() -> np.ndarray:
+    """Returns every set of 4 agent codes (sorted ascending), row i being the one of rank i"""
+    combinations = np.array(list(itertools.combinations(range(len(MODEL_AGENTS)), 4)), dtype=np.int64)
+    ranks = BINOMIALS[combinations[:, 0], 1] + BINOMIALS[combinations[:, 1], 2] + BINOMIALS[combinations[:, 2], 3] + BINOMIALS[combinations[:, 3], 4]
+
+    ranked = np.empty_like(combinations)
+    ranked[ranks] = combinations
+    return ranked
+
+class RecommendationTable:
+    """Outputs of a model for every 4 agent composition on every map, with the reference stats of each agent.
+
+    A directory holding, for map m and agent set of rank r (see `combination_rank`):
+     - probabilities.npy[m, r]: probability of each agent being the 5th one, as the agent head outputs it
+     - ranking.npy[m, r]: codes of the agents not in the composition, most probable first
+     - embeddings.npy[m, r]: latent embedding
+    Agents and maps are codes of MODEL_AGENTS / MODEL_MAPS, every lookup is a couple of array reads.
+    """
+
+    def __init__(self, path: str, header: dict, arrays: dict[str, np.ndarray]):
+        self.path = path
+        self.header = header
+        self.arrays = arrays
+
+        self._agent_codes = { agent: i for i, agent in enumerate(header["agents"]) }
+        self._map_codes = { map_name: i for i, map_name in enumerate(header["maps"]) }
+
+    @property
+    def model_hash(self) -> str:
+        return self.header["model_hash"]
+
+    @classmethod
+    def open(cls, path: str, mmap: bool = True) -> "RecommendationTable":
+        with open(os.path.join(path, "header.json"), "r", encoding="utf-8") as f:
+            header = json.load(f)
+
+        if header["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {header['format_version']} but {FORMAT_VERSION} is expected, rebuild it")
+
+        if header["agents"] != MODEL_AGENTS or header["maps"] != MODEL_MAPS:
+            raise ValueError(f"{path} was built with other agents or maps than utils/consts.py, rebuild it")
+
+        mmap_mode = "r" if mmap else None
+        arrays = { name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ("probabilities", "ranking", "embeddings") }
+        return cls(path, header, arrays)
+
+    @classmethod
+    def build(
+        cls,
+        path: str,
+        model: NumpyModel,
+        stats_mean: np.ndarray,
+        stats_scale: np.ndarray,
+        reference_stats: np.ndarray = None,
+        batch_size: int = 8192
+    ) -> "RecommendationTable":
+        """Runs the model on every composition and map and writes the table.
+
+        reference_stats are the raw stats given to each agent of MODEL_AGENTS, (n_agents, n_stats),
+        every agent gets stats_mean when it's None.
+        """
+        n_agents, n_maps = len(MODEL_AGENTS), len(MODEL_MAPS)
+        stats_mean = np.asarray(stats_mean, dtype=np.float64)
+        if reference_stats is None:
+            reference_stats = np.tile(stats_mean, (n_agents, 1))
+        reference_stats = np.asarray(reference_stats, dtype=np.float64)
+        normalized_stats = ((reference_stats - stats_mean) / stats_scale).astype(np.float32)
+
+        combinations = all_combinations()
+        x_agents = np.tile(combinations, (n_maps, 1)).astype(np.int32)
+        x_maps = np.repeat(np.arange(n_maps), len(combinations)).astype(np.int32)
+        x_stats = normalized_stats[x_agents]
+        if model.input_encoding == "onehot":
+            x_agents, x_maps = np.eye(n_agents, dtype=np.float32)[x_agents], np.eye(n_maps, dtype=np.float32)[x_maps]
+
+        agent_name = model.graph["outputs"][0]
+        probabilities, embeddings = [], []
+        for start in range(0, len(x_maps), batch_size):
+            inputs = [x[start : start + batch_size] for x in (x_agents, x_maps, x_stats)]
+            block_probabilities, block_embeddings = model.run(inputs, [agent_name, "latent"])
+            probabilities.append(block_probabilities)
+            embeddings.append(block_embeddings)
+
+        probabilities = np.concatenate(probabilities).reshape(n_maps, len(combinations), n_agents)
+        embeddings = np.concatenate(embeddings).reshape(n_maps, len(combinations), -1)
+
+        # Agents already in the composition can't be the 5th one, they go last and are cut off
+        present = np.zeros((len(combinations), n_agents), dtype=bool)
+        present[np.arange(len(combinations))[:, None], combinations] = True
+        ranking = np.argsort(np.where(present, -np.inf, probabilities), axis=-1, kind="stable")[..., ::-1][..., : n_agents - 4]
+
+        os.makedirs(path, exist_ok=True)
+        arrays = {
+            "probabilities": probabilities.astype(np.float32),
+            "ranking": ranking.astype(np.int8),
+            "embeddings": embeddings.astype(np.float16),
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+
+        header = {
+            "format_version": FORMAT_VERSION,
+            "agents": MODEL_AGENTS,
+            "maps": MODEL_MAPS,
+            "model_hash": model.model_hash,
+            "reference_stats": reference_stats.tolist(),
+        }
+
+        # The header goes last so a table is never readable while half written
+        with open(os.path.join(path, "header.json"), "w", encoding="utf-8") as f:
+            json.dump(header, f)
+
+        return cls(path, header, arrays)
+
+    def index(self, agents: list[str], map_name: str) -> tuple[int, int]:
+        """Returns the map code and combination rank of a composition"""
+        try:
+            codes = [self._agent_codes[agent] for agent in agents]
+            map_code = self._map_codes[map_name]
+        except KeyError as e:
+            raise ValueError(f"Unknown agent or map {e}") from e
+
+        if len(set(codes)) != 4:
+            raise ValueError(f"A composition needs 4 different agents, got {agents}")
+        return map_code, combination_rank(codes)
+
+    def probabilities(self, agents: list[str], map_name: str) -> dict[str, float]:
+        """Returns the probability of each agent being the 5th one"""
+        map_code, rank = self.index(agents, map_name)
+        return dict(zip(self.header["agents"], self.arrays["probabilities"][map_code, rank].tolist()))
+
+    def recommend(self, agents: list[str], map_name: str, k: int = 5) -> list[tuple[str, float]]:
+        """Returns the k most probable 5th agents with their probabilities"""
+        map_code, rank = self.index(agents, map_name)
+        probabilities = self.arrays["probabilities"][map_code, rank]
+        return [(self.header["agents"][code], float(probabilities[code])) for code in self.arrays["ranking"][map_code, rank, :k]]
+
+    def embedding(self, agents: list[str], map_name: str) -> np.ndarray:
+        map_code, rank = self.index(agents, map_name)
+        return np.asarray(self.arrays["embeddings"][map_code, rank], dtype=np.float32)
+
+def agent_reference_stats(comps: CompositionStore, block_size: int = 65536) -> np.ndarray:
+    """Returns the mean raw stats of every agent of MODEL_AGENTS over the players of a composition store.
+
+    Agents nobody played get the mean stats of every player.
+    """
+    n_stats = comps.stats.shape[-1]
+    sums = np.zeros((len(ALL_AGENTS), n_stats))
+    counts = np.zeros(len(ALL_AGENTS))
+    for start in range(0, len(comps), block_size):
+        agents = np.asarray(comps.agents[start : start + block_size], dtype=np.int64).reshape(-1)
+        stats = np.asarray(comps.stats[start : start + block_size], dtype=np.float64).reshape(-1, n_stats)
+        sums += np.stack([np.bincount(agents, weights=stats[:, j], minlength=len(ALL_AGENTS)) for j in range(n_stats)], axis=1)
+        counts += np.bincount(agents, minlength=len(ALL_AGENTS))
+
+    overall = sums.sum(axis=0) / max(counts.sum(), 1)
+    means = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], overall)
+    return means[[ALL_AGENTS.index(agent) for agent in MODEL_AGENTS]]
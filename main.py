@@ -1,46 +1,62 @@
-import pandas as pd
-import seaborn as sns
-import tensorflow as tf
-import matplotlib.pyplot as plt
-
-from sklearn.decomposition import PCA
-
-from training.datasetfactory import DatasetFactory
-
-model_path = "models/model-1.9646-044-0.6771-0.8939.h5"
-
-dataset_factory = DatasetFactory(scrapped_comps_file="data/comps.jsonl")
-test_ds, test_ds, train_meta, test_meta = dataset_factory.generate_dataset(as_tf_dataset=False)
-(agents_x, maps_x, stats_x), (agents_y, stats_y) = test_ds
-
-ctx_model = tf.keras.models.load_model(model_path)
-encoder_output = ctx_model.get_layer("latent").output
-encoder = tf.keras.models.Model(inputs=ctx_model.input, outputs=encoder_output)
-
-pca = PCA(n_components=2)
-embeddings = encoder.predict([agents_x, maps_x, stats_x])
-components = pca.fit_transform(embeddings)
-
-df = pd.DataFrame(components, columns=["x", "y"])
-df["map"] = dataset_factory.map_encoder.inverse_transform(maps_x)
-df["agent"] = dataset_factory.agent_encoder.inverse_transform(agents_y)
-df = pd.concat([df, pd.DataFrame(test_meta)], axis=1)
-
-count_df = df.groupby("team").size().reset_index(name="count")
-popular_teams = count_df[count_df["count"] > 5]["team"].values
-
-df = df[df["team"].isin(popular_teams)]
-df["score"] = df["score"].astype(int)
-
-sns.scatterplot(data=df, x="x", y="y", s=5)
-
-selected_teams = ["Team Liquid", "OpTic Gaming", "LOUD", "XSET", "FNATIC", "DRX", "Leviatán", "FunPlus Phoenix"]
-# selected_teams = ["Leviatán"]
-df = df[df["team"].isin(selected_teams)]
-# df = df.groupby(["team", "map"]).mean().reset_index()
-
-df = df[df["map"] == "Fracture"]
-print(df.head(15))
-
-sns.scatterplot(data=df, x="x", y="y", hue="team", s=100)
-plt.show()
\ No newline at end of file
+import argparse
+import numpy as np
+
+from inference.embeddingstore import EmbeddingStore
+from inference.projection import ProjectedStore
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--store", "-s", default="data/embeddings.store", type=str, help="Embedding store from embed.py")
+    parser.add_argument("--teams", nargs="+", default=["Team Liquid", "OpTic Gaming", "LOUD", "XSET", "FNATIC", "DRX", "Leviatán", "FunPlus Phoenix"], help="Teams highlighted in the second plot")
+    parser.add_argument("--map", default="Fracture", type=str, help="Map of the compositions highlighted in the second plot")
+    parser.add_argument("--min-games", default=5, type=int, help="Teams with fewer embeddings are not plotted")
+    parser.add_argument("--max-points", default=200000, type=int, help="Embeddings drawn in the first plot are sampled down to this number")
+    parser.add_argument("--refit", action="store_true", help="Fits the projection again instead of using the saved one")
+
+def main(args: argparse.Namespace):
+    """Main function"""
+
+    # Plotting needs all of these, they take seconds to import
+    import pandas as pd
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
+    store = EmbeddingStore.open(args.store)
+    projected = ProjectedStore.open(store, refit=args.refit)
+    print(f"{len(projected)} embeddings, the 2 components explain {100 * projected.projection.explained_variance_ratio.sum():.1f}% of their variance")
+
+    # Teams are filtered on the aggregated counts and compared by code, never going over the rows by name
+    teams = projected.aggregate(["team"])
+    popular_teams = teams["team"][teams["count"] > args.min_games]
+    team_codes = [store.teams.index(team) for team in args.teams if team in store.teams]
+    map_code = store.maps.index(args.map)
+
+    # A random sample has the same distribution as the millions of rows it's drawn from
+    popular_rows = np.flatnonzero(np.isin(store.columns["team"], popular_teams))
+    if len(popular_rows) > args.max_points:
+        popular_rows = np.sort(np.random.default_rng(0).choice(popular_rows, size=args.max_points, replace=False))
+    sns.scatterplot(x=projected.coords[popular_rows, 0], y=projected.coords[popular_rows, 1], s=5)
+
+    selected_rows = np.flatnonzero(np.isin(store.columns["team"], team_codes) & (store.columns["map"] == map_code))
+    df = pd.DataFrame(projected.coords[selected_rows], columns=["x", "y"])
+    df = pd.concat([df, pd.DataFrame(store.meta(selected_rows))], axis=1)
+    print(df.head(15))
+
+    # Mean position of each selected team on the map, from the aggregated table
+    means = projected.aggregate(["team", "map"])
+    selected = np.isin(means["team"], team_codes) & (means["map"] == map_code)
+    means_df = pd.DataFrame({
+        "team": [store.teams[team] for team in means["team"][selected]],
+        "count": means["count"][selected],
+        "x": means["mean"][selected, 0],
+        "y": means["mean"][selected, 1],
+    })
+    print(means_df.sort_values("count", ascending=False).to_string(index=False))
+
+    sns.scatterplot(data=df, x="x", y="y", hue="team", s=100)
+    sns.scatterplot(data=means_df, x="x", y="y", hue="team", s=400, marker="X", legend=False)
+    plt.show()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plots the embeddings of a trained model")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,55 @@
+import time
+import argparse
+import numpy as np
+
+from inference.embeddingstore import EmbeddingStore
+from inference.numpymodel import NumpyModel
+from inference.recommendations import RecommendationTable, agent_reference_stats
+from training.jsonlreader import open_compositions
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--model", "-m", default=None, type=str, help="Model checkpoint or NumPy export to build the table with, the table is only queried otherwise")
+    parser.add_argument("--store", "-s", default="data/embeddings.store", type=str, help="Embedding store of the same checkpoint, its stats normalization is used")
+    parser.add_argument("--comps", "-i", default=None, type=str, help="Scraped compositions, each agent gets its mean stats in them instead of the mean stats of every player")
+    parser.add_argument("--outpath", "-o", default="data/recommendations", type=str, help="Directory of the table")
+    parser.add_argument("--agents", nargs=4, default=None, type=str, help="4 agents to recommend the 5th one for")
+    parser.add_argument("--map", default=None, type=str, help="Map of the composition to recommend for")
+    parser.add_argument("-k", default=5, type=int, help="Number of recommended agents")
+
+def load_model(path: str) -> NumpyModel:
+    """Loads a NumPy export, or converts a checkpoint in memory"""
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            if "graph" in data.files:
+                return NumpyModel.load(path)
+
+    # Imports TensorFlow, not needed to query the table
+    from inference.numpyexport import to_numpy_model
+    return to_numpy_model(path)[0]
+
+def main(args: argparse.Namespace):
+    """Main function"""
+
+    if args.model is not None:
+        model = load_model(args.model)
+        store = EmbeddingStore.open(args.store)
+        if store.model_hash != model.model_hash:
+            raise ValueError(f"{args.store} holds embeddings of another checkpoint than {args.model}")
+
+        reference_stats = agent_reference_stats(open_compositions(args.comps)) if args.comps is not None else None
+
+        start = time.perf_counter()
+        table = RecommendationTable.build(args.outpath, model, store.stats_mean, store.stats_scale, reference_stats)
+        elapsed = time.perf_counter() - start
+
+        print(f"Built a table of {table.arrays['probabilities'].shape[1]} compositions on {len(table.header['maps'])} maps in {args.outpath} in {elapsed:.2f} s")
+
+    if args.agents is not None and args.map is not None:
+        table = RecommendationTable.open(args.outpath)
+        for agent, probability in table.recommend(args.agents, args.map, args.k):
+            print(f" > {agent:<12} {probability:.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds a table of the 5th agent recommendations for every composition and map, or queries it")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -1,61 +1,219 @@
+import os
 import json
+import asyncio
 import argparse
-import threading
 import concurrent.futures
-from dataclasses import asdict
 
-from scraping.vlrscraper import VLRScraper
+from scraping.gamewriter import GameResultWriter
+from scraping.manifest import ScrapeManifest
+from scraping.pagecache import PageCache
+from scraping.scheduler import AIMDController, TokenBucket, RequestScheduler, AsyncRequestScheduler
+from scraping.vlrscraper import VLRScraper, MATCH_PARSERS
+from utils import metrics
 
-parser = argparse.ArgumentParser(description="vlr.gg scraper")
-parser.add_argument("--outpath", "-o", type=str, help="Path for output file")
-parser.add_argument("--threads", "-t", default=12, type=int, help="Number of threads to be used")
-args = parser.parse_args()
+# Event IDs from big tournaments (Masters, VCT Challengers, Champions...)
+DEFAULT_EVENT_IDS = [
+    1015, 1111, 1130, 1117, 1083, 1084, 1014, 1113, 1085, 1086, 800, 911, 984, 1063,
+    1013, 998, 988, 983, 1012, 882, 991, 972, 926
+]
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--outpath", "-o", type=str, help="Path for output file")
+    parser.add_argument("--threads", "-t", default=12, type=int, help="Number of threads, the max number of concurrent downloads of the thread engine")
+    parser.add_argument("--cache-dir", default="data/pagecache", type=str, help="Directory of the downloaded pages cache")
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument("--no-cache", action="store_true", help="Always download pages instead of using the cache")
+    cache_mode.add_argument("--offline", action="store_true", help="Only parse pages already in the cache, never download")
+    parser.add_argument("--parser", default="lxml", choices=MATCH_PARSERS, help="Backend used to parse match pages")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use the asyncio engine instead of threads")
+    parser.add_argument("--connections", default=32, type=int, help="Max open connections per host of the asyncio engine")
+    parser.add_argument("--resume", action="store_true", help="Keep the existing output and only scrape matches missing from its manifest")
+    parser.add_argument("--events", nargs="+", type=int, help="Event IDs to scrape instead of the default ones")
+    parser.add_argument("--max-pending", default=256, type=int, help="Max number of scraped matches waiting to be written")
+    parser.add_argument("--initial-concurrency", default=4, type=int, help="Concurrent downloads at the start, adapted to the latency and throttling of the site")
+    parser.add_argument("--fixed-concurrency", action="store_true", help="Always use --threads / --connections concurrent downloads")
+    parser.add_argument("--rate", default=50.0, type=float, help="Max average number of downloads per second")
+    parser.add_argument("--burst", default=None, type=int, help="Max number of downloads above the rate at once, the rate by default")
+    parser.add_argument("--retries", default=4, type=int, help="Retries of a download that was throttled or failed to connect")
+    metrics.add_arguments(parser)
+
+def new_match_ids(matches, seen, manifest):
+    """Yields the IDs of the matches of an event that weren't seen in a previous event nor are in the manifest yet"""
+
+    for match in matches:
+        if match.id not in seen:
+            seen.add(match.id)
+            if not manifest.is_match_done(match.id):
+                yield match.id
+
+def create_writer(args, manifest):
+    """Creates the single writer of the output file"""
+
+    return GameResultWriter(args.outpath, manifest, resume=args.resume, max_pending=args.max_pending)
+
+def create_scheduler(args, max_concurrency, scheduler_class=RequestScheduler):
+    """Creates the scheduler of the downloads, with at most max_concurrency of them at once"""
+
+    initial = max_concurrency if args.fixed_concurrency else min(args.initial_concurrency, max_concurrency)
+    min_limit = max_concurrency if args.fixed_concurrency else 1
+    return scheduler_class(
+        controller=AIMDController(initial=initial, min_limit=min_limit, max_limit=max_concurrency),
+        bucket=TokenBucket(args.rate, args.burst),
+        max_attempts=args.retries + 1
+    )
+
+def dead_letter_path(outpath):
+    """Returns the path of the failed matches of an output file (data/comps.jsonl -> data/comps.failed.jsonl)"""
+
+    root, _ = os.path.splitext(outpath)
+    return f"{root}.failed.jsonl"
+
+def report(args, writer, scheduler, failed_events):
+    """Prints the summary of a run and writes the events and matches that failed for good"""
+
+    print(f"Wrote {writer.n_games} games from {writer.n_matches} matches")
+    print(f"Downloads: {scheduler.summary()}")
+
+    # Failed matches are not in the manifest, so --resume tries them again
+    with open(dead_letter_path(args.outpath), "w", encoding="utf-8") as f:
+        for event_id, error in failed_events:
+            f.write(json.dumps({ "event_id": event_id, "error": error }) + "\n")
+        for match_id, error in writer.failures:
+            f.write(json.dumps({ "match_id": match_id, "error": error }) + "\n")
+
+    if len(failed_events) > 0:
+        print(f"Failed to get the matches of {len(failed_events)} events, listed in {dead_letter_path(args.outpath)}:")
+        for event_id, error in failed_events:
+            print(f"   > Event {event_id}: {error}")
+
+    if len(writer.failures) > 0:
+        print(f"Failed to scrape {len(writer.failures)} matches, listed in {dead_letter_path(args.outpath)}:")
+        for match_id, error in writer.failures:
+            print(f"   > Match {match_id}: {error}")
 
 # Scraping all matches
-def process_match(i, match_id, file):
-    """Scrapes a match and writes it to a file"""
+def process_match(scraper, writer, i, n_matches, match_id):
+    """Scrapes a match and hands it to the writer"""
 
-    print(f" > Scraping match {match_id} ({i + 1:05d} / {len(match_ids):05d})")
+    print(f" > Scraping match {match_id} ({i + 1:05d} / {n_matches:05d} found so far)")
 
     try:
-        match_games = scraper.get_match_info(match_id)
-        file_lock.acquire()
-        for game_info in match_games:
-            file.write(json.dumps(asdict(game_info)) + "\n")
-        file_lock.release()
-    except TypeError:
-        print(f"   > Error scraping match {match_id}. Skipping...")
-
-def main():
-    """Main function"""
+        with metrics.timer("scrape_match_seconds"):
+            game_results = scraper.get_match_info(match_id)
+        writer.submit(i, match_id, game_results)
+    except Exception as e: # pylint: disable=broad-except
+        metrics.inc("scrape_match_failures", error=type(e).__name__)
+        writer.fail(i, match_id, e)
+
+async def process_match_async(scraper, writer, i, n_matches, match_id):
+    """Scrapes a match with the asyncio engine and hands it to the writer"""
 
-    print(f"Scraping {len(match_ids)} matches")
+    print(f" > Scraping match {match_id} ({i + 1:05d} / {n_matches:05d} found so far)")
 
-    # Clearing output file
-    open(args.outpath, "w+", encoding="utf-8").close()
+    try:
+        with metrics.timer("scrape_match_seconds"):
+            game_results = await scraper.get_match_info(match_id)
+        writer.submit(i, match_id, game_results)
+    except Exception as e: # pylint: disable=broad-except
+        metrics.inc("scrape_match_failures", error=type(e).__name__)
+        writer.fail(i, match_id, e)
 
-    # Scraping matches
-    with open(args.outpath, "a", encoding="utf-8") as f:
-        thread_data = ((i, match_id, f) for i, match_id in enumerate(match_ids))
-        with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
-            executor.map(lambda x: process_match(*x), thread_data)
+async def get_event_matches_async(scraper, event_id):
+    """Returns the event ID with its matches or the error that prevented getting them"""
+
+    try:
+        return event_id, await scraper.get_event_matches(event_id), None
+    except Exception as e: # pylint: disable=broad-except
+        return event_id, None, e
+
+async def main_async(args, event_ids, cache, manifest):
+    """Main function of the asyncio engine"""
+
+    # aiohttp is only needed by the asyncio engine
+    from scraping.asyncvlrscraper import AsyncVLRScraper
+
+    scheduler = create_scheduler(args, args.connections, AsyncRequestScheduler)
+    async with AsyncVLRScraper(cache=cache, offline=args.offline, max_connections_per_host=args.connections, parser=args.parser, scheduler=scheduler) as scraper:
+        print(f"Getting match IDs of {len(event_ids)} events")
+
+        with create_writer(args, manifest) as writer:
+            # Events are all downloaded at once, but their matches are taken in event_ids order, so the order of the
+            # output and the event a duplicate match is counted in don't depend on which event is downloaded first
+            event_tasks = [asyncio.create_task(get_event_matches_async(scraper, event_id)) for event_id in event_ids]
+            seen, failed_events, tasks = set(), [], []
+            for event_task in event_tasks:
+                event_id, matches, error = await event_task
+                if error is not None:
+                    print(f" > Failed to get the matches of event {event_id}: {error!r}")
+                    failed_events.append((event_id, repr(error)))
+                    continue
+
+                match_ids = list(new_match_ids(matches, seen, manifest))
+                n_found = len(tasks) + len(match_ids)
+                for match_id in match_ids:
+                    # Waiting for room in the writer keeps the number of tasks in flight bounded
+                    await asyncio.to_thread(writer.reserve)
+                    tasks.append(asyncio.create_task(process_match_async(scraper, writer, len(tasks), n_found, match_id)))
+            await asyncio.gather(*tasks)
+
+        report(args, writer, scheduler, failed_events)
+
+def main_threads(args, event_ids, cache, manifest):
+    """Main function of the thread engine"""
 
-if __name__ == "__main__":
     # Initializing scraper object
-    scraper = VLRScraper()
+    scheduler = create_scheduler(args, args.threads)
+    scraper = VLRScraper(cache=cache, offline=args.offline, max_connections=args.threads, parser=args.parser, scheduler=scheduler)
 
-    # Event IDs from big tournaments (Masters, VCT Challengers, Champions...)
-    event_ids = [
-        1015, 1111, 1130, 1117, 1083, 1084, 1014, 1113, 1085, 1086, 800, 911, 984, 1063,
-        1013, 998, 988, 983, 1012, 882, 991, 972, 926
-    ]
+    print(f"Getting match IDs of {len(event_ids)} events")
 
-    # Getting all match IDs from all events
-    print("Getting match IDs")
-    events = [scraper.get_event_matches(event_id) for event_id in event_ids]
-    match_ids = [match.id for event in events for match in event]
+    with create_writer(args, manifest) as writer:
+        # Events are downloaded by their own threads so a match thread waiting for room in the writer never blocks
+        # them. Their matches are taken in event_ids order, so the order of the output and the event a duplicate
+        # match is counted in don't depend on which event is downloaded first
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as event_executor, \
+             concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
+            events = [(event_id, event_executor.submit(scraper.get_event_matches, event_id)) for event_id in event_ids]
+            seen, failed_events, n_submitted = set(), [], 0
+            for event_id, future in events:
+                try:
+                    matches = future.result()
+                except Exception as e: # pylint: disable=broad-except
+                    print(f" > Failed to get the matches of event {event_id}: {e!r}")
+                    failed_events.append((event_id, repr(e)))
+                    continue
 
-    # Lock for writing to file
-    file_lock = threading.Lock()
+                match_ids = list(new_match_ids(matches, seen, manifest))
+                n_found = n_submitted + len(match_ids)
+                for match_id in match_ids:
+                    # Waiting for room in the writer keeps the number of submitted matches bounded
+                    writer.reserve()
+                    executor.submit(process_match, scraper, writer, n_submitted, n_found, match_id)
+                    n_submitted += 1
 
-    main()
\ No newline at end of file
+    report(args, writer, scheduler, failed_events)
+
+def main(args: argparse.Namespace):
+    """Main function"""
+
+    cache = None if args.no_cache else PageCache(args.cache_dir)
+
+    # Record of the matches already scraped into the output file
+    manifest = ScrapeManifest(ScrapeManifest.path_for(args.outpath))
+    if args.resume:
+        print(f"Resuming with {manifest.n_games} games from {manifest.n_matches} matches already scraped")
+    else:
+        manifest.clear()
+
+    event_ids = args.events or DEFAULT_EVENT_IDS
+
+    with metrics.session("scrape", args.metrics_dir):
+        if args.use_async:
+            asyncio.run(main_async(args, event_ids, cache, manifest))
+        else:
+            main_threads(args, event_ids, cache, manifest)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="vlr.gg scraper")
+    add_arguments(parser)
+    main(parser.parse_args())
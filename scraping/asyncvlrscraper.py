@@ -0,0 +1,121 @@
+import asyncio
+import aiohttp
+
+from scraping.datamodels import Match, GameResult
+from scraping.pagecache import PageCache, PageNotCachedError
+from scraping.scheduler import AsyncRequestScheduler, PageDownloadError, parse_retry_after
+from scraping.vlrscraper import VLRScraper, is_match_finished
+from utils import metrics
+
+class AsyncVLRScraper(VLRScraper):
+    """asyncio version of VLRScraper that shares a pool of keep-alive connections between all requests.
+
+    Must be used as an async context manager so the connection pool is opened and closed properly.
+    """
+
+    def __init__(
+        self,
+        cache: PageCache = None,
+        offline: bool = False,
+        base_url: str = "https://www.vlr.gg",
+        max_connections: int = 100,
+        max_connections_per_host: int = 32,
+        keepalive_timeout: float = 30.0,
+        parser: str = "bs4",
+        scheduler: AsyncRequestScheduler = None,
+        timeout: float = 30.0
+    ):
+        super().__init__(cache=cache, offline=offline, base_url=base_url, max_connections=max_connections, parser=parser, scheduler=scheduler, timeout=timeout)
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self._client: aiohttp.ClientSession = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections_per_host,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        self._client = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._client.close()
+        self._client = None
+
+    def _create_session(self, max_connections: int) -> None:
+        # Pages are downloaded with the aiohttp client opened by __aenter__
+        return None
+
+    async def get_match_info(self, match_id: int) -> list[GameResult]:
+        """Get info of a specific match from VLR.gg"""
+        target_url = self._match_url(match_id)
+        content = await self._get_page(target_url, kind="match")
+
+        # Games of live matches are only written once the match is over, so it's never recorded half played
+        if not is_match_finished(content):
+            metrics.inc("scrape_unfinished_matches")
+            await asyncio.to_thread(self._forget_page, target_url)
+            return []
+
+        # Parsing is moved off the event loop too, a big page would stall every request in flight
+        with metrics.timer("scrape_parse_seconds", kind="match", parser=self.parser):
+            game_results = await asyncio.to_thread(self._parse_match_page, match_id, content)
+        metrics.inc("scrape_games", len(game_results))
+
+        # Matches that were not played yet have no games, so they must be downloaded again later
+        if len(game_results) == 0:
+            await asyncio.to_thread(self._forget_page, target_url)
+
+        return game_results
+
+    async def get_event_matches(self, event_id: int) -> list[Match]:
+        """Get all matches of a specific event from VLR.gg"""
+        target_url = self._event_url(event_id)
+        content = await self._get_page(target_url, kind="event")
+        with metrics.timer("scrape_parse_seconds", kind="event", parser="bs4"):
+            return await asyncio.to_thread(self._parse_event_page, content)
+
+    async def _get_page(self, url: str, kind: str) -> bytes:
+        """Downloads a page, going through the page cache when there is one"""
+        if self._client is None:
+            raise RuntimeError("AsyncVLRScraper must be used inside an 'async with' block")
+
+        # Disk access is moved off the event loop so it doesn't stall the other requests
+        if self.cache is not None:
+            with metrics.timer("scrape_cache_read_seconds", kind=kind):
+                content = await asyncio.to_thread(self.cache.get, url, kind, self.offline)
+            if content is not None:
+                metrics.inc("scrape_cache_hits", kind=kind)
+                return content
+
+            if self.offline:
+                raise PageNotCachedError(url)
+
+        if self.scheduler is not None:
+            content = await self.scheduler.call(self._download, url, kind)
+        else:
+            content = await self._download(url, kind)
+
+        if self.cache is not None and self._is_cacheable(kind, content):
+            await asyncio.to_thread(self.cache.put, url, content, kind)
+
+        return content
+
+    async def _download(self, url: str, kind: str) -> bytes:
+        """Returns the content of a page, raises PageDownloadError if there is no response or it's not a success"""
+        try:
+            # Includes the wait for a free connection of the pool
+            with metrics.timer("scrape_request_seconds", kind=kind):
+                async with self._client.get(url) as response:
+                    content = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            metrics.inc("scrape_requests", kind=kind, status="error")
+            raise PageDownloadError(url) from e
+
+        metrics.inc("scrape_requests", kind=kind, status=response.status)
+        metrics.inc("scrape_downloaded_bytes", len(content), kind=kind)
+        if not response.ok:
+            raise PageDownloadError(url, response.status, parse_retry_after(response.headers.get("Retry-After")))
+        return content
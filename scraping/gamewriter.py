@@ -0,0 +1,158 @@
+import json
+import time
+import queue
+import threading
+from dataclasses import asdict
+
+from scraping.datamodels import GameResult
+from scraping.manifest import ScrapeManifest
+
+class GameResultWriter:
+    """Single writer thread that receives scraped matches from the workers through a bounded queue.
+
+    Matches are written in the order of their index, no matter the order they finish in, so the
+    output of a run is reproducible. Producers must call `reserve` before starting each match, which
+    blocks while `max_pending` matches are waiting to be written and keeps memory bounded.
+    """
+
+    def __init__(
+        self,
+        outpath: str,
+        manifest: ScrapeManifest,
+        resume: bool = False,
+        max_pending: int = 256,
+        batch_size: int = 64,
+        flush_interval: float = 5.0
+    ):
+        self.outpath = outpath
+        self.manifest = manifest
+        self.resume = resume
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.n_matches = 0
+        self.n_games = 0
+        self.failures: list[tuple[str, str]] = []
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._window = threading.BoundedSemaphore(max_pending)
+        self._thread: threading.Thread = None
+        self._error: BaseException = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self) -> None:
+        """Opens the output file and starts the writer thread"""
+        if self.resume:
+            # Cuts anything written after the last match recorded in the manifest
+            self.manifest.repair_output(self.outpath)
+        else:
+            open(self.outpath, "w+", encoding="utf-8").close()
+            self.manifest.clear()
+
+        self._thread = threading.Thread(target=self._run, name="GameResultWriter", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Writes everything still pending and stops the writer thread"""
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_if_failed()
+
+    def reserve(self) -> None:
+        """Reserves room for one more match, blocking while too many matches are pending.
+        Raises a RuntimeError once the writer thread failed, the window is never released then"""
+        while not self._window.acquire(timeout=0.5):
+            self._raise_if_failed()
+        self._raise_if_failed()
+
+    def submit(self, index: int, match_id, games: list[GameResult]) -> None:
+        """Hands the games of the match with the given index to the writer"""
+        self._raise_if_failed()
+        self._queue.put((index, match_id, games, None))
+
+    def fail(self, index: int, match_id, error: BaseException) -> None:
+        """Tells the writer the match with the given index failed, so it can move past it"""
+        self._raise_if_failed()
+        self._queue.put((index, match_id, None, error))
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("The writer thread failed") from self._error
+
+    def _run(self) -> None:
+        pending = {}
+        next_index = 0
+        batch_lines = []
+        batch_matches = []
+        last_flush = time.monotonic()
+        closing = False
+
+        try:
+            with open(self.outpath, "a", encoding="utf-8") as f:
+                while True:
+                    try:
+                        item = self._queue.get(timeout=self.flush_interval)
+                    except queue.Empty:
+                        item = ()
+
+                    if item is None:
+                        closing = True
+                        break
+
+                    if item:
+                        pending[item[0]] = item[1:]
+
+                    # Only the next match in order can be written, the others wait for it
+                    while next_index in pending:
+                        self._add_to_batch(*pending.pop(next_index), batch_lines, batch_matches)
+                        next_index += 1
+                        self._window.release()
+
+                    timed_out = time.monotonic() - last_flush >= self.flush_interval
+                    if len(batch_matches) >= self.batch_size or (timed_out and len(batch_matches) > 0):
+                        self._flush(f, batch_lines, batch_matches)
+                        last_flush = time.monotonic()
+
+                # Matches that never got their turn because an earlier one is missing are still written, in order
+                for index in sorted(pending):
+                    self._add_to_batch(*pending.pop(index), batch_lines, batch_matches)
+
+                self._flush(f, batch_lines, batch_matches)
+        except BaseException as e: # pylint: disable=broad-except
+            self._error = e
+
+            # Producers already blocked on the full queue would wait forever, what they send is dropped until close
+            while not closing:
+                closing = self._queue.get() is None
+
+    def _add_to_batch(self, match_id, games: list[GameResult], error: BaseException, batch_lines: list[str], batch_matches: list[tuple]) -> None:
+        if error is not None:
+            self.failures.append((str(match_id), repr(error)))
+            return
+
+        # Matches without games (e.g. not played yet) are not recorded so they are scraped again next time
+        new_games = [game for game in games if not self.manifest.is_game_done(match_id, game.game_id)]
+        if len(new_games) > 0:
+            batch_lines.extend(json.dumps(asdict(game)) + "\n" for game in new_games)
+            batch_matches.append((match_id, [game.game_id for game in new_games]))
+
+    def _flush(self, file, batch_lines: list[str], batch_matches: list[tuple]) -> None:
+        if len(batch_matches) == 0:
+            return
+
+        file.write("".join(batch_lines))
+        file.flush()
+
+        # The manifest is only updated after the games are safely in the output file
+        self.manifest.record_batch(batch_matches, file.tell())
+
+        self.n_matches += len(batch_matches)
+        self.n_games += len(batch_lines)
+        batch_lines.clear()
+        batch_matches.clear()
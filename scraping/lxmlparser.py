@@ -0,0 +1,152 @@
+import re
+from lxml import etree, html
+
+from scraping.datamodels import TeamGameResult, PlayerGameResult, GameResult
+
+def _has_class(name: str) -> str:
+    """XPath predicate equivalent to BeautifulSoup's class matching"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+# Regexes used to cut the regions we care about out of the page before building any tree
+_MATCH_HEADER_RE = re.compile(r"<div[^>]*\sclass=\"(?:[^\"]*\s)?match-header-vs(?:\s[^\"]*)?\"")
+_VM_STATS_RE = re.compile(r"<div[^>]*\sclass=\"(?:[^\"]*\s)?vm-stats(?:\s[^\"]*)?\"")
+
+_MATCH_HEADER = etree.XPath(f"(//div[{_has_class('match-header-vs')}])[1]")
+_TEAM_NAMES = etree.XPath(f".//div[{_has_class('wf-title-med')}]")
+_VM_STATS = etree.XPath(f"(//div[{_has_class('vm-stats')}])[1]")
+_GAMES_NAV = etree.XPath(f".//div[{_has_class('vm-stats-gamesnav-item')}]")
+_GAMES = etree.XPath(f".//div[{_has_class('vm-stats-game')}]")
+_SCORES = etree.XPath(f".//div[{_has_class('score')}]")
+_TBODIES = etree.XPath(".//tbody")
+_ROWS = etree.XPath(".//tr")
+_CELLS = etree.XPath(".//td")
+_TEAM_NAME = etree.XPath(f"(.//div[{_has_class('ge-text-light')}])[1]")
+_PLAYER_NAME = etree.XPath(f"(.//div[{_has_class('text-of')}])[1]")
+_AGENT_IMG = etree.XPath("(.//img)[1]")
+_STAT_SIDES = etree.XPath(
+    f"(.//span[{_has_class('stats-sq')}])[1]"
+    f"/descendant::span[{_has_class('mod-t')} or {_has_class('mod-ct')}]"
+)
+
+# Position of each stat in the scoreboard columns
+_STAT_COLUMNS = { "acs": 0, "kills": 1, "deaths": 2, "assists": 3, "kast": 5, "adr": 6, "hs": 7, "fk": 8, "fd": 9 }
+
+class LxmlMatchParser:
+    """Fast match page parser that only builds trees for the header and `vm-stats` regions of the page.
+
+    Returns exactly the same results as the BeautifulSoup parser of VLRScraper.
+    """
+
+    def parse_match_page(self, match_id: int, content: bytes | str) -> list[GameResult]:
+        """Parses a match page into its game results"""
+        if isinstance(content, bytes):
+            content = content.decode("utf-8", errors="replace")
+
+        header_root, stats_root = self._get_regions(content)
+
+        # Get team names
+        match_header = _first(_MATCH_HEADER(header_root))
+        [team_a_name, team_b_name] = [tn.text_content().strip() for tn in _TEAM_NAMES(match_header)]
+
+        # Get played maps
+        stats_html = _first(_VM_STATS(stats_root))
+        match_maps = self._get_match_played_maps(stats_html)
+
+        # Get game results
+        game_results: list[GameResult] = []
+
+        if len(match_maps) == 0:
+            return game_results
+
+        for played_map in _GAMES(stats_html):
+            game_id = played_map.attrib["data-game-id"]
+            if game_id == "all":
+                continue
+
+            # Get team scores
+            [score_a, score_b] = [s.text_content().strip() for s in _SCORES(played_map)]
+            map_name = match_maps.get(game_id)
+
+            # Get player game stats/info
+            teams_players = [[], []]
+            for team_i, row_html in enumerate(_TBODIES(played_map)):
+                for player_html in _ROWS(row_html):
+                    teams_players[min(team_i, 1)].append(self._get_player_game_result(player_html))
+
+            [team_a_players, team_b_players] = teams_players
+            if len(team_a_players) != 5 or len(team_b_players) != 5:
+                continue
+
+            game_results.append(GameResult(
+                match_id=match_id,
+                game_id=game_id,
+                map_name=map_name,
+                team_a=TeamGameResult(team=team_a_name, score=score_a, players=team_a_players),
+                team_b=TeamGameResult(team=team_b_name, score=score_b, players=team_b_players),
+            ))
+
+        return game_results
+
+    def _get_regions(self, content: str):
+        """Returns the parsed trees containing the match header and the game stats"""
+        header_match = _MATCH_HEADER_RE.search(content)
+        stats_match = _VM_STATS_RE.search(content)
+
+        # If the page doesn't have the expected layout we fall back to parsing all of it
+        if header_match is None or stats_match is None or header_match.start() > stats_match.start():
+            root = html.document_fromstring(content)
+            return root, root
+
+        header_root = html.document_fromstring(content[header_match.start():stats_match.start()])
+        stats_root = html.document_fromstring(content[stats_match.start():])
+        return header_root, stats_root
+
+    def _get_player_game_result(self, player_html) -> PlayerGameResult:
+        # Single pass over the row cells, splitting them by their type
+        player_info = None
+        agent_info = None
+        stat_cells = []
+        for cell in _CELLS(player_html):
+            classes = cell.get("class", "").split()
+            if "mod-stat" in classes:
+                stat_cells.append(cell)
+            elif player_info is None and "mod-player" in classes:
+                player_info = cell
+            elif agent_info is None and "mod-agents" in classes:
+                agent_info = cell
+
+        team_name = _first(_TEAM_NAME(player_info)).text_content().strip()
+        agent_name = _first(_AGENT_IMG(agent_info)).attrib["title"]
+        player_name = _first(_PLAYER_NAME(player_info)).text_content().strip()
+
+        stats = { stat: self._get_stat(stat_cells[column]) for stat, column in _STAT_COLUMNS.items() }
+        return PlayerGameResult(player=player_name, team=team_name, agent=agent_name, **stats)
+
+    def _get_stat(self, stat_html) -> dict[str, int]:
+        atk_stat = None
+        def_stat = None
+        for side in _STAT_SIDES(stat_html):
+            classes = side.get("class", "").split()
+            if atk_stat is None and "mod-t" in classes:
+                atk_stat = side.text_content().strip()
+            if def_stat is None and "mod-ct" in classes:
+                def_stat = side.text_content().strip()
+
+        atk_stat = int(atk_stat.replace("%", "")) if atk_stat else 0
+        def_stat = int(def_stat.replace("%", "")) if def_stat else 0
+        return { "atk": atk_stat, "def": def_stat }
+
+    def _get_match_played_maps(self, stats_html) -> dict[str, str]:
+        match_maps = {}
+        for played_map in _GAMES_NAV(stats_html):
+            game_id = played_map.attrib["data-game-id"]
+            if game_id == "all":
+                continue
+
+            map_name = played_map.text_content().strip().replace("\n", "").replace("\t", "")
+            map_name = "".join(c for c in map_name if not c.isdigit())
+            match_maps.setdefault(game_id, map_name)
+        return match_maps
+
+def _first(elements: list):
+    return elements[0] if len(elements) > 0 else None
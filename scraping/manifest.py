@@ -0,0 +1,92 @@
+import os
+import json
+
+class ScrapeManifest:
+    """Append-only log of the games already written to a scraped compositions file.
+
+    Every entry holds the games of one match and the size of the output file right after
+    they were written, so an interrupted run can cut any half-written tail before resuming.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._games: set[tuple[str, str]] = set()
+        self._matches: set[str] = set()
+        self._output_size = 0
+
+        if os.path.exists(self.path):
+            self._load()
+
+    @staticmethod
+    def path_for(outpath: str) -> str:
+        """Returns the manifest path for an output file (data/comps.jsonl -> data/comps.manifest.jsonl)"""
+        root, _ = os.path.splitext(outpath)
+        return f"{root}.manifest.jsonl"
+
+    @property
+    def n_matches(self) -> int:
+        return len(self._matches)
+
+    @property
+    def n_games(self) -> int:
+        return len(self._games)
+
+    def is_match_done(self, match_id) -> bool:
+        return str(match_id) in self._matches
+
+    def is_game_done(self, match_id, game_id) -> bool:
+        return (str(match_id), str(game_id)) in self._games
+
+    def record(self, match_id, game_ids: list, output_size: int) -> None:
+        """Marks the games of a match as written, output_size is the output file size after writing them"""
+        self.record_batch([(match_id, game_ids)], output_size)
+
+    def record_batch(self, matches: list[tuple], output_size: int) -> None:
+        """Marks the games of several (match_id, game_ids) pairs as written with a single write"""
+        entries = [
+            { "match_id": str(match_id), "game_ids": [str(game_id) for game_id in game_ids], "output_size": output_size }
+            for match_id, game_ids in matches
+        ]
+
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+
+        for entry in entries:
+            self._add(entry)
+
+    def clear(self) -> None:
+        """Forgets all the recorded games"""
+        open(self.path, "w", encoding="utf-8").close()
+        self._games.clear()
+        self._matches.clear()
+        self._output_size = 0
+
+    def repair_output(self, outpath: str) -> None:
+        """Cuts whatever was written to the output file after the last recorded match"""
+        if not os.path.exists(outpath):
+            open(outpath, "w", encoding="utf-8").close()
+            return
+
+        if os.path.getsize(outpath) > self._output_size:
+            with open(outpath, "r+b") as f:
+                f.truncate(self._output_size)
+
+    def _load(self) -> None:
+        complete_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                # A line without its newline was being written when the last run was interrupted
+                if not line.endswith(b"\n"):
+                    break
+                self._add(json.loads(line))
+                complete_size += len(line)
+
+        # The next entries would be appended to the torn line otherwise
+        if os.path.getsize(self.path) > complete_size:
+            with open(self.path, "r+b") as f:
+                f.truncate(complete_size)
+
+    def _add(self, entry: dict) -> None:
+        self._matches.add(entry["match_id"])
+        self._games.update((entry["match_id"], game_id) for game_id in entry["game_ids"])
+        self._output_size = max(self._output_size, entry["output_size"])
@@ -0,0 +1,93 @@
+import os
+import json
+import gzip
+import time
+import hashlib
+import tempfile
+
+# How long (in seconds) a cached page stays valid for each kind of URL. None means forever, the scrapers only
+# cache the pages of finished matches.
+DEFAULT_TTLS: dict[str, float | None] = {
+    "match": None,
+    "event": 6 * 60 * 60,
+}
+
+class PageNotCachedError(LookupError):
+    """Raised when a page is requested in offline mode but it is not in the cache"""
+
+    def __init__(self, url: str):
+        super().__init__(f"Page not cached: {url}")
+        self.url = url
+
+class PageCache:
+    """Content-addressed, gzip compressed on-disk cache of downloaded pages.
+
+    Page bodies are stored once per content hash under `blobs/` and every URL has a
+    small index entry under `index/` pointing to the blob it resolved to last time.
+    """
+
+    def __init__(self, cache_dir: str, ttls: dict[str, float | None] = None):
+        self.cache_dir = cache_dir
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+
+        os.makedirs(os.path.join(self.cache_dir, "index"), exist_ok=True)
+        os.makedirs(os.path.join(self.cache_dir, "blobs"), exist_ok=True)
+
+    def get(self, url: str, kind: str = None, ignore_ttl: bool = False) -> bytes | None:
+        """Returns the cached page of an URL or None if it is missing or expired"""
+        entry = self._read_entry(url)
+        if entry is None:
+            return None
+
+        ttl = self.ttls.get(kind if kind is not None else entry["kind"])
+        if not ignore_ttl and ttl is not None and time.time() - entry["fetched_at"] > ttl:
+            return None
+
+        blob_path = self._blob_path(entry["sha256"])
+        if not os.path.exists(blob_path):
+            return None
+
+        with gzip.open(blob_path, "rb") as f:
+            return f.read()
+
+    def put(self, url: str, content: bytes, kind: str = None) -> None:
+        """Stores a page in the cache"""
+        sha256 = hashlib.sha256(content).hexdigest()
+
+        # Identical pages share the same blob, so we only write it once
+        blob_path = self._blob_path(sha256)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            self._atomic_write(blob_path, gzip.compress(content))
+
+        entry = { "url": url, "kind": kind, "sha256": sha256, "fetched_at": time.time() }
+        self._atomic_write(self._entry_path(url), json.dumps(entry).encode("utf-8"))
+
+    def invalidate(self, url: str) -> None:
+        """Removes the index entry of an URL (the blob is kept as other URLs may share it)"""
+        entry_path = self._entry_path(url)
+        if os.path.exists(entry_path):
+            os.remove(entry_path)
+
+    def _read_entry(self, url: str) -> dict | None:
+        entry_path = self._entry_path(url)
+        if not os.path.exists(entry_path):
+            return None
+
+        with open(entry_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _entry_path(self, url: str) -> str:
+        url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "index", url_hash[:2], f"{url_hash}.json")
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.cache_dir, "blobs", sha256[:2], f"{sha256}.gz")
+
+    def _atomic_write(self, path: str, data: bytes) -> None:
+        # Writing to a temporary file and renaming it means concurrent readers never see partial files
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
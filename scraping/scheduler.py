@@ -0,0 +1,247 @@
+import time
+import random
+import asyncio
+import threading
+import collections
+
+from utils import metrics
+
+# Statuses of a server that is overloaded or rate limiting, the request can succeed later
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class PageDownloadError(Exception):
+    """A page couldn't be downloaded, status is None when no response was received (connection error, timeout)"""
+
+    def __init__(self, url: str, status: int = None, retry_after: float = None):
+        super().__init__(f"{url} returned {status}" if status is not None else f"{url} couldn't be reached")
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status is None or self.status in RETRY_STATUSES
+
+class AIMDController:
+    """Concurrency limit that grows by `increase` for every window of `limit` fast successes, and is multiplied
+    by `decrease` when the server throttles, its latency goes over `latency_tolerance` times the baseline or
+    more than `error_tolerance` of the recent requests failed.
+
+    The baseline is the lowest latency seen, slowly drifting up so it follows a server that got slower for good.
+    Decreases happen at most once per smoothed latency, so a burst of concurrent failures counts once. Errors
+    only count past the tolerance since a few of them happen whatever the load, unlike throttling.
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        latency_tolerance: float = 3.0,
+        error_tolerance: float = 0.2,
+        baseline_drift: float = 1.01
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.error_tolerance = error_tolerance
+        self.baseline_drift = baseline_drift
+        self.baseline: float = None
+        self.smoothed_latency: float = None
+        self.error_rate = 0.0
+        self._last_decrease = float("-inf")
+
+    def on_success(self, latency: float, now: float) -> None:
+        self.baseline = latency if self.baseline is None else min(latency, self.baseline * self.baseline_drift)
+        self.smoothed_latency = latency if self.smoothed_latency is None else 0.9 * self.smoothed_latency + 0.1 * latency
+        self.error_rate *= 0.98
+
+        if latency > self.latency_tolerance * self.baseline:
+            self._decrease(now)
+        else:
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+
+    def on_throttle(self, now: float) -> None:
+        self._decrease(now)
+
+    def on_error(self, now: float) -> None:
+        self.error_rate = 0.98 * self.error_rate + 0.02
+        if self.error_rate > self.error_tolerance:
+            self._decrease(now)
+
+    def _decrease(self, now: float) -> None:
+        if now - self._last_decrease < (self.smoothed_latency or 0.0):
+            return
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        self._last_decrease = now
+
+class TokenBucket:
+    """Allows `rate` requests per second on average with bursts of up to `burst` requests"""
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def reserve(self, now: float) -> float:
+        """Takes a token and returns how long to wait before it's available"""
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+class RequestScheduler:
+    """Runs the downloads of a scraper under an adaptive concurrency limit and a rate limit, retrying failures.
+
+    Retryable failures (throttling, server errors, connection errors) are retried up to max_attempts times after
+    a jittered exponential backoff, or the delay asked for by Retry-After if it's longer. Other failures and
+    the last attempt raise. Thread safe, see AsyncRequestScheduler for coroutines.
+    """
+
+    def __init__(
+        self,
+        controller: AIMDController = None,
+        bucket: TokenBucket = None,
+        max_attempts: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 60.0,
+        seed: int = None
+    ):
+        self.controller = controller or AIMDController()
+        self.bucket = bucket
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.in_flight = 0
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._rng = random.Random(seed)
+
+    def call(self, fn, *args):
+        """Returns fn(*args), called once a slot is free and retried on retryable PageDownloadError"""
+        attempt = 0
+        while True:
+            with self._slot_freed:
+                self._slot_freed.wait_for(self._has_slot)
+                delay = self._start()
+
+            # The slot is released whatever fn raises, a leaked one would lower the limit for good
+            try:
+                time.sleep(delay)
+                start = time.monotonic()
+                try:
+                    result = fn(*args)
+                except PageDownloadError as e:
+                    with self._lock:
+                        delay = self._finish(time.monotonic() - start, e, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    with self._lock:
+                        self._finish(time.monotonic() - start, None, attempt)
+                    return result
+            finally:
+                with self._slot_freed:
+                    self.in_flight -= 1
+                    self._slot_freed.notify_all()
+
+            time.sleep(delay)
+            attempt += 1
+
+    def summary(self) -> str:
+        return (
+            f"{self.counts['requests']} requests, {self.counts['retries']} retries, {self.counts['throttled']} throttled, "
+            f"{self.counts['errors']} server or connection errors, {self.counts['failed']} failed, concurrency limit {self.controller.limit:.1f}"
+        )
+
+    def _has_slot(self) -> bool:
+        return self.in_flight < int(self.controller.limit)
+
+    def _start(self) -> float:
+        """Takes a slot and returns how long to wait for the rate limit, called with the lock held"""
+        self.in_flight += 1
+        self.counts["requests"] += 1
+        return self.bucket.reserve(time.monotonic()) if self.bucket is not None else 0.0
+
+    def _finish(self, latency: float, error: PageDownloadError | None, attempt: int) -> float | None:
+        """Updates the limit, returns the delay before a retry or None if the error is final, called with the lock held"""
+        now = time.monotonic()
+
+        if error is None:
+            self.controller.on_success(latency, now)
+            metrics.set_gauge("scrape_concurrency_limit", self.controller.limit)
+            return None
+
+        if error.status == 429:
+            self.counts["throttled"] += 1
+            self.controller.on_throttle(now)
+        elif error.retryable:
+            self.counts["errors"] += 1
+            self.controller.on_error(now)
+        metrics.set_gauge("scrape_concurrency_limit", self.controller.limit)
+
+        if not error.retryable or attempt + 1 >= self.max_attempts:
+            self.counts["failed"] += 1
+            metrics.inc("scrape_request_failures", status=error.status)
+            return None
+
+        self.counts["retries"] += 1
+        metrics.inc("scrape_retries", status=error.status)
+
+        # Full jitter spreads out the retries of requests that failed together
+        delay = self._rng.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        return max(delay, error.retry_after or 0.0)
+
+class AsyncRequestScheduler(RequestScheduler):
+    """RequestScheduler for coroutines, must be used from a single event loop"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._async_slot_freed = asyncio.Condition()
+
+    async def call(self, fn, *args):
+        """Returns await fn(*args), awaited once a slot is free and retried on retryable PageDownloadError"""
+        attempt = 0
+        while True:
+            async with self._async_slot_freed:
+                await self._async_slot_freed.wait_for(self._has_slot)
+                with self._lock:
+                    delay = self._start()
+
+            # Also released when the task is cancelled while waiting for the rate limit or the response
+            try:
+                await asyncio.sleep(delay)
+                start = time.monotonic()
+                try:
+                    result = await fn(*args)
+                except PageDownloadError as e:
+                    with self._lock:
+                        delay = self._finish(time.monotonic() - start, e, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    with self._lock:
+                        self._finish(time.monotonic() - start, None, attempt)
+                    return result
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                async with self._async_slot_freed:
+                    self._async_slot_freed.notify_all()
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Returns the seconds of a Retry-After header, only the delay form is supported"""
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
@@ -1,18 +1,94 @@
+import re
 import requests
 from bs4 import BeautifulSoup
 
 from scraping.datamodels import Match, TeamGameResult, PlayerGameResult, GameResult
+from scraping.pagecache import PageCache, PageNotCachedError
+from scraping.scheduler import RequestScheduler, PageDownloadError, parse_retry_after
+from utils import metrics
+
+# Available backends for parsing match pages
+MATCH_PARSERS = ["bs4", "lxml"]
+
+# First note of the match header, "final" once the match is over, "live" or a countdown before
+_MATCH_STATUS_RE = re.compile(rb"<[a-z]+[^>]*\sclass=\"match-header-vs-note(?:\s[^\"]*)?\"[^>]*>\s*([^<]*?)\s*<")
 
 class VLRScraper:
-    def __init__(self):
-        pass
+    def __init__(
+        self,
+        cache: PageCache = None,
+        offline: bool = False,
+        base_url: str = "https://www.vlr.gg",
+        max_connections: int = 16,
+        parser: str = "bs4",
+        scheduler: RequestScheduler = None,
+        timeout: float = 30.0
+    ):
+        if offline and cache is None:
+            raise ValueError("Offline mode requires a page cache")
+
+        if parser not in MATCH_PARSERS:
+            raise ValueError(f"Unknown parser '{parser}', expected one of {MATCH_PARSERS}")
+
+        self.cache = cache
+        self.offline = offline
+        self.base_url = base_url.rstrip("/")
+        self.parser = parser
+        self.scheduler = scheduler
+        self.timeout = timeout
+
+        # lxml is only needed by its own parser
+        self._lxml_parser = None
+        if parser == "lxml":
+            from scraping.lxmlparser import LxmlMatchParser
+            self._lxml_parser = LxmlMatchParser()
+
+        self.session = self._create_session(max_connections)
 
     def get_match_info(self, match_id: int):
         """Get info of a specific match from VLR.gg"""
 
         # Download match page and parse it
-        target_url = f"https://www.vlr.gg/{match_id}"
-        content = requests.get(target_url).content
+        target_url = self._match_url(match_id)
+        content = self._get_page(target_url, kind="match")
+
+        # Games of live matches are only written once the match is over, so it's never recorded half played
+        if not is_match_finished(content):
+            metrics.inc("scrape_unfinished_matches")
+            self._forget_page(target_url)
+            return []
+
+        with metrics.timer("scrape_parse_seconds", kind="match", parser=self.parser):
+            game_results = self._parse_match_page(match_id, content)
+        metrics.inc("scrape_games", len(game_results))
+
+        # Matches that were not played yet have no games, so they must be downloaded again later
+        if len(game_results) == 0:
+            self._forget_page(target_url)
+
+        return game_results
+
+    def get_event_matches(self, event_id: int):
+        """Get all matches of a specific event from VLR.gg"""
+
+        # Download event page and parse it
+        target_url = self._event_url(event_id)
+        content = self._get_page(target_url, kind="event")
+        with metrics.timer("scrape_parse_seconds", kind="event", parser="bs4"):
+            return self._parse_event_page(content)
+
+    def _match_url(self, match_id: int) -> str:
+        return f"{self.base_url}/{match_id}"
+
+    def _event_url(self, event_id: int) -> str:
+        return f"{self.base_url}/event/matches/{event_id}/?series_id=all"
+
+    def _parse_match_page(self, match_id: int, content: bytes) -> list[GameResult]:
+        if self._lxml_parser is not None:
+            return self._lxml_parser.parse_match_page(match_id, content)
+        return self._parse_match_page_soup(match_id, content)
+
+    def _parse_match_page_soup(self, match_id: int, content: bytes) -> list[GameResult]:
         soup = BeautifulSoup(content, "html.parser")
 
         # Get team names
@@ -65,24 +141,78 @@ class VLRScraper:
 
         return game_results
 
-    def get_event_matches(self, event_id: int):
-        """Get all matches of a specific event from VLR.gg"""
-
-        # Download event page and parse it
-        target_url = f"https://www.vlr.gg/event/matches/{event_id}/?series_id=all"
-        content = requests.get(target_url).content
+    def _parse_event_page(self, content: bytes) -> list[Match]:
         soup = BeautifulSoup(content, "html.parser")
 
-        # Get matches info
+        # Every day is a date label followed by the card of its matches, both are found in a single walk of the
+        # page in document order. The card before the first label (the filters) has no date and is skipped.
         matches: list[Match] = []
-        dates = soup.find_all("div", { "class": "wf-label mod-large" })
-        for (day, date) in enumerate(dates):
-            date = date.get_text().strip()
-            matches_on_day = soup.find_all("div", { "class": "wf-card" })[day + 1]
-            matches.extend(self._get_matches(matches_on_day, date))
+        date = None
+        for element in soup.find_all("div", class_=["wf-label", "wf-card"]):
+            classes = element["class"]
+            if "wf-label" in classes and "mod-large" in classes:
+                date = element.get_text().strip()
+            elif "wf-card" in classes and date is not None:
+                matches.extend(self._get_matches(element, date))
+                date = None
 
         return matches
 
+    def _get_page(self, url: str, kind: str) -> bytes:
+        """Downloads a page, going through the page cache when there is one"""
+        if self.cache is not None:
+            with metrics.timer("scrape_cache_read_seconds", kind=kind):
+                content = self.cache.get(url, kind=kind, ignore_ttl=self.offline)
+            if content is not None:
+                metrics.inc("scrape_cache_hits", kind=kind)
+                return content
+
+            if self.offline:
+                raise PageNotCachedError(url)
+
+        if self.scheduler is not None:
+            content = self.scheduler.call(self._download, url, kind)
+        else:
+            content = self._download(url, kind)
+
+        if self.cache is not None and self._is_cacheable(kind, content):
+            self.cache.put(url, content, kind=kind)
+
+        return content
+
+    def _is_cacheable(self, kind: str, content: bytes) -> bool:
+        """Match pages are cached forever, so only the ones of finished matches are"""
+        return kind != "match" or is_match_finished(content)
+
+    def _download(self, url: str, kind: str) -> bytes:
+        """Returns the content of a page, raises PageDownloadError if there is no response or it's not a success"""
+        try:
+            with metrics.timer("scrape_request_seconds", kind=kind):
+                response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            metrics.inc("scrape_requests", kind=kind, status="error")
+            raise PageDownloadError(url) from e
+
+        metrics.inc("scrape_requests", kind=kind, status=response.status_code)
+        metrics.inc("scrape_downloaded_bytes", len(response.content), kind=kind)
+        if not response.ok:
+            raise PageDownloadError(url, response.status_code, parse_retry_after(response.headers.get("Retry-After")))
+        return response.content
+
+    def _create_session(self, max_connections: int) -> requests.Session | None:
+        """Returns the session the pages are downloaded with"""
+        # A shared session keeps connections alive between requests instead of doing a new TLS handshake for each page
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _forget_page(self, url: str) -> None:
+        """Drops a page from the cache so it gets downloaded again next time"""
+        if self.cache is not None and not self.offline:
+            self.cache.invalidate(url)
+
     def _get_player_game_result(self, player_html):
         def get_stat(html, i: int):
             target_stat_html = html.find_all("td", { "class": "mod-stat" })[i]
@@ -135,8 +265,9 @@ class VLRScraper:
             match_time = match_html.find("div", { "class": "match-item-time" }).get_text().strip()
             match_status = match_html.find("div", { "class": "ml-status" }).get_text().strip()
             
-            match_round = match_html.find("div", { "class": "match-item-event text-of" }).get_text().strip().split("\n")[0].strip()
-            match_stage = match_html.find("div", { "class": "match-item-event text-of" }).get_text().strip().split("\n")[1].strip()
+            match_event = match_html.find("div", { "class": "match-item-event text-of" }).get_text().strip().split("\n")
+            match_round = match_event[0].strip()
+            match_stage = match_event[1].strip()
 
             match_teams = []
             teams_html = match_html.find_all("div", { "class": "match-item-vs-team" })
@@ -154,4 +285,15 @@ class VLRScraper:
                 teams=match_teams
             ))
             
-        return match_list
\ No newline at end of file
+        return match_list
+
+
+def match_status(content: bytes) -> str | None:
+    """Returns the lowercase status of a match page ("final", "live"...) or None if the page has none"""
+    status = _MATCH_STATUS_RE.search(content)
+    return status.group(1).decode("utf-8", errors="replace").strip().lower() if status is not None else None
+
+def is_match_finished(content: bytes) -> bool:
+    """Pages without a status (another layout) are trusted to hold finished games, like before statuses were checked"""
+    status = match_status(content)
+    return status is None or status == "final"
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Scripts and packages live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "3")
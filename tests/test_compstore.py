@@ -0,0 +1,28 @@
+import numpy as np
+
+from training.compstore import CompositionStore
+
+def _store(tmp_path, n_rows=6):
+    columns = {
+        "agents": np.zeros((n_rows, 5), dtype=np.int8),
+        "maps": np.zeros(n_rows, dtype=np.int8),
+        "stats": np.zeros((n_rows, 5, 2), dtype=np.float32),
+        "match_id": np.arange(100, 100 + n_rows) // 2,
+        "game_id": np.arange(200, 200 + n_rows) // 2,
+        "team": np.arange(n_rows) % 2,
+        "wr": np.arange(n_rows) / 10,
+    }
+    return CompositionStore(str(tmp_path), columns, ["Team A", "Team B"])
+
+def test_meta_rows(tmp_path):
+    store = _store(tmp_path)
+    meta = store.meta()
+
+    assert len(meta) == 6
+    assert meta[3] == { "match_id": "51", "game_id": "101", "team": "Team B", "wr": 0.3 }
+    assert meta[-1]["team"] == "Team B"
+
+    rows = np.array([4, 1, 4])
+    assert list(store.meta(rows)) == [meta[4], meta[1], meta[4]]
+    assert meta[rows][1:].tolist() == [meta[1], meta[4]]
+    assert list(meta) == [meta[i] for i in range(6)]
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from benchmarks.synthcorpus import generate_corpus
+from inference.embedder import export_embeddings
+from training.checkpointsaver import load_checkpoint, load_checkpoint_arrays, write_checkpoint
+from training.contextualmodel import contextual_autoencoder
+from utils.consts import ALL_AGENTS, ALL_MAPS, ALL_STATS
+
+HPARAMS = { "input_processing_size": 8, "output_processing_size": 8, "layer_a_size": 16, "layer_b_size": 8, "latent_size": 4, "activation": "relu" }
+N_STATS = 2 * len(ALL_STATS)
+
+def test_embeddings_use_the_training_normalization(tmp_path):
+    model = contextual_autoencoder(HPARAMS, len(ALL_MAPS), len(ALL_AGENTS), N_STATS, input_encoding="index")
+    stats_mean, stats_scale = np.linspace(1, 2, N_STATS), np.linspace(3, 4, N_STATS)
+    model_path = str(tmp_path / "model.npz")
+    write_checkpoint(model_path, model.get_weights(), model.to_json(), { "stats_mean": stats_mean, "stats_scale": stats_scale })
+
+    for expected, found in zip(model.get_weights(), load_checkpoint(model_path).get_weights()):
+        np.testing.assert_array_equal(found, expected)
+    assert sorted(load_checkpoint_arrays(model_path)) == ["stats_mean", "stats_scale"]
+
+    comps_path = str(tmp_path / "comps.jsonl")
+    generate_corpus(comps_path, 20, seed=0)
+    store, n_rows = export_embeddings(model_path, comps_path, str(tmp_path / "store"), dtype="float32")
+
+    assert n_rows == len(store) > 0
+    np.testing.assert_allclose(store.stats_mean, stats_mean)
+    np.testing.assert_allclose(store.stats_scale, stats_scale)
+
+def test_checkpoint_arrays_cant_shadow_weights(tmp_path):
+    with pytest.raises(ValueError):
+        write_checkpoint(str(tmp_path / "model.npz"), [np.zeros(2)], "{}", { "arr_0": np.ones(2) })
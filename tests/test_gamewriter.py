@@ -0,0 +1,46 @@
+import json
+import threading
+
+import pytest
+
+from scraping.datamodels import GameResult, PlayerGameResult, TeamGameResult
+from scraping.gamewriter import GameResultWriter
+from scraping.manifest import ScrapeManifest
+
+def game(match_id: int, game_id: int) -> GameResult:
+    stat = { "atk": 1, "def": 2 }
+    players = [PlayerGameResult(f"P{i}", "T", "Jett", stat, stat, stat, stat, stat, stat, stat, stat, stat) for i in range(5)]
+    return GameResult(match_id, game_id, "Bind", TeamGameResult("A", 13, players), TeamGameResult("B", 7, players))
+
+def writer(tmp_path, **kwargs) -> GameResultWriter:
+    outpath = str(tmp_path / "comps.jsonl")
+    return GameResultWriter(outpath, ScrapeManifest(ScrapeManifest.path_for(outpath)), flush_interval=0.05, **kwargs)
+
+def test_matches_are_written_in_index_order(tmp_path):
+    with writer(tmp_path) as w:
+        for index in [2, 0, 1]:
+            w.reserve()
+            w.submit(index, 100 + index, [game(100 + index, 1000 + index)])
+
+    with open(w.outpath, "r", encoding="utf-8") as f:
+        assert [json.loads(line)["match_id"] for line in f] == [100, 101, 102]
+    assert w.manifest.n_matches == 3
+
+def test_producers_fail_instead_of_blocking_when_the_writer_dies(tmp_path):
+    w = writer(tmp_path, max_pending=2)
+    w.start()
+
+    def produce():
+        with pytest.raises(RuntimeError):
+            for index in range(100):
+                w.reserve()
+                # Not a dataclass, the writer thread fails serializing it
+                w.submit(index, index, [object()])
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    producer.join(timeout=10)
+    assert not producer.is_alive()
+
+    with pytest.raises(RuntimeError):
+        w.close()
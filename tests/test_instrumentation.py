@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from training.instrumentation import ThroughputCallback
+
+@pytest.mark.parametrize("steps_per_execution", [1, 3])
+def test_throughput_counts_steps_times_batch_size(steps_per_execution):
+    x = np.random.default_rng(0).normal(size=(120, 4)).astype(np.float32)
+    dataset = tf.data.Dataset.from_tensor_slices((x, x[:, :1])).batch(10)
+
+    model = tf.keras.Sequential([tf.keras.Input((4,)), tf.keras.layers.Dense(1)])
+    model.compile(optimizer="sgd", loss="mse", steps_per_execution=steps_per_execution)
+    throughput = ThroughputCallback(10, verbose=False)
+    model.fit(dataset, validation_data=dataset, epochs=3, verbose=0, callbacks=[throughput])
+
+    assert throughput.epoch_examples == [120, 120, 120]
+    assert len(throughput.epoch_seconds) == 3
+    assert throughput.samples_per_second > 0
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from inference.knnindex import IVFIndex, exact_search
+
+def test_more_lists_than_rows():
+    vectors = np.random.default_rng(0).normal(size=(10, 4)).astype(np.float32)
+    index = IVFIndex.build(vectors, n_lists=20)
+
+    assert index.n_lists == 10
+    assert len(index) == 10
+    distances, indices = index.search(vectors[:3], k=2, nprobe=20)
+    expected_distances, expected_indices = exact_search(vectors, vectors[:3], k=2)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distances, expected_distances, atol=1e-5)
+
+def test_empty_vectors():
+    with pytest.raises(ValueError, match="without vectors"):
+        IVFIndex.build(np.zeros((0, 4), dtype=np.float32))
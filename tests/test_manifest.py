@@ -0,0 +1,15 @@
+from scraping.manifest import ScrapeManifest
+
+def test_torn_last_line_is_cut_before_appending(tmp_path):
+    path = str(tmp_path / "comps.manifest.jsonl")
+    ScrapeManifest(path).record(1, [10, 11], 100)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"match_id": "2", "game')
+
+    manifest = ScrapeManifest(path)
+    assert manifest.n_matches == 1
+    manifest.record(3, [30], 200)
+
+    manifest = ScrapeManifest(path)
+    assert manifest.is_match_done(1) and manifest.is_match_done(3) and not manifest.is_match_done(2)
+    assert manifest.n_games == 3
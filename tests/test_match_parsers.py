@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+from scraping.lxmlparser import LxmlMatchParser
+from scraping.vlrscraper import VLRScraper
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+MATCH_PAGES = sorted(name for name in os.listdir(FIXTURES) if name.startswith("match_"))
+
+def read_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+@pytest.mark.parametrize("name", MATCH_PAGES)
+def test_lxml_and_bs4_parsers_agree(name):
+    content = read_fixture(name)
+    expected = VLRScraper(parser="bs4")._parse_match_page(131279, content)
+    assert LxmlMatchParser().parse_match_page(131279, content) == expected
+    assert LxmlMatchParser().parse_match_page(131279, content.decode("utf-8")) == expected
+
+def test_parsed_values():
+    games = VLRScraper(parser="bs4")._parse_match_page(131279, read_fixture("match_final.html"))
+
+    assert [(game.game_id, game.map_name) for game in games] == [("131900", "Lotus"), ("131901", "Split"), ("131902", "Ascent")]
+    assert (games[0].team_a.team, games[0].team_b.team) == ("NRG Esports", "FNATIC")
+    player = games[0].team_a.players[2]
+    assert (player.player, player.team) == ("NRGplayer2", "NRG")
+    # Empty sides count as 0 and percentages are parsed as integers
+    assert player.kast["atk"] == 0
+    assert isinstance(player.hs["def"], int)
+
+@pytest.mark.parametrize("name, n_games", [
+    ("match_incomplete_team.html", 1),
+    ("match_unplayed_map.html", 2),
+    ("match_no_maps.html", 0),
+    ("match_stats_before_header.html", 1),
+])
+def test_skipped_games(name, n_games):
+    assert len(VLRScraper(parser="lxml")._parse_match_page(131279, read_fixture(name))) == n_games
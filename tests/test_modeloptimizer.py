@@ -0,0 +1,60 @@
+import json
+import sqlite3
+
+import pytest
+
+pytest.importorskip("tensorflow")
+
+from tensorboard.plugins.hparams import api as hp
+
+from training.modeloptimizer import ModelOptimizer
+from training.tpesampler import TPESampler
+from training.trialledger import TrialLedger
+
+def test_real_hparams_are_rounded_before_keying(tmp_path):
+    dropout = hp.HParam("dropout", hp.RealInterval(0.1, 0.33))
+    units = hp.HParam("units", hp.Discrete([8, 16]))
+    ledger = TrialLedger(str(tmp_path / "trials.sqlite"))
+    optimizer = ModelOptimizer(
+        factory=None, hyperparams=[dropout, units], losses="mse", metrics=["mae"], model_out_dir=str(tmp_path),
+        ledger=ledger, sampler=TPESampler(n_startup_trials=4, seed=0), real_decimals=2
+    )
+
+    trained = []
+    for i in range(12):
+        hparams, trial_id = optimizer._next_trial()
+        ledger.finish_trial(trial_id, [], { "val_loss": abs(hparams[dropout] - 0.2) + i * 1e-3 })
+        trained.append(hparams[dropout])
+
+    assert all(value == round(value, 2) for value in trained)
+    assert len(ledger) == len(trained)
+
+    rows = sqlite3.connect(ledger.path).execute("SELECT hparams FROM trials ORDER BY id").fetchall()
+    assert [json.loads(row[0])["dropout"] for row in rows] == trained
+
+def test_early_stopping_patience_counts_across_rungs(tmp_path):
+    import numpy as np
+    import tensorflow as tf
+
+    from training.trialscheduler import SuccessiveHalvingScheduler
+
+    def factory(hparams):
+        # No trainable weight, the loss never improves after the first epoch
+        inputs = tf.keras.Input((2,))
+        dense = tf.keras.layers.Dense(hparams["units"], trainable=False)
+        return tf.keras.Model(inputs, dense(inputs))
+
+    ledger = TrialLedger(str(tmp_path / "trials.sqlite"))
+    optimizer = ModelOptimizer(
+        factory=factory, hyperparams=[hp.HParam("units", hp.Discrete([1]))], losses="mse", metrics=["mae"],
+        model_out_dir=str(tmp_path), early_stopping_patience=3, ledger=ledger,
+        scheduler=SuccessiveHalvingScheduler(n_configs=1, min_epochs=2, max_epochs=8, reduction_factor=2)
+    )
+    x = np.random.default_rng(0).normal(size=(32, 2)).astype(np.float32)
+    dataset = tf.data.Dataset.from_tensor_slices((x, x[:, :1]))
+
+    # Rungs at 2, 4 and 8 epochs: the first epoch is the best one, patience runs out at the end of the second
+    # rung and training stops after the first epoch of the third, patience restarting at every rung would train 8
+    optimizer.run_iteration(dataset, dataset, batch_size=16)
+    epochs = sqlite3.connect(ledger.path).execute("SELECT epochs FROM trials").fetchall()
+    assert epochs == [(5,)]
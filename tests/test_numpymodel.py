@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from inference.embedder import latent_encoder
+from inference.numpyexport import _convert, to_numpy_model
+from inference.numpymodel import NumpyModel
+from training.checkpointsaver import write_checkpoint
+from training.contextualmodel import contextual_autoencoder
+
+HPARAMS = {
+    "input_processing_size": 8,
+    "output_processing_size": 8,
+    "layer_a_size": 16,
+    "layer_b_size": 8,
+    "latent_size": 4,
+    "dropout": 0.2,
+    "activation": "relu",
+}
+N_MAPS, N_AGENTS, N_STATS = 5, 7, 6
+
+def tiny_model(encoding: str) -> tf.keras.Model:
+    """A contextual autoencoder with random BatchNormalization statistics, so folding them is actually tested"""
+    tf.random.set_seed(0)
+    model = contextual_autoencoder(HPARAMS, N_MAPS, N_AGENTS, N_STATS, input_encoding=encoding)
+    rng = np.random.default_rng(0)
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.BatchNormalization):
+            gamma, beta, mean, variance = layer.get_weights()
+            layer.set_weights([
+                rng.uniform(0.5, 2.0, gamma.shape).astype(np.float32),
+                rng.normal(0, 0.5, beta.shape).astype(np.float32),
+                rng.normal(0, 0.5, mean.shape).astype(np.float32),
+                rng.uniform(0.5, 2.0, variance.shape).astype(np.float32),
+            ])
+    return model
+
+def random_inputs(encoding: str, n: int = 64) -> list[np.ndarray]:
+    rng = np.random.default_rng(1)
+    agents = rng.integers(0, N_AGENTS, size=(n, 4))
+    maps = rng.integers(0, N_MAPS, size=n)
+    stats = rng.normal(size=(n, 4, N_STATS)).astype(np.float32)
+    if encoding == "onehot":
+        return [np.eye(N_AGENTS, dtype=np.float32)[agents], np.eye(N_MAPS, dtype=np.float32)[maps], stats]
+    return [agents.astype(np.int32), maps.astype(np.int32), stats]
+
+@pytest.mark.parametrize("encoding", ["index", "onehot"])
+def test_numpy_model_matches_keras(encoding):
+    model = tiny_model(encoding)
+    numpy_model = NumpyModel(*_convert(model))
+    inputs = random_inputs(encoding)
+
+    assert numpy_model.input_encoding == encoding
+    for expected, found in zip(model.predict(inputs, verbose=0), numpy_model.predict(inputs, batch_size=16)):
+        np.testing.assert_allclose(found, expected, atol=1e-5)
+    np.testing.assert_allclose(numpy_model.encode(inputs, batch_size=16), latent_encoder(model).predict(inputs, verbose=0), atol=1e-5)
+
+def test_to_numpy_model_from_checkpoint(tmp_path):
+    model = tiny_model("index")
+    path = str(tmp_path / "model.npz")
+    write_checkpoint(path, model.get_weights(), model.to_json())
+
+    numpy_model, error = to_numpy_model(path, n_parity=64)
+    assert error < 1e-4
+
+    saved = str(tmp_path / "model.numpy.npz")
+    numpy_model.save(saved)
+    inputs = random_inputs("index")
+    np.testing.assert_array_equal(NumpyModel.load(saved).encode(inputs), numpy_model.encode(inputs))
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from scraping.pagecache import PageCache
+from scraping.vlrscraper import VLRScraper, is_match_finished
+
+LIVE_PAGE = b'<div class="match-header-vs"><div class="match-header-vs-score"><span class="match-header-vs-note mod-live">live</span></div></div>'
+FINAL_PAGE = b'<div class="match-header-vs"><div class="match-header-vs-score"><div class="match-header-vs-note"> final </div><div class="match-header-vs-note">Bo3</div></div></div>'
+
+def test_put_get_and_ttl(tmp_path):
+    cache = PageCache(str(tmp_path), ttls={ "event": 0.0, "match": None })
+    cache.put("https://www.vlr.gg/1", b"match", kind="match")
+    cache.put("https://www.vlr.gg/event/1", b"event", kind="event")
+
+    assert cache.get("https://www.vlr.gg/1") == b"match"
+    assert cache.get("https://www.vlr.gg/event/1") is None
+    assert cache.get("https://www.vlr.gg/event/1", ignore_ttl=True) == b"event"
+
+def test_live_matches_are_not_cached_nor_returned(tmp_path):
+    cache = PageCache(str(tmp_path))
+    scraper = VLRScraper(cache=cache)
+    scraper._download = lambda url, kind: LIVE_PAGE
+
+    assert scraper.get_match_info(1) == []
+    assert cache.get(scraper._match_url(1), ignore_ttl=True) is None
+
+def test_match_status():
+    assert is_match_finished(FINAL_PAGE)
+    assert not is_match_finished(LIVE_PAGE)
+    assert not is_match_finished(b'<div class="match-header-vs-note mod-upcoming">2h 10m</div>')
+
+def test_async_live_matches_are_not_cached_nor_returned(tmp_path):
+    pytest.importorskip("aiohttp")
+    from scraping.asyncvlrscraper import AsyncVLRScraper
+
+    async def run():
+        cache = PageCache(str(tmp_path))
+        # The page is in the cache already, getting it again must forget it
+        cache.put("https://www.vlr.gg/1", LIVE_PAGE, kind="match")
+        async with AsyncVLRScraper(cache=cache) as scraper:
+            assert scraper.session is None
+            assert await scraper.get_match_info(1) == []
+        return cache.get("https://www.vlr.gg/1", ignore_ttl=True)
+
+    assert asyncio.run(run()) is None
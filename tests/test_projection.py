@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+
+from inference.embeddingstore import EmbeddingStore
+from inference.projection import ProjectedStore
+
+def _append(store, rng, n):
+    store.append(
+        rng.normal(size=(n, 4)),
+        np.arange(n), np.arange(n), [f"Team {i % 3}" for i in range(n)],
+        np.zeros(n), rng.integers(0, 3, size=n), rng.integers(0, 5, size=n)
+    )
+
+def test_aggregates_of_unfinished_update_are_rebuilt(tmp_path):
+    rng = np.random.default_rng(0)
+    store = EmbeddingStore.create(str(tmp_path), "hash", 4, "float32", np.zeros(2), np.ones(2))
+    _append(store, rng, 50)
+    projected = ProjectedStore.open(store, block_size=16)
+
+    # An update that replaced the aggregates but died before writing its header
+    header_path = os.path.join(projected.path, "header.json")
+    with open(header_path, "rb") as f:
+        header = f.read()
+    _append(store, rng, 30)
+    projected.update(block_size=16)
+    with open(header_path, "wb") as f:
+        f.write(header)
+
+    reopened = ProjectedStore.open(EmbeddingStore.open(str(tmp_path)), block_size=16)
+    assert len(reopened) == 80
+
+    # Every row is counted once, with its own coordinates
+    by_map = reopened.aggregate(["map"])
+    maps = np.asarray(reopened.store.columns["map"])
+    assert by_map["count"].tolist() == [int((maps == code).sum()) for code in by_map["map"]]
+    for code, mean in zip(by_map["map"], by_map["mean"]):
+        np.testing.assert_allclose(mean, reopened.coords[maps == code].mean(axis=0), rtol=1e-5)
@@ -0,0 +1,56 @@
+import asyncio
+import concurrent.futures
+
+import pytest
+
+from benchmarks.recordedserver import FaultyPageServer
+from scraping.scheduler import AIMDController, AsyncRequestScheduler, RequestScheduler
+from scraping.vlrscraper import VLRScraper
+
+def test_no_lost_pages_and_backoff_on_throttling(tmp_path):
+    pytest.importorskip("requests")
+
+    match_ids = list(range(100000, 100080))
+    server = FaultyPageServer(
+        str(tmp_path), latency=0.01, capacity=4, max_in_flight=4, error_rate=0.05, retry_after=0.05, fallback=b"<html></html>"
+    )
+    with server:
+        scheduler = RequestScheduler(AIMDController(initial=16, max_limit=16), max_attempts=20, backoff=0.02, max_backoff=0.2, seed=0)
+        scraper = VLRScraper(base_url=server.url, max_connections=16, scheduler=scheduler)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+            pages = list(executor.map(lambda match_id: scraper._get_page(scraper._match_url(match_id), kind="match"), match_ids))
+
+    assert pages == [b"<html></html>"] * len(match_ids)
+    assert server.counts[200] == len(match_ids)
+    assert server.counts[429] > 0 and scheduler.counts["throttled"] > 0
+    assert scheduler.controller.limit < 16
+    assert scheduler.counts["failed"] == 0
+    assert scheduler.in_flight == 0
+
+def test_slot_released_on_other_exceptions():
+    scheduler = RequestScheduler(AIMDController(initial=1, max_limit=1))
+
+    def fail():
+        raise ValueError("not a download error")
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            scheduler.call(fail)
+        assert scheduler.in_flight == 0
+    assert scheduler.call(lambda: 42) == 42
+
+def test_async_slot_released_on_cancellation():
+    async def run():
+        scheduler = AsyncRequestScheduler(AIMDController(initial=1, max_limit=1))
+        task = asyncio.create_task(scheduler.call(asyncio.sleep, 60))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert scheduler.in_flight == 0
+
+        async def answer():
+            return 42
+        return await asyncio.wait_for(scheduler.call(answer), timeout=5)
+
+    assert asyncio.run(run()) == 42
@@ -0,0 +1,86 @@
+import argparse
+import asyncio
+import time
+
+import pytest
+
+import scrapdata
+from scraping.datamodels import Match
+from scraping.manifest import ScrapeManifest
+from test_gamewriter import game
+
+# Matches of each event, 102 and 201 are also in a later event
+EVENTS = {
+    1: [100, 101, 102],
+    2: [102, 200, 201],
+    3: [201, 300],
+}
+
+def matches(event_id):
+    return [Match(match_id, "", "", "Completed", "", "", []) for match_id in EVENTS[event_id]]
+
+class FakeScraper:
+    """Returns the events after a delay given by delays, to choose which one is downloaded first"""
+
+    delays = {}
+
+    def __init__(self, **kwargs):
+        pass
+
+    def get_event_matches(self, event_id):
+        time.sleep(self.delays[event_id])
+        return matches(event_id)
+
+    def get_match_info(self, match_id):
+        return [game(match_id, match_id * 10)]
+
+class FakeAsyncScraper:
+    delays = {}
+
+    def __init__(self, **kwargs):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def get_event_matches(self, event_id):
+        await asyncio.sleep(self.delays[event_id])
+        return matches(event_id)
+
+    async def get_match_info(self, match_id):
+        return [game(match_id, match_id * 10)]
+
+def scrape(tmp_path, name, use_async, delays):
+    outpath = str(tmp_path / f"{name}.jsonl")
+    parser = argparse.ArgumentParser()
+    scrapdata.add_arguments(parser)
+    args = parser.parse_args(["-o", outpath, "--threads", "4", "--connections", "4", "--rate", "1000"])
+    manifest = ScrapeManifest(ScrapeManifest.path_for(outpath))
+    event_ids = list(EVENTS)
+
+    if use_async:
+        FakeAsyncScraper.delays = delays
+        asyncio.run(scrapdata.main_async(args, event_ids, None, manifest))
+    else:
+        FakeScraper.delays = delays
+        scrapdata.main_threads(args, event_ids, None, manifest)
+
+    with open(outpath, "rb") as f:
+        return f.read()
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_output_does_not_depend_on_event_completion_order(tmp_path, monkeypatch, use_async):
+    if use_async:
+        asyncvlrscraper = pytest.importorskip("scraping.asyncvlrscraper")
+        monkeypatch.setattr(asyncvlrscraper, "AsyncVLRScraper", FakeAsyncScraper)
+    else:
+        monkeypatch.setattr(scrapdata, "VLRScraper", FakeScraper)
+
+    in_order = scrape(tmp_path, "in_order", use_async, { 1: 0.0, 2: 0.1, 3: 0.2 })
+    reversed_order = scrape(tmp_path, "reversed", use_async, { 1: 0.2, 2: 0.1, 3: 0.0 })
+
+    assert in_order == reversed_order
+    assert in_order.count(b"\n") == 6
@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip("tensorflow")
+
+from training.trialledger import TrialLedger
+from training.trialscheduler import ASHAScheduler
+
+def _start_trials(ledger, n):
+    return [ledger.start_trial({ "units": i }) for i in range(n)]
+
+def test_asha_workers_share_rung_values(tmp_path):
+    path = str(tmp_path / "trials.sqlite")
+    worker_a = ASHAScheduler(min_epochs=1, max_epochs=9, reduction_factor=3, ledger=TrialLedger(path))
+    worker_b = ASHAScheduler(min_epochs=1, max_epochs=9, reduction_factor=3, ledger=TrialLedger(path))
+    trial_ids = _start_trials(worker_a.ledger, 3)
+
+    # A good value reported by one worker makes the other stop a trial it would have promoted on its own
+    assert worker_a.should_continue(1, 0.1, trial_ids[0])
+    assert not worker_b.should_continue(1, 0.9, trial_ids[1])
+
+    # A search resumed on the same ledger still knows the values, and a retrained trial replaces its own
+    resumed = ASHAScheduler(min_epochs=1, max_epochs=9, reduction_factor=3, ledger=TrialLedger(path))
+    assert not resumed.should_continue(1, 0.5, trial_ids[2])
+    assert sorted(resumed.ledger.record_rung_value(trial_ids[2], 1, 0.05)) == [0.05, 0.1, 0.9]
+
+def test_asha_without_ledger_keeps_values_in_process():
+    scheduler = ASHAScheduler(min_epochs=1, max_epochs=9, reduction_factor=3)
+    assert scheduler.should_continue(1, 0.5)
+    assert not scheduler.should_continue(1, 0.9)
+    assert scheduler.should_continue(1, 0.1)
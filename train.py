@@ -1,36 +1,130 @@
-from tensorboard.plugins.hparams import api as hp
+import argparse
+import functools
 
-from training.datasetfactory import DatasetFactory
-from training.modeloptimizer import ModelOptimizer
-from training.contextualmodel import contextual_autoencoder
+from utils import metrics
 
-from utils.consts import ALL_AGENTS, ALL_MAPS, ALL_STATS
+# "index" feeds int8 agent/map codes that the model one-hot encodes itself, "onehot" feeds float64 one-hot arrays
+input_encoding = "index"
+agent_loss = "sparse_categorical_crossentropy" if input_encoding == "index" else "categorical_crossentropy"
 
-hparams = [
-    hp.HParam("input_processing_size", hp.Discrete([16, 32, 64])),
-    hp.HParam("output_processing_size", hp.Discrete([16, 32, 64])),
-    hp.HParam("layer_a_size", hp.Discrete([128, 192, 256])),
-    hp.HParam("layer_b_size", hp.Discrete([32, 64, 128])),
-    hp.HParam("latent_size", hp.Discrete([16])),
-    hp.HParam("dropout", hp.RealInterval(0.1, 0.33)),
-    hp.HParam("optimizer", hp.Discrete(["adam", "rmsprop"])),
-    hp.HParam("activation", hp.Discrete(["relu"]))
-]
+# Streaming expands the held out players on the fly instead of keeping 5 copies of every composition in memory
+streaming_dataset = False
+
+# Every trial is recorded here, so configs are never trained twice and an interrupted search picks up where it stopped
+trial_ledger_path = "models/trials.sqlite"
+
+# Number of trials trained at the same time, each in its own process with its own share of the CPUs
+parallel_trials = 1
+
+# Batch size of the trials, the fast mode tunes it
+batch_size = 32
+
+# The fast mode runs this many steps per call into the TensorFlow runtime, casts the batches in the input
+# pipeline and trains with the largest batch size that does as well as the smallest one
+fast_training = False
+fast_steps_per_execution = 32
+
+# XLA compiles every new model, which takes longer than it saves on short trials once the batch size is tuned
+jit_compile = False
+
+def search_space():
+    """Hyperparameters the trials are sampled from"""
+    from tensorboard.plugins.hparams import api as hp
+
+    return [
+        hp.HParam("input_processing_size", hp.Discrete([16, 32, 64])),
+        hp.HParam("output_processing_size", hp.Discrete([16, 32, 64])),
+        hp.HParam("layer_a_size", hp.Discrete([128, 192, 256])),
+        hp.HParam("layer_b_size", hp.Discrete([32, 64, 128])),
+        hp.HParam("latent_size", hp.Discrete([16])),
+        hp.HParam("dropout", hp.RealInterval(0.1, 0.33)),
+        hp.HParam("optimizer", hp.Discrete(["adam", "rmsprop"])),
+        hp.HParam("activation", hp.Discrete(["relu"]))
+    ]
+
+def trial_scheduler():
+    from training.trialscheduler import ASHAScheduler
+
+    # Stops trials whose val_loss is not in the best third of their peers after 3, 9, 27 and 81 epochs
+    return ASHAScheduler(min_epochs=3, max_epochs=243, reduction_factor=3)
+
+def batch_tuner():
+    from training.batchtuner import BatchSizeTuner
+
+    # Batch sizes whose val_loss after 3 epochs is within 2% of the one of batches of 32
+    return BatchSizeTuner(batch_sizes=(32, 64, 128, 256, 512, 1024, 2048), epochs=3, tolerance=0.02, lr_scaling="sqrt")
 
 def ContextualAutoencoder(hparams):
-    return contextual_autoencoder(hparams, len(ALL_MAPS), len(ALL_AGENTS), 2 * len(ALL_STATS))
-
-optimizer = ModelOptimizer(
-    factory=ContextualAutoencoder,
-    hyperparams=hparams,
-    losses={ "agent": "categorical_crossentropy", "stat": "mse" },
-    metrics={ "agent": "accuracy", "stat": "mse" },
-    model_out_dir="models",
-    tensorboard_log=False
-)
-
-dataset_factory = DatasetFactory(scrapped_comps_file="data/comps.jsonl")
-training_dataset, test_dataset, _, _ = dataset_factory.generate_dataset(as_tf_dataset=True)
-
-while True:
-    optimizer.run_iteration(training_dataset, test_dataset, batch_size=32)
\ No newline at end of file
+    from training.contextualmodel import contextual_autoencoder
+    from utils.consts import ALL_AGENTS, ALL_MAPS, ALL_STATS
+
+    return contextual_autoencoder(hparams, len(ALL_MAPS), len(ALL_AGENTS), 2 * len(ALL_STATS), input_encoding=input_encoding)
+
+def load_datasets(comps_path: str = "data/comps.jsonl", streaming: bool = streaming_dataset):
+    from training.datasetfactory import DatasetFactory
+
+    dataset_factory = DatasetFactory(scrapped_comps_file=comps_path)
+    if streaming:
+        training_dataset, test_dataset, _, _ = dataset_factory.generate_streaming_dataset(encoding=input_encoding, cache="memory")
+    else:
+        training_dataset, test_dataset, _, _ = dataset_factory.generate_dataset(as_tf_dataset=True, encoding=input_encoding)
+    return training_dataset, test_dataset
+
+def stats_normalization(comps_path: str) -> dict:
+    """Returns the mean and scale of the stats the datasets are normalized with, saved with the checkpoints for embed.py"""
+    from training.datasetfactory import DatasetFactory
+    from training.jsonlreader import open_compositions
+
+    # Both datasets fit their scaler on the stats of every composition too
+    scaler = DatasetFactory(comps_path).fit_stats_scaler(open_compositions(comps_path).stats)
+    return { "stats_mean": scaler.mean_, "stats_scale": scaler.scale_ }
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--inpath", "-i", default="data/comps.jsonl", type=str, help="Scraped compositions file or store")
+    parser.add_argument("--ledger", default=trial_ledger_path, type=str, help="SQLite file the trials are recorded in")
+    parser.add_argument("--parallel-trials", default=parallel_trials, type=int, help="Number of trials trained at the same time")
+    parser.add_argument("--streaming", action="store_true", default=streaming_dataset, help="Expand the held out players on the fly")
+    parser.add_argument("--batch-size", default=batch_size, type=int, help="Batch size of the trials, replaced by the tuned one in fast mode")
+    parser.add_argument("--fast", action="store_true", default=fast_training, help="Train with several steps per execution and a tuned batch size")
+    parser.add_argument("--jit", action="store_true", default=jit_compile, help="Compile the train steps with XLA")
+    metrics.add_arguments(parser, profiling=True)
+
+def main(args: argparse.Namespace):
+    """Main function"""
+
+    from training.modeloptimizer import ModelOptimizer
+    from training.trialledger import TrialLedger
+    from training.tpesampler import TPESampler
+
+    optimizer = ModelOptimizer(
+        factory=ContextualAutoencoder,
+        hyperparams=search_space(),
+        losses={ "agent": agent_loss, "stat": "mse" },
+        metrics={ "agent": "accuracy", "stat": "mse" },
+        model_out_dir="models",
+        tensorboard_log=False,
+        scheduler=trial_scheduler(),
+        ledger=TrialLedger(args.ledger),
+        sampler=TPESampler(),
+        profile=metrics.profile_window(args),
+        jit_compile=args.jit,
+        steps_per_execution=fast_steps_per_execution if args.fast else 1,
+        cast_inputs=args.fast,
+        batch_tuner=batch_tuner() if args.fast else None,
+        checkpoint_arrays=stats_normalization(args.inpath)
+    )
+
+    # A partial of a module level function can be sent to the worker processes
+    dataset_fn = functools.partial(load_datasets, args.inpath, args.streaming)
+    with metrics.session("train", args.metrics_dir):
+        if args.parallel_trials > 1:
+            optimizer.run_parallel(dataset_fn, n_workers=args.parallel_trials, batch_size=args.batch_size)
+        else:
+            training_dataset, test_dataset = dataset_fn()
+            while True:
+                optimizer.run_iteration(training_dataset, test_dataset, batch_size=args.batch_size)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Searches hyperparameters of the contextual autoencoder")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,64 @@
+from typing import Callable
+
+LR_SCALINGS = ["linear", "sqrt", "none"]
+
+class BatchSizeTuner:
+    """Finds the largest batch size that trains as well as the smallest one.
+
+    Every candidate batch size trains a fresh model of the same config for `epochs` epochs, with the learning
+    rate scaled from the one of the smallest batch: linearly, by the square root of the ratio (the usual
+    rule for Adam and RMSprop) or not at all. Candidates are tried from the smallest up, and the search stops
+    at the first one whose best monitored value is worse than the smallest batch's by more than `tolerance`
+    (relative), bigger batches only do worse for the same number of epochs.
+    """
+
+    def __init__(
+        self,
+        batch_sizes: tuple[int, ...] = (32, 64, 128, 256, 512, 1024, 2048),
+        epochs: int = 3,
+        tolerance: float = 0.02,
+        lr_scaling: str = "sqrt",
+        mode: str = "min"
+    ):
+        if lr_scaling not in LR_SCALINGS:
+            raise ValueError(f"Unknown learning rate scaling '{lr_scaling}', expected one of {LR_SCALINGS}")
+        if mode not in ("min", "max"):
+            raise ValueError(f"Unknown mode {mode}, it must be 'min' or 'max'")
+
+        self.batch_sizes = sorted(batch_sizes)
+        self.epochs = epochs
+        self.tolerance = tolerance
+        self.lr_scaling = lr_scaling
+        self.mode = mode
+
+    def learning_rate_scale(self, batch_size: int) -> float:
+        """Returns the factor of the learning rate of a batch size"""
+        ratio = batch_size / self.batch_sizes[0]
+        if self.lr_scaling == "linear":
+            return ratio
+        return ratio ** 0.5 if self.lr_scaling == "sqrt" else 1.0
+
+    def tune(self, fit: Callable[[int, float], tuple[float, float]]) -> tuple[int, float]:
+        """Returns the batch size and learning rate scale to train with.
+
+        fit(batch_size, lr_scale) trains a fresh model for `epochs` epochs and returns its best monitored
+        value and its training examples per second.
+        """
+        reference, best = None, None
+        for batch_size in self.batch_sizes:
+            lr_scale = self.learning_rate_scale(batch_size)
+            value, samples_per_second = fit(batch_size, lr_scale)
+
+            within = reference is None or self._within_tolerance(value, reference)
+            print(f"Batch size {batch_size:>5} (learning rate x{lr_scale:.2f}): {value:.4f} at {samples_per_second:.0f} samples/s{'' if within else ', out of tolerance'}")
+            if not within:
+                break
+
+            if reference is None:
+                reference = value
+            best = batch_size, lr_scale
+        return best
+
+    def _within_tolerance(self, value: float, reference: float) -> bool:
+        margin = self.tolerance * abs(reference)
+        return value <= reference + margin if self.mode == "min" else value >= reference - margin
@@ -1,34 +1,185 @@
 import os
-import functools
+import heapq
+import queue
+import itertools
+import threading
+import numpy as np
 import tensorflow as tf
 
-class SaveBestNCheckpoints(tf.keras.callbacks.ModelCheckpoint):
-    """Keras Callback that saves the best N checkpoints based on a given metric."""
+class CheckpointWriter:
+    """Background thread that writes weight snapshots to disk, so training never waits on disk I/O.
 
-    def __init__(self, n: int, filepath: str, monitor: str = "val_loss", verbose: int = 0, **kwargs):
-        super().__init__(filepath=filepath, monitor=monitor, save_best_only=True, verbose=verbose, **kwargs)
+    Saves and deletes are applied in the order they are submitted. At most max_pending snapshots
+    wait in memory, submitting more blocks until the thread catches up.
+    """
+
+    def __init__(self, max_pending: int = 4):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread: threading.Thread = None
+        self._error: BaseException = None
+
+    def save(self, path: str, weights: list[np.ndarray], model_config: str, arrays: dict[str, np.ndarray] = None) -> None:
+        """Queues the snapshot of a model to be written to path"""
+        self._put(("save", path, weights, model_config, arrays))
+
+    def delete(self, path: str) -> None:
+        """Queues the removal of a checkpoint"""
+        self._put(("delete", path, None, None, None))
+
+    def flush(self) -> None:
+        """Blocks until everything submitted is on disk"""
+        if self._thread is not None:
+            self._queue.join()
+
+        if self._error is not None:
+            raise RuntimeError("The checkpoint writer failed") from self._error
+
+    def _put(self, item: tuple) -> None:
+        if self._error is not None:
+            raise RuntimeError("The checkpoint writer failed") from self._error
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="CheckpointWriter", daemon=True)
+            self._thread.start()
+        self._queue.put(item)
+
+    def _run(self) -> None:
+        while True:
+            action, path, weights, model_config, arrays = self._queue.get()
+            try:
+                if self._error is None:
+                    if action == "save":
+                        write_checkpoint(path, weights, model_config, arrays)
+                    elif os.path.exists(path):
+                        os.remove(path)
+            except BaseException as e: # pylint: disable=broad-except
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+class BestCheckpoints:
+    """The best n checkpoints across every trial, kept in a heap with the worst one on top.
+
+    arrays are saved with every checkpoint, e.g. the stats normalization the models are trained with.
+    """
+
+    def __init__(self, n: int, mode: str = "min", writer: CheckpointWriter = None, arrays: dict[str, np.ndarray] = None):
         self.n = n
+        self.mode = mode
+        self.writer = writer or CheckpointWriter()
+        self.arrays = arrays
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __getstate__(self):
+        # The writer thread stays in this process, a copy gets its own
+        state = self.__dict__.copy()
+        del state["writer"], state["_counter"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.writer = CheckpointWriter()
+        self._counter = itertools.count(len(self._heap))
+
+    @property
+    def checkpoints(self) -> list[dict]:
+        """Returns the checkpoints kept, best first"""
+        return [{ "value": value, "path": path } for _, _, value, path in sorted(self._heap, reverse=True)]
+
+    def accepts(self, value: float) -> bool:
+        """Tells if a checkpoint with the given value would be kept"""
+        return len(self._heap) < self.n or self._key(value) < -self._heap[0][0]
+
+    def add(self, value: float, path: str, weights: list[np.ndarray], model_config: str) -> None:
+        """Saves a checkpoint in the background, deleting the worst one if there are more than n"""
+        self.writer.save(path, weights, model_config, self.arrays)
+        heapq.heappush(self._heap, (-self._key(value), next(self._counter), value, path))
+
+        if len(self._heap) > self.n:
+            _, _, _, removed_path = heapq.heappop(self._heap)
+            self.writer.delete(removed_path)
+
+    def flush(self) -> None:
+        """Blocks until every checkpoint kept is on disk"""
+        self.writer.flush()
+
+    def _key(self, value: float) -> float:
+        return value if self.mode == "min" else -value
+
+class SaveBestNCheckpoints(tf.keras.callbacks.Callback):
+    """Keras Callback that saves the model whenever a trial improves, if it's among the best N checkpoints.
+
+    Only the weights are copied on the training thread, writing them is left to the writer of
+    `checkpoints`. A new instance must be used for every trial.
+    """
+
+    def __init__(self, checkpoints: BestCheckpoints, filepath: str, monitor: str = "val_loss", verbose: int = 0):
+        super().__init__()
+        self.checkpoints = checkpoints
         self.filepath = filepath
-        self._checkpoints = []
+        self.monitor = monitor
+        self.verbose = verbose
+        self.best = np.inf if checkpoints.mode == "min" else -np.inf
+        self._model_config: str = None
 
     def on_epoch_end(self, epoch, logs=None):
-        self.epochs_since_last_save += 1
+        logs = logs or {}
+        value = logs.get(self.monitor)
+        if value is None:
+            return
+
+        improved = value < self.best if self.checkpoints.mode == "min" else value > self.best
+        if not improved:
+            return
+        self.best = value
+
+        if self.checkpoints.accepts(value):
+            # The architecture doesn't change during a trial
+            if self._model_config is None:
+                self._model_config = self.model.to_json()
+
+            filepath = self.filepath.format(epoch=epoch + 1, **logs)
+            self.checkpoints.add(value, filepath, self.model.get_weights(), self._model_config)
+
+            if self.verbose > 0:
+                print(f"\nEpoch {epoch + 1:05d}: {self.monitor} improved to {value:.5f}, saving model to {filepath}")
+
+def write_checkpoint(path: str, weights: list[np.ndarray], model_config: str, arrays: dict[str, np.ndarray] = None) -> None:
+    """Writes the architecture and weights of a model to a .npz file, with named arrays read by load_checkpoint_arrays"""
+    arrays = arrays or {}
+    reserved = [name for name in arrays if name == "model_config" or name.startswith("arr_")]
+    if len(reserved) > 0:
+        raise ValueError(f"Checkpoint arrays can't be named {reserved}, the names are used by the weights and the architecture")
+
+    if os.path.dirname(path) != "":
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Written next to the destination and renamed, so a checkpoint is never half written
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, *weights, model_config=np.array(model_config), **arrays)
+    os.replace(tmp_path, path)
 
-        if self.save_freq == "epoch":
-            monitor_value = logs.get(self.monitor)
+def load_checkpoint(path: str) -> tf.keras.Model:
+    """Loads a model saved by SaveBestNCheckpoints, or a full Keras model file"""
+    if not path.endswith(".npz"):
+        return tf.keras.models.load_model(path)
 
-            # If it's the best model yet, we need to make room for it
-            if self.monitor_op(monitor_value, self.best):
+    with np.load(path) as data:
+        model = tf.keras.models.model_from_json(str(data["model_config"]))
+        n_weights = sum(name.startswith("arr_") for name in data.files)
+        model.set_weights([data[f"arr_{i}"] for i in range(n_weights)])
+    return model
 
-                # If we already have N checkpoints, we delete the worst one to make room for the new one
-                if len(self._checkpoints) >= self.n:
-                    removed_checkpoint = self._checkpoints.pop(-1)
-                    if os.path.exists(removed_checkpoint["path"]):
-                        os.remove(removed_checkpoint["path"])
+def load_checkpoint_arrays(path: str) -> dict[str, np.ndarray]:
+    """Returns the named arrays saved with a checkpoint, none for Keras model files and older checkpoints"""
+    if not path.endswith(".npz"):
+        return {}
 
-                # We add the new checkpoint to the list
-                filepath = self._get_file_path(epoch, batch=None, logs=logs)
-                self._checkpoints.append({ "value": monitor_value, "path": filepath })
-                self._checkpoints.sort(key=functools.cmp_to_key(lambda a, b: -1 if self.monitor_op(a["value"], b["value"]) else 1))
+    with np.load(path) as data:
+        return { name: data[name] for name in data.files if name != "model_config" and not name.startswith("arr_") }
 
-            self._save_model(epoch=epoch, batch=None, logs=logs)
\ No newline at end of file
+def checkpoint_mode(monitor: str) -> str:
+    """Returns whether a monitored metric should be minimized or maximized, same rule as Keras for mode="auto" """
+    return "max" if "acc" in monitor or monitor.startswith("fmeasure") else "min"
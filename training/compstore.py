@@ -0,0 +1,148 @@
+import os
+import json
+import numpy as np
+
+from utils.consts import ALL_AGENTS, ALL_MAPS, ALL_STATS
+
+# Bump whenever the layout of the store changes, old stores must then be rebuilt
+FORMAT_VERSION = 1
+
+# dtype of each column, the store holds one row per team per game
+COLUMNS = {
+    "agents": np.int8,    # (n, 5) indices into ALL_AGENTS
+    "maps": np.int8,      # (n,) indices into ALL_MAPS
+    "stats": np.float32,  # (n, 5, 2 * len(ALL_STATS)) atk/def value of each stat
+    "match_id": np.int64, # (n,)
+    "game_id": np.int64,  # (n,)
+    "team": np.int32,     # (n,) indices into the store "teams" list
+    "wr": np.float64,     # (n,) rounds won / rounds played
+}
+
+class CompositionStore:
+    """Columnar binary store of scraped compositions, one .npy file per column in a directory.
+
+    Columns are memory-mapped when opened, so opening a store takes the same time no matter its size.
+    Agents and maps are stored as codes of ALL_AGENTS / ALL_MAPS, and the names used when the store
+    was written are kept in its header so stores stay readable when those lists change.
+    """
+
+    def __init__(self, path: str, columns: dict[str, np.ndarray], teams: list[str]):
+        self.path = path
+        self.columns = columns
+        self.teams = teams
+
+    def __len__(self) -> int:
+        return self.columns["maps"].shape[0]
+
+    @property
+    def agents(self) -> np.ndarray:
+        return self.columns["agents"]
+
+    @property
+    def maps(self) -> np.ndarray:
+        return self.columns["maps"]
+
+    @property
+    def stats(self) -> np.ndarray:
+        return self.columns["stats"]
+
+    @classmethod
+    def open(cls, path: str, mmap: bool = True) -> "CompositionStore":
+        """Opens a store, memory-mapping its columns unless mmap is False"""
+        with open(os.path.join(path, "header.json"), "r", encoding="utf-8") as f:
+            header = json.load(f)
+
+        if header["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {header['format_version']} but {FORMAT_VERSION} is expected, rebuild it with builddataset.py")
+
+        if header["stats"] != ALL_STATS:
+            raise ValueError(f"{path} was built with stats {header['stats']} but ALL_STATS is {ALL_STATS}, rebuild it with builddataset.py")
+
+        mmap_mode = "r" if mmap else None
+        columns = { name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in COLUMNS }
+
+        # Codes only need to be translated if ALL_AGENTS or ALL_MAPS changed since the store was built
+        columns["agents"] = _remap_codes(columns["agents"], header["agents"], ALL_AGENTS, "agent")
+        columns["maps"] = _remap_codes(columns["maps"], header["maps"], ALL_MAPS, "map")
+
+        return cls(path, columns, header["teams"])
+
+    @classmethod
+    def write(cls, path: str, columns: dict[str, np.ndarray], teams: list[str]) -> "CompositionStore":
+        """Writes the columns (with codes of ALL_AGENTS / ALL_MAPS) to a new store"""
+        os.makedirs(path, exist_ok=True)
+
+        for name, dtype in COLUMNS.items():
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(columns[name], dtype=dtype))
+
+        header = {
+            "format_version": FORMAT_VERSION,
+            "n_rows": int(columns["maps"].shape[0]),
+            "agents": ALL_AGENTS,
+            "maps": ALL_MAPS,
+            "stats": ALL_STATS,
+            "teams": teams,
+        }
+
+        # The header goes last so a store is never readable while half written
+        with open(os.path.join(path, "header.json"), "w", encoding="utf-8") as f:
+            json.dump(header, f, ensure_ascii=False)
+
+        return cls.open(path)
+
+    def meta(self, rows: np.ndarray = None) -> "CompositionMeta":
+        """Returns the metadata of the given rows (all by default), its dicts are only built when read"""
+        meta = CompositionMeta(self.columns, self.teams)
+        return meta if rows is None else meta[rows]
+
+class CompositionMeta:
+    """Metadata of rows of a store in the format of DatasetFactory, a view of the store columns and teams.
+
+    Indexing with an int returns the dict of a row, indexing with an array or a slice returns the view of
+    those rows, so selecting rows costs one array of indices and dicts are only built for the rows read.
+    """
+
+    def __init__(self, columns: dict[str, np.ndarray], teams: list[str], rows: np.ndarray = None):
+        self.columns = columns
+        self.teams = teams
+        self.rows = np.arange(columns["maps"].shape[0]) if rows is None else rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            row = self.rows[key]
+            return {
+                "match_id": str(self.columns["match_id"][row]),
+                "game_id": str(self.columns["game_id"][row]),
+                "team": self.teams[self.columns["team"][row]],
+                "wr": float(self.columns["wr"][row]),
+            }
+        return CompositionMeta(self.columns, self.teams, self.rows[key])
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self) -> list[dict]:
+        """Returns the dicts of every row, reading each column once"""
+        match_ids = self.columns["match_id"][self.rows].tolist()
+        game_ids = self.columns["game_id"][self.rows].tolist()
+        teams = self.columns["team"][self.rows].tolist()
+        wrs = self.columns["wr"][self.rows].tolist()
+
+        return [
+            { "match_id": str(match_id), "game_id": str(game_id), "team": self.teams[team], "wr": wr }
+            for match_id, game_id, team, wr in zip(match_ids, game_ids, teams, wrs)
+        ]
+
+def _remap_codes(codes: np.ndarray, stored_names: list[str], current_names: list[str], kind: str) -> np.ndarray:
+    if stored_names == current_names:
+        return codes
+
+    missing = [name for name in stored_names if name not in current_names]
+    if len(missing) > 0:
+        raise ValueError(f"Store has {kind}s {missing} that are missing from utils/consts.py")
+
+    table = np.array([current_names.index(name) for name in stored_names], dtype=codes.dtype)
+    return table[codes]
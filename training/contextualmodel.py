@@ -1,12 +1,24 @@
 import tensorflow as tf
 
-def contextual_autoencoder(hparams, n_maps, n_agents, n_stats):
-    input_maps = tf.keras.layers.Input(shape=(n_maps,))
-    maps_x = tf.keras.layers.Dense(hparams["input_processing_size"], activation=hparams["activation"])(input_maps)
+def contextual_autoencoder(hparams, n_maps, n_agents, n_stats, input_encoding="onehot"):
+    if input_encoding == "index":
+        # Integer codes are one-hot encoded inside the model by frozen identity embeddings
+        input_maps = tf.keras.layers.Input(shape=(), dtype="int32")
+        maps_onehot = _onehot_layer(n_maps, name="map_onehot")(input_maps)
+
+        input_agents = tf.keras.layers.Input(shape=(4,), dtype="int32")
+        agents_onehot = _onehot_layer(n_agents, name="agent_onehot")(input_agents)
+    else:
+        input_maps = tf.keras.layers.Input(shape=(n_maps,))
+        maps_onehot = input_maps
+
+        input_agents = tf.keras.layers.Input(shape=(4, n_agents,))
+        agents_onehot = input_agents
+
+    maps_x = tf.keras.layers.Dense(hparams["input_processing_size"], activation=hparams["activation"])(maps_onehot)
     maps_x = tf.keras.layers.BatchNormalization()(maps_x)
 
-    input_agents = tf.keras.layers.Input(shape=(4, n_agents,))
-    agents_x = tf.keras.layers.Flatten()(input_agents)
+    agents_x = tf.keras.layers.Flatten()(agents_onehot)
     agents_x = tf.keras.layers.Dense(hparams["input_processing_size"], activation=hparams["activation"])(agents_x)
     agents_x = tf.keras.layers.BatchNormalization()(agents_x)
 
@@ -46,4 +58,12 @@ def contextual_autoencoder(hparams, n_maps, n_agents, n_stats):
         outputs=[agent_output, stat_output]
     )
 
-    return model
\ No newline at end of file
+    return model
+
+def model_input_encoding(model: tf.keras.Model) -> str:
+    """Returns the input encoding ("onehot" or "index") a contextual autoencoder was built with"""
+    layer_names = [layer.name for layer in model.layers]
+    return "index" if "agent_onehot" in layer_names else "onehot"
+
+def _onehot_layer(n_categories, name):
+    return tf.keras.layers.Embedding(n_categories, n_categories, embeddings_initializer="identity", trainable=False, name=name)
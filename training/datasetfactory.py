@@ -1,17 +1,25 @@
-import json
 import numpy as np
-import tensorflow as tf
 
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 
-from utils.consts import ALL_AGENTS, ALL_MAPS, ALL_STATS
+from training.jsonlreader import open_compositions
+from utils import metrics
+from utils.consts import ALL_AGENTS, ALL_MAPS
+
+# "onehot" generates float64 one-hot agents and maps, "index" generates int8 codes of the encoders categories
+ENCODINGS = ["onehot", "index"]
+
+# Players kept as input for each of the 5 held out players of a composition
+HOLDOUT_INPUTS = [[j for j in range(5) if j != i] for i in range(5)]
 
 class DatasetFactory:
     """Class to load and generate the dataset"""
 
-    def __init__(self, scrapped_comps_file: str):
+    def __init__(self, scrapped_comps_file: str, ingest_workers: int = 1):
+        """scrapped_comps_file is either a .jsonl file from scrapdata.py or a store from builddataset.py"""
         self.scrapped_comps_file = scrapped_comps_file
+        self.ingest_workers = ingest_workers
 
         self.agent_encoder = OneHotEncoder()
         self.agent_encoder.fit(np.array(ALL_AGENTS).reshape(-1, 1))
@@ -19,43 +27,54 @@ class DatasetFactory:
         self.map_encoder = OneHotEncoder()
         self.map_encoder.fit(np.array(ALL_MAPS).reshape(-1, 1))
 
+        # Column of the one-hot encoders for each code of ALL_AGENTS / ALL_MAPS (the encoders sort their categories)
+        self._agent_columns = np.array([list(self.agent_encoder.categories_[0]).index(agent) for agent in ALL_AGENTS])
+        self._map_columns = np.array([list(self.map_encoder.categories_[0]).index(map_name) for map_name in ALL_MAPS])
+
         self.std_scaler = StandardScaler()
 
-    def generate_dataset(self, test_size: float = 0.2, as_tf_dataset: bool = True):
+    def generate_dataset(self, test_size: float = 0.2, as_tf_dataset: bool = True, encoding: str = "onehot"):
         """Generates the dataset"""
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding '{encoding}', expected one of {ENCODINGS}")
+
+        stages = metrics.stages("dataset_stage_seconds", dataset="in_memory")
 
         # Loads and preprocesses the data
         agents, maps, stats, meta = self._load_data()
-        agents, maps, stats = self._preprocess_data(agents, maps, stats)
-
-        # Splits the data into train and test
-        agents_train, agents_test, maps_train, maps_test, stats_train, stats_test, meta_train, meta_test = train_test_split(agents, maps, stats, meta, test_size=test_size, random_state=42)
-
-        # Finds data shapes
+        stages.mark("load")
+        metrics.inc("dataset_rows", len(maps), stage="load")
+        agents, maps, stats = self._preprocess_data(agents, maps, stats, encoding)
+        stages.mark("preprocess")
+
+        # Splits the data into train and test, the same split as splitting the arrays themselves
+        train_rows, test_rows = train_test_split(np.arange(len(maps)), test_size=test_size, random_state=42)
+        agents_train, agents_test = agents[train_rows], agents[test_rows]
+        maps_train, maps_test = maps[train_rows], maps[test_rows]
+        stats_train, stats_test = stats[train_rows], stats[test_rows]
+        stages.mark("split")
+
+        # Finds data shapes (the trailing dimensions are empty for agents and maps codes)
         n_train = agents_train.shape[0] * agents_train.shape[1]
         n_test = agents_test.shape[0] * agents_test.shape[1]
-        n_agents = agents_train.shape[-1]
-        n_maps = maps_train.shape[-1]
-        n_stats = stats_train.shape[-1]
+        agent_shape = agents_train.shape[2:]
+        map_shape = maps_train.shape[1:]
+        stat_shape = stats_train.shape[2:]
 
         # Initializes all the arrays
-        x_agents_train = np.zeros((n_train, 4, n_agents))
-        x_maps_train = np.zeros((n_train, n_maps))
-        x_stats_train = np.zeros((n_train, 4, n_stats))
+        x_agents_train = np.zeros((n_train, 4, *agent_shape), dtype=agents.dtype)
+        x_maps_train = np.zeros((n_train, *map_shape), dtype=maps.dtype)
+        x_stats_train = np.zeros((n_train, 4, *stat_shape), dtype=stats.dtype)
 
-        x_agents_test = np.zeros((n_test, 4, n_agents))
-        x_maps_test = np.zeros((n_test, n_maps))
-        x_stats_test = np.zeros((n_test, 4, n_stats))
+        x_agents_test = np.zeros((n_test, 4, *agent_shape), dtype=agents.dtype)
+        x_maps_test = np.zeros((n_test, *map_shape), dtype=maps.dtype)
+        x_stats_test = np.zeros((n_test, 4, *stat_shape), dtype=stats.dtype)
 
-        y_agents_train = np.zeros((n_train, n_agents))
-        y_stats_train = np.zeros((n_train, n_stats))
+        y_agents_train = np.zeros((n_train, *agent_shape), dtype=agents.dtype)
+        y_stats_train = np.zeros((n_train, *stat_shape), dtype=stats.dtype)
 
-        y_agents_test = np.zeros((n_test, n_agents))
-        y_stats_test = np.zeros((n_test, n_stats))
-        
-        # Repeat meta data for each player
-        flat_meta_train = []
-        flat_meta_test = []
+        y_agents_test = np.zeros((n_test, *agent_shape), dtype=agents.dtype)
+        y_stats_test = np.zeros((n_test, *stat_shape), dtype=stats.dtype)
 
         # Fills the arrays
         for y_i in range(agents_train.shape[1]):
@@ -67,23 +86,28 @@ class DatasetFactory:
 
             all_xi = [j for j in range(agents_train.shape[1]) if j != y_i]
 
-            x_agents_train[train_idx_start : train_idx_end, :, :] = agents_train[:, all_xi, :]
-            x_maps_train[train_idx_start : train_idx_end, :] = maps_train[:, 0, :]
-            x_stats_train[train_idx_start : train_idx_end, :, :] = stats_train[:, all_xi, :]
-            x_agents_test[test_idx_start : test_idx_end, :, :] = agents_test[:, all_xi, :]
-            x_maps_test[test_idx_start : test_idx_end, :] = maps_test[:, 0, :]
-            x_stats_test[test_idx_start : test_idx_end, :, :] = stats_test[:, all_xi, :]
+            x_agents_train[train_idx_start : train_idx_end] = agents_train[:, all_xi]
+            x_maps_train[train_idx_start : train_idx_end] = maps_train
+            x_stats_train[train_idx_start : train_idx_end] = stats_train[:, all_xi]
+            x_agents_test[test_idx_start : test_idx_end] = agents_test[:, all_xi]
+            x_maps_test[test_idx_start : test_idx_end] = maps_test
+            x_stats_test[test_idx_start : test_idx_end] = stats_test[:, all_xi]
 
-            y_agents_train[train_idx_start : train_idx_end, :] = agents_train[:, y_i, :]
-            y_stats_train[train_idx_start : train_idx_end, :] = stats_train[:, y_i, :]
-            y_agents_test[test_idx_start : test_idx_end, :] = agents_test[:, y_i, :]
-            y_stats_test[test_idx_start : test_idx_end, :] = stats_test[:, y_i, :]
+            y_agents_train[train_idx_start : train_idx_end] = agents_train[:, y_i]
+            y_stats_train[train_idx_start : train_idx_end] = stats_train[:, y_i]
+            y_agents_test[test_idx_start : test_idx_end] = agents_test[:, y_i]
+            y_stats_test[test_idx_start : test_idx_end] = stats_test[:, y_i]
 
-            flat_meta_train.extend(meta_train)
-            flat_meta_test.extend(meta_test)
+        # Repeat meta data for each player
+        flat_meta_train = meta[np.tile(train_rows, agents_train.shape[1])]
+        flat_meta_test = meta[np.tile(test_rows, agents_test.shape[1])]
+        stages.mark("expand")
 
         # Creates the datasets
         if as_tf_dataset:
+            # TensorFlow is only imported when tf.data datasets are asked for, it takes seconds
+            import tensorflow as tf
+
             training_dataset = tf.data.Dataset.zip((
                 tf.data.Dataset.from_tensor_slices((x_agents_train, x_maps_train, x_stats_train)),
                 tf.data.Dataset.from_tensor_slices((y_agents_train, y_stats_train))
@@ -96,74 +120,168 @@ class DatasetFactory:
         else:
             training_dataset = (x_agents_train, x_maps_train, x_stats_train), (y_agents_train, y_stats_train)
             test_dataset = (x_agents_test, x_maps_test, x_stats_test), (y_agents_test, y_stats_test)
+        stages.mark("tf_dataset" if as_tf_dataset else "arrays")
 
         return training_dataset, test_dataset, flat_meta_train, flat_meta_test
 
+    def generate_streaming_dataset(
+        self,
+        test_size: float = 0.2,
+        encoding: str = "index",
+        shuffle_buffer: int = 65536,
+        block_size: int = 8192,
+        cache: str = None,
+        snapshot_path: str = None,
+        seed: int = 42
+    ):
+        """Generates the dataset as tf.data pipelines that expand the held out players on the fly.
+
+        Only the 5 player compositions are kept (memory-mapped when reading a store), each block of them is
+        expanded into its 5 held out variants with gather ops while training. cache can be "memory" or a file
+        path and snapshot_path persists the expanded training data to disk. The train / test split is the same
+        as generate_dataset, but the returned metadata has one entry per composition instead of per example.
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding '{encoding}', expected one of {ENCODINGS}")
+
+        stages = metrics.stages("dataset_stage_seconds", dataset="streaming")
+
+        agents, maps, stats, meta = self._load_data()
+        stages.mark("load")
+        metrics.inc("dataset_rows", len(maps), stage="load")
+        train_rows, test_rows = train_test_split(np.arange(len(maps)), test_size=test_size, random_state=42)
+        stages.mark("split")
+
+        # Stats are normalized inside the pipeline
+        self.std_scaler = self.fit_stats_scaler(stats, block_size)
+        stages.mark("fit_scaler")
+
+        training_dataset = self._streaming_pipeline(agents, maps, stats, train_rows, encoding, block_size, seed)
+        test_dataset = self._streaming_pipeline(agents, maps, stats, test_rows, encoding, block_size, None)
+
+        if snapshot_path is not None:
+            training_dataset = training_dataset.snapshot(snapshot_path)
+        elif cache is not None:
+            training_dataset = training_dataset.cache("" if cache == "memory" else cache)
+
+        training_dataset = training_dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+        stages.mark("pipeline")
+
+        return training_dataset, test_dataset, meta[train_rows], meta[test_rows]
+
+    def fit_stats_scaler(self, stats: np.ndarray, block_size: int = 8192) -> StandardScaler:
+        """Fits a scaler on the stats of every player block by block, so memory-mapped stats are never fully loaded"""
+        scaler = StandardScaler()
+        for start in range(0, len(stats), block_size):
+            block = np.asarray(stats[start : start + block_size], dtype=np.float64)
+            scaler.partial_fit(block.reshape(-1, block.shape[-1]))
+        return scaler
+
+    def holdout_inputs(self, agents: np.ndarray, maps: np.ndarray, stats: np.ndarray, stats_mean: np.ndarray, stats_scale: np.ndarray, encoding: str = "index"):
+        """Returns the model inputs of the 5 held out examples of each composition.
+
+        Example 5 * i + j holds out player j of composition i, stats are normalized with the given mean and scale.
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding '{encoding}', expected one of {ENCODINGS}")
+
+        agents = self._agent_columns[agents]
+        maps = self._map_columns[maps]
+        stats = ((np.asarray(stats, dtype=np.float64) - stats_mean) / stats_scale).astype(np.float32)
+
+        x_agents = agents[:, HOLDOUT_INPUTS].reshape(-1, 4)
+        x_maps = np.repeat(maps, 5)
+        x_stats = stats[:, HOLDOUT_INPUTS].reshape(-1, 4, stats.shape[-1])
+
+        if encoding == "onehot":
+            return np.eye(len(ALL_AGENTS))[x_agents], np.eye(len(ALL_MAPS))[x_maps], x_stats
+        return x_agents.astype(np.int8), x_maps.astype(np.int8), x_stats
+
+    def _streaming_pipeline(self, agents, maps, stats, rows: np.ndarray, encoding: str, block_size: int, seed: int | None):
+        """Returns a dataset with the 5 held out examples of each composition in rows"""
+        import tensorflow as tf
+
+        n_stats = stats.shape[-1]
+
+        # Created once, so every epoch draws the next block order of the same reproducible sequence
+        rng = np.random.default_rng(seed) if seed is not None else None
+
+        def read_blocks():
+            # A different block order every epoch when shuffling, rows are sorted inside blocks for memory-mapped reads
+            order = np.arange(0, len(rows), block_size)
+            if rng is not None:
+                rng.shuffle(order)
+
+            for start in order:
+                block_rows = np.sort(rows[start : start + block_size])
+                yield agents[block_rows], maps[block_rows], np.asarray(stats[block_rows], dtype=np.float32)
+
+        agent_columns = tf.constant(self._agent_columns, dtype=tf.int32)
+        map_columns = tf.constant(self._map_columns, dtype=tf.int32)
+        stats_mean = tf.constant(self.std_scaler.mean_, dtype=tf.float32)
+        stats_scale = tf.constant(self.std_scaler.scale_, dtype=tf.float32)
+        holdout_inputs = tf.constant(HOLDOUT_INPUTS, dtype=tf.int32)
+
+        def expand_block(block_agents, block_maps, block_stats):
+            block_agents = tf.gather(agent_columns, tf.cast(block_agents, tf.int32))
+            block_maps = tf.gather(map_columns, tf.cast(block_maps, tf.int32))
+            block_stats = (block_stats - stats_mean) / stats_scale
+
+            # (b, 5, ...) -> (b, 5 held out, 4 inputs, ...) -> (b * 5, 4, ...)
+            x_agents = tf.reshape(tf.gather(block_agents, holdout_inputs, axis=1), (-1, 4))
+            x_stats = tf.reshape(tf.gather(block_stats, holdout_inputs, axis=1), (-1, 4, n_stats))
+            x_maps = tf.repeat(block_maps, 5)
+            y_agents = tf.reshape(block_agents, (-1,))
+            y_stats = tf.reshape(block_stats, (-1, n_stats))
+
+            if encoding == "onehot":
+                x_agents = tf.one_hot(x_agents, len(ALL_AGENTS))
+                x_maps = tf.one_hot(x_maps, len(ALL_MAPS))
+                y_agents = tf.one_hot(y_agents, len(ALL_AGENTS))
+            else:
+                x_agents = tf.cast(x_agents, tf.int8)
+                x_maps = tf.cast(x_maps, tf.int8)
+                y_agents = tf.cast(y_agents, tf.int8)
+
+            return tf.data.Dataset.from_tensor_slices(((x_agents, x_maps, x_stats), (y_agents, y_stats)))
+
+        dataset = tf.data.Dataset.from_generator(read_blocks, output_signature=(
+            tf.TensorSpec(shape=(None, 5), dtype=tf.as_dtype(agents.dtype)),
+            tf.TensorSpec(shape=(None,), dtype=tf.as_dtype(maps.dtype)),
+            tf.TensorSpec(shape=(None, 5, n_stats), dtype=tf.float32),
+        ))
+        return dataset.flat_map(expand_block)
+
     def _load_data(self):
-        all_agents_ohe = []
-        all_maps_ohe = []
-        all_stats = []
-        all_meta = []
-
-        with open(self.scrapped_comps_file, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            for line in lines:
-                data = json.loads(line)
-
-                agents_a = [player["agent"] for player in data["team_a"]["players"]]
-                agents_b = [player["agent"] for player in data["team_b"]["players"]]
-
-                maps_a = [data["map_name"] for _ in range(5)]
-                maps_b = [data["map_name"] for _ in range(5)]
-
-                stats_a = [self._get_player_data(player) for player in data["team_a"]["players"]]
-                stats_b = [self._get_player_data(player) for player in data["team_b"]["players"]]
-
-                score_a = float(data["team_a"]["score"])
-                score_b = float(data["team_b"]["score"])
-                total_rounds = score_a + score_b
-                wr_a = score_a / total_rounds
-                wr_b = score_b / total_rounds
-                meta_a = { "match_id": data["match_id"], "game_id": data["game_id"], "team": data["team_a"]["team"], "wr": wr_a }
-                meta_b = { "match_id": data["match_id"], "game_id": data["game_id"], "team": data["team_b"]["team"], "wr": wr_b }
-
-                all_agents_ohe.append(agents_a)
-                all_agents_ohe.append(agents_b)
-                
-                all_maps_ohe.append(maps_a)
-                all_maps_ohe.append(maps_b)
-
-                all_stats.append(stats_a)
-                all_stats.append(stats_b)
-
-                all_meta.append(meta_a)
-                all_meta.append(meta_b)
-
-        return np.array(all_agents_ohe), np.array(all_maps_ohe), np.array(all_stats), all_meta
-
-    def _preprocess_data(self, agents: np.ndarray, maps: np.ndarray, stats: np.ndarray):
-        orig_agents_shape = agents.shape
-        orig_maps_shape = maps.shape
+        """Returns the agent codes (n, 5), map codes (n,), stats (n, 5, n_stats) and lazy metadata of every team composition"""
+        store = open_compositions(self.scrapped_comps_file, workers=self.ingest_workers)
+        return store.agents, store.maps, store.stats, store.meta()
+
+    def decode_agents(self, agents: np.ndarray) -> np.ndarray:
+        """Returns the agent names of one-hot encoded or index encoded agents"""
+        if agents.ndim == 1:
+            return self.agent_encoder.categories_[0][agents]
+        return self.agent_encoder.inverse_transform(agents).reshape(-1)
+
+    def decode_maps(self, maps: np.ndarray) -> np.ndarray:
+        """Returns the map names of one-hot encoded or index encoded maps"""
+        if maps.ndim == 1:
+            return self.map_encoder.categories_[0][maps]
+        return self.map_encoder.inverse_transform(maps).reshape(-1)
+
+    def _preprocess_data(self, agents: np.ndarray, maps: np.ndarray, stats: np.ndarray, encoding: str = "onehot"):
         orig_stats_shape = stats.shape
 
-        # One-hot encodes the agents
-        agents = self.agent_encoder.transform(agents.reshape(-1, 1)).toarray()
-        agents = agents.reshape(orig_agents_shape[0], orig_agents_shape[1], -1)
+        # Both encodings follow the column order of the one-hot encoders, so models are interchangeable
+        agents = self._agent_columns[agents].astype(np.int8)
+        maps = self._map_columns[maps].astype(np.int8)
 
-        # One-hot encodes the maps
-        maps = self.map_encoder.transform(maps.reshape(-1, 1)).toarray()
-        maps = maps.reshape(orig_maps_shape[0], orig_maps_shape[1], -1)
+        if encoding == "onehot":
+            agents = np.eye(len(ALL_AGENTS))[agents]
+            maps = np.eye(len(ALL_MAPS))[maps]
 
         # Normalizes the stats
+        stats = np.asarray(stats, dtype=np.float64 if encoding == "onehot" else np.float32)
         stats = self.std_scaler.fit_transform(stats.reshape(-1, stats.shape[-1]))
         stats = stats.reshape(orig_stats_shape)
         return agents, maps, stats
-
-    def _get_player_data(self, player_info: dict[str, dict[str, float]]):
-        player_data = []
-        for metric in ALL_STATS:
-            player_data.append(player_info[metric]["atk"])
-            player_data.append(player_info[metric]["def"])
-
-        return player_data
-        
\ No newline at end of file
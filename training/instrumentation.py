@@ -0,0 +1,140 @@
+import time
+import tensorflow as tf
+
+from utils import metrics
+
+class MetricsCallback(tf.keras.callbacks.Callback):
+    """Records step, host gap and epoch times of a trial, and runs the profile window when it covers the trial.
+
+    Step times include waiting for the input pipeline, which runs inside the train function. Comparing them
+    with `input_batch_seconds`, the time to produce a batch without training, tells if training is input bound.
+    With steps_per_execution, Keras calls the batch hooks once per execution, so a step is that many batches.
+    """
+
+    def __init__(self, trial: int, profile: metrics.ProfileWindow = None, input_batch_seconds: float = None):
+        super().__init__()
+        self.trial = trial
+        self.profile = profile
+        self.input_batch_seconds = input_batch_seconds
+        self._epoch_start = None
+        self._step_start = None
+        self._step_end = None
+        self._epoch_step_time = 0.0
+        self._epoch_steps = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        if self.profile is not None and self.profile.covers(self.trial, epoch + 1):
+            self.profile.start()
+
+        self._epoch_start = time.perf_counter()
+        self._step_end = None
+        self._epoch_step_time = 0.0
+        self._epoch_steps = 0
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._step_start = time.perf_counter()
+        if self._step_end is not None:
+            metrics.observe("train_step_gap_seconds", self._step_start - self._step_end)
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._step_end = time.perf_counter()
+        step_time = self._step_end - self._step_start
+        self._epoch_step_time += step_time
+        self._epoch_steps += 1
+        metrics.observe("train_step_seconds", step_time)
+
+    def on_epoch_end(self, epoch, logs=None):
+        metrics.observe("train_epoch_seconds", time.perf_counter() - self._epoch_start)
+        metrics.inc("train_epochs")
+        metrics.inc("train_steps", self._epoch_steps)
+
+        if self._epoch_steps > 0:
+            mean_step = self._epoch_step_time / self._epoch_steps
+            metrics.set_gauge("train_mean_step_seconds", mean_step, trial=self.trial)
+            if self.input_batch_seconds is not None:
+                metrics.set_gauge("train_input_bound_ratio", self.input_batch_seconds / mean_step, trial=self.trial)
+
+        if self.profile is not None and self.profile.covers(self.trial, epoch + 1) and not self.profile.covers(self.trial, epoch + 2):
+            self._stop_profile()
+        metrics.flush()
+
+    def on_train_end(self, logs=None):
+        # Early stopping can end the trial inside the window, brackets of successive halving fit it again later otherwise
+        if self.profile is not None and self.model.stop_training:
+            self._stop_profile()
+
+    def _stop_profile(self) -> None:
+        self.profile.stop(f"trial{self.trial}-epochs{self.profile.first_epoch}-{self.profile.last_epoch}")
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    """Measures the training examples per second of a trial, validation excluded, and prints it when fit ends.
+
+    The examples of an epoch are its steps times the batch size, so datasets are never counted (a full pass
+    on a streaming one) and only the last, partial batch is overcounted. The first epoch traces (and with
+    jit_compile compiles) the train function, it's reported apart as the warm up and left out of the
+    examples per second when later epochs were trained.
+    """
+
+    # Only keeps the index of the last batch, Keras may call the batch hooks from another thread
+    async_safe = True
+
+    def __init__(self, batch_size: int, trial: int = None, verbose: bool = True):
+        super().__init__()
+        self._supports_tf_logs = True
+        self.batch_size = batch_size
+        self.trial = trial
+        self.verbose = verbose
+        self.epoch_seconds: list[float] = []
+        self.epoch_examples: list[int] = []
+        self._epoch_start = None
+        self._epoch_steps = 0
+
+    @property
+    def warmup_seconds(self) -> float:
+        return self.epoch_seconds[0] if len(self.epoch_seconds) > 0 else float("nan")
+
+    @property
+    def samples_per_second(self) -> float:
+        start = 1 if len(self.epoch_seconds) > 1 else 0
+        epoch_seconds, epoch_examples = self.epoch_seconds[start:], self.epoch_examples[start:]
+        return sum(epoch_examples) / sum(epoch_seconds) if len(epoch_seconds) > 0 else float("nan")
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+        self._epoch_steps = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        # With steps_per_execution, batch is the index of the last step of the execution
+        self._epoch_steps = max(self._epoch_steps, batch + 1)
+
+    def on_test_begin(self, logs=None):
+        # Validation runs at the end of the epoch, evaluate calls outside of fit are not counted
+        self._end_epoch()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self._end_epoch()
+        # Asynchronous batch hooks are only flushed here, not before validation
+        self.epoch_examples.append(self._epoch_steps * self.batch_size)
+
+    def on_train_end(self, logs=None):
+        if self.trial is not None:
+            metrics.set_gauge("train_samples_per_second", self.samples_per_second, trial=self.trial)
+            metrics.set_gauge("train_warmup_seconds", self.warmup_seconds, trial=self.trial)
+        if self.verbose:
+            print(f"Trial {self.trial}: {self.samples_per_second:.0f} samples/s over {len(self.epoch_seconds)} epochs, {self.warmup_seconds:.1f}s first epoch")
+
+    def _end_epoch(self) -> None:
+        if self._epoch_start is not None:
+            self.epoch_seconds.append(time.perf_counter() - self._epoch_start)
+            self._epoch_start = None
+
+def input_batch_seconds(dataset: tf.data.Dataset, n_batches: int = 50) -> float:
+    """Returns the mean time to produce a batch of a batched dataset, after a warm up batch"""
+    iterator = iter(dataset.take(n_batches + 1))
+    next(iterator)
+
+    start = time.perf_counter()
+    n = 0
+    for _ in iterator:
+        n += 1
+    return (time.perf_counter() - start) / max(n, 1)
@@ -0,0 +1,144 @@
+import os
+import json
+import itertools
+import concurrent.futures
+import numpy as np
+
+from training.compstore import COLUMNS, CompositionStore
+from utils.consts import ALL_AGENTS, ALL_MAPS, ALL_STATS
+
+# orjson is a lot faster than json but it's optional
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+N_STATS = 2 * len(ALL_STATS)
+
+def read_jsonl(path: str, chunk_size: int = 1024, workers: int = 1) -> tuple[dict[str, np.ndarray], list[str]]:
+    """Reads a scraped compositions file into store columns and the list of team names.
+
+    The file is decoded in chunks of chunk_size lines straight into preallocated arrays, and with
+    workers > 1 byte ranges of the file are read by that many processes.
+    """
+    if workers <= 1:
+        return _read_range(path, 0, None, chunk_size)
+
+    # Splits the file in byte ranges that start and end on line boundaries
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, workers):
+            f.seek(max(size * i // workers, bounds[-1]))
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        parts = list(executor.map(_read_range, itertools.repeat(path), bounds[:-1], bounds[1:], itertools.repeat(chunk_size)))
+
+    # Merges the team names of every range in order, so codes are the same as a sequential read
+    team_codes = {}
+    for columns, teams in parts:
+        table = np.array([team_codes.setdefault(team, len(team_codes)) for team in teams], dtype=COLUMNS["team"])
+        columns["team"] = table[columns["team"]] if len(teams) > 0 else columns["team"]
+
+    columns = { name: np.concatenate([part[name] for part, _ in parts]) for name in COLUMNS }
+    return columns, list(team_codes)
+
+def convert_jsonl(jsonl_path: str, store_path: str, chunk_size: int = 1024, workers: int = 1) -> CompositionStore:
+    """Converts a scraped compositions file into a store"""
+    columns, teams = read_jsonl(jsonl_path, chunk_size=chunk_size, workers=workers)
+    return CompositionStore.write(store_path, columns, teams)
+
+def open_compositions(path: str, workers: int = 1) -> CompositionStore:
+    """Opens a store from builddataset.py, or reads a .jsonl file from scrapdata.py into an in-memory store"""
+    if os.path.isdir(path):
+        return CompositionStore.open(path)
+
+    columns, teams = read_jsonl(path, workers=workers)
+    return CompositionStore(path, columns, teams)
+
+def count_lines(path: str, start: int = 0, end: int = None, block_size: int = 1 << 24) -> int:
+    """Counts the lines of a byte range of a file without decoding it"""
+    n_lines = 0
+    last_byte = b"\n"
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = (os.path.getsize(path) if end is None else end) - start
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            n_lines += block.count(b"\n")
+            last_byte = block[-1:]
+            remaining -= len(block)
+
+    # The last line may not end with a newline
+    return n_lines + (last_byte != b"\n")
+
+def _read_range(path: str, start: int, end: int | None, chunk_size: int) -> tuple[dict[str, np.ndarray], list[str]]:
+    """Reads the lines between two byte offsets of a file into store columns"""
+    n_rows = 2 * count_lines(path, start, end)
+    columns = { name: np.empty(_shape(name, n_rows), dtype=dtype) for name, dtype in COLUMNS.items() }
+
+    agent_codes = { agent: i for i, agent in enumerate(ALL_AGENTS) }
+    map_codes = { map_name: i for i, map_name in enumerate(ALL_MAPS) }
+    team_codes = {}
+
+    row = 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        lines = _lines_until(f, start, end)
+        while True:
+            chunk = [_loads(line) for line in itertools.islice(lines, chunk_size) if line.strip()]
+            if len(chunk) == 0:
+                break
+
+            rows = slice(row, row + 2 * len(chunk))
+            teams = [team for data in chunk for team in (data["team_a"], data["team_b"])]
+            players = [player for team in teams for player in team["players"]]
+
+            try:
+                columns["agents"][rows] = np.array([agent_codes[player["agent"]] for player in players]).reshape(-1, 5)
+                columns["maps"][rows] = np.repeat([map_codes[data["map_name"]] for data in chunk], 2)
+            except KeyError as e:
+                raise ValueError(f"Unknown agent or map {e}, it must be added to utils/consts.py") from e
+
+            columns["stats"][rows] = np.array(
+                [player[metric][side] for player in players for metric in ALL_STATS for side in ("atk", "def")],
+                dtype=COLUMNS["stats"]
+            ).reshape(-1, 5, N_STATS)
+
+            columns["match_id"][rows] = np.repeat([int(data["match_id"]) for data in chunk], 2)
+            columns["game_id"][rows] = np.repeat([int(data["game_id"]) for data in chunk], 2)
+            columns["team"][rows] = [team_codes.setdefault(team["team"], len(team_codes)) for team in teams]
+
+            scores = np.array([float(team["score"]) for team in teams]).reshape(-1, 2)
+            total_rounds = scores.sum(axis=1, keepdims=True)
+            if np.any(total_rounds == 0):
+                raise ValueError("Found a game without any rounds played")
+            columns["wr"][rows] = (scores / total_rounds).reshape(-1)
+
+            row += 2 * len(chunk)
+
+    # Blank lines were counted but not read
+    columns = { name: column[:row] for name, column in columns.items() }
+    return columns, list(team_codes)
+
+def _lines_until(f, start: int, end: int | None):
+    """Yields the lines of a file opened at byte offset start until byte offset end"""
+    position = start
+    for line in f:
+        if end is not None and position >= end:
+            break
+        position += len(line)
+        yield line
+
+def _shape(name: str, n_rows: int) -> tuple:
+    if name == "agents":
+        return (n_rows, 5)
+    if name == "stats":
+        return (n_rows, 5, N_STATS)
+    return (n_rows,)
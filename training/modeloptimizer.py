@@ -1,11 +1,21 @@
 from typing import Callable, Any
 
 import os
+import queue
+import traceback
+import multiprocessing as mp
+import numpy as np
 import pandas as pd
 import tensorflow as tf
 from tensorboard.plugins.hparams import api as hp
 
-from training.checkpointsaver import SaveBestNCheckpoints
+from training.batchtuner import BatchSizeTuner
+from training.checkpointsaver import BestCheckpoints, SaveBestNCheckpoints, checkpoint_mode
+from training.instrumentation import MetricsCallback, ThroughputCallback, input_batch_seconds
+from training.trialscheduler import TrialScheduler, ASHAScheduler, SuccessiveHalvingScheduler
+from training.trialledger import TrialLedger
+from training.tpesampler import TPESampler
+from utils import metrics
 
 class ModelOptimizer:
     """Class responsible for optimizing the hyperparameters of a model"""
@@ -25,7 +35,17 @@ class ModelOptimizer:
         tensorboard_log_dir: str = "logs/hparam_tuning",
         model_out_dir: str = "",
         model_out_name: str = None,
-        extra_callbacks: list[tf.keras.callbacks.Callback] = None
+        extra_callbacks: list[tf.keras.callbacks.Callback] = None,
+        scheduler: TrialScheduler = None,
+        ledger: TrialLedger = None,
+        sampler: TPESampler = None,
+        profile: metrics.ProfileWindow = None,
+        jit_compile: bool = False,
+        steps_per_execution: int = 1,
+        cast_inputs: bool = False,
+        batch_tuner: BatchSizeTuner = None,
+        real_decimals: int = 3,
+        checkpoint_arrays: dict[str, np.ndarray] = None
     ):
         self.model_factory = factory
         self.model_losses = losses
@@ -41,6 +61,29 @@ class ModelOptimizer:
         self.model_out_dir = model_out_dir
         self.model_out_name = model_out_name
         self.extra_callbacks = extra_callbacks
+        self.scheduler = scheduler
+        self.ledger = ledger
+        self.sampler = sampler
+        self.profile = profile
+
+        # Throughput options: XLA compiled train steps, several steps per call into the runtime, and batches cast
+        # to float32 / int32 by the input pipeline instead of inside every step
+        self.jit_compile = jit_compile
+        self.steps_per_execution = steps_per_execution
+        self.cast_inputs = cast_inputs
+        self.batch_tuner = batch_tuner
+
+        # RealInterval values are rounded when sampled, so the ledger key of a config is the value that is
+        # trained and configs that only differ by float noise count as the same one
+        self.real_decimals = real_decimals
+        self._real_hparams = { hparam.name for hparam in hyperparams if isinstance(hparam.domain, hp.RealInterval) }
+
+        if self.sampler is not None and self.ledger is None:
+            raise ValueError("A sampler learns from past trials, so it needs a ledger")
+
+        # Rung values go to the ledger, shared by the parallel workers and kept when the search resumes
+        if isinstance(self.scheduler, ASHAScheduler) and self.scheduler.ledger is None:
+            self.scheduler.ledger = self.ledger
 
         self._hp_metrics = []
         self._hp_params = hyperparams
@@ -48,10 +91,30 @@ class ModelOptimizer:
         self._initialize()
 
         self._iteration_counter = 0
+        self.last_hparams: dict[str, Any] = None
+
+        # Trials started by this process, counted to find the one the profile window covers
+        self._trial_counter = 0
+        self._input_batch_seconds: float = None
+
+        # (batch size, learning rate scale) found by the batch tuner, replaces the batch size given to the runs
+        self.tuned_batch: tuple[int, float] = None
 
-        self._default_callbacks = [
+        # Shared by the checkpoint callbacks of every trial
+        # Saved with every checkpoint, e.g. the stats normalization of the training data
+        self._best_checkpoints = BestCheckpoints(self.n_models, mode=checkpoint_mode(self.monitor), arrays=checkpoint_arrays)
+
+        # Trials of a search that died are trained again first
+        if self.ledger is not None:
+            n_interrupted = self.ledger.reset_interrupted()
+            if n_interrupted > 0:
+                print(f"Resuming {n_interrupted} interrupted trials from {self.ledger.path}")
+
+    def _build_default_callbacks(self) -> list[tf.keras.callbacks.Callback]:
+        """Returns new checkpoint, early stopping and learning rate callbacks, every trial needs its own"""
+        return [
             SaveBestNCheckpoints(
-                self.n_models,
+                self._best_checkpoints,
                 filepath=self._model_out_path,
                 monitor=self.monitor,
                 verbose=1
@@ -83,10 +146,21 @@ class ModelOptimizer:
         if self.model_out_name is None:
             self.model_out_name = self._generate_model_out_name()
 
-    def run_iteration(self, train_dataset: tf.data.Dataset, validation_dataset: tf.data.Dataset, batch_size: int = 32, run_name_prefix: str = "iteration") -> None:
-        """Runs a single iteration of the hyperparameter optimization"""
+    def run_iteration(self, train_dataset: tf.data.Dataset, validation_dataset: tf.data.Dataset, batch_size: int = 32, run_name_prefix: str = "iteration") -> pd.Series:
+        """Runs a single iteration of the hyperparameter optimization and returns its best metrics"""
         run_name = f"{run_name_prefix}-{self._iteration_counter}"
         run_path = os.path.join(self.tensorboard_log_dir, run_name)
+        self._iteration_counter += 1
+
+        if self.batch_tuner is not None and self.tuned_batch is None:
+            self.tune_batch_size(train_dataset, validation_dataset)
+        if self.tuned_batch is not None:
+            batch_size = self.tuned_batch[0]
+
+        # Timed once per process, the input pipeline is the same for every trial
+        if metrics.enabled() and self._input_batch_seconds is None:
+            self._input_batch_seconds = input_batch_seconds(self._batched(train_dataset, batch_size))
+            metrics.set_gauge("train_input_batch_seconds", self._input_batch_seconds)
 
         if self.tensorboard_log:
             with tf.summary.create_file_writer(run_path).as_default():
@@ -98,46 +172,324 @@ class ModelOptimizer:
                     tf.summary.scalar(metric.name, best_metrics[metric.name], step=1)
         else:
             # Fitting model with random hyperparameters
-            self._fit_random_model(train_dataset, validation_dataset, batch_size)
+            best_metrics = self._fit_random_model(train_dataset, validation_dataset, batch_size)
+
+        # The checkpoints of the trial must be on disk before anyone looks for them
+        self._best_checkpoints.flush()
+
+        if self.scheduler is not None:
+            print(self.scheduler.summary())
+
+        metrics.flush()
+        return best_metrics
+
+    def tune_batch_size(self, train_dataset: tf.data.Dataset, validation_dataset: tf.data.Dataset) -> tuple[int, float]:
+        """Finds the batch size and learning rate scale of the next trials with the batch tuner.
+
+        The candidates train the same random config from a snapshot of the same initial weights, so they only
+        differ by their batch size and dropout masks. Not recorded in the ledger, the models are thrown away.
+        """
+        hparams = self._get_random_hparams()
+        print(f"Tuning the batch size with {self._convert_hparams_dict(hparams)}")
+
+        # Seeding TensorFlow doesn't fix the initializers of Keras 3, which have their own seed generators
+        initial_weights = self._build_model(hparams).get_weights()
+
+        def fit(batch_size: int, lr_scale: float) -> tuple[float, float]:
+            model = self._build_model(hparams, lr_scale)
+            model.set_weights(initial_weights)
+            throughput = ThroughputCallback(batch_size, verbose=False)
+            history = model.fit(
+                self._batched(train_dataset, batch_size),
+                validation_data=self._batched(validation_dataset, batch_size),
+                epochs=self.batch_tuner.epochs,
+                verbose=0,
+                callbacks=[throughput]
+            )
+            return self._best_metrics(pd.DataFrame(history.history))[self.monitor], throughput.samples_per_second
+
+        with metrics.timer("train_batch_tuning_seconds"):
+            self.tuned_batch = self.batch_tuner.tune(fit)
+        metrics.set_gauge("train_batch_size", self.tuned_batch[0])
+        print(f"Training with batch size {self.tuned_batch[0]} and learning rate x{self.tuned_batch[1]:.2f}")
+        return self.tuned_batch
+
+    def run_parallel(
+        self,
+        dataset_fn: Callable[[], tuple[tf.data.Dataset, tf.data.Dataset]],
+        n_workers: int,
+        n_trials: int = None,
+        batch_size: int = 32,
+        cpus_per_worker: int = None
+    ) -> list[dict]:
+        """Runs hyperparameter trials in n_workers processes at the same time and returns their results.
+
+        Each worker is a fresh process pinned to its own slice of the CPUs, with TensorFlow limited to
+        that many threads so workers don't fight over cores. dataset_fn must be a picklable (module level)
+        function, it's called once in each worker to build the (train, validation) datasets. The factory
+        of the optimizer must be picklable too. Runs forever when n_trials is None.
+
+        Workers keep their best checkpoints like `run_iteration` does, and the best n_models checkpoints
+        across all workers are kept on disk, the others are deleted as better ones are reported.
+        """
+        # Tuned once for all workers, which get the result with the optimizer
+        if self.batch_tuner is not None and self.tuned_batch is None:
+            self.tune_batch_size(*dataset_fn())
+
+        cpus = sorted(os.sched_getaffinity(0))
+        cpus_per_worker = cpus_per_worker or max(1, len(cpus) // n_workers)
+        cpu_slices = [
+            [cpus[(i * cpus_per_worker + j) % len(cpus)] for j in range(cpus_per_worker)]
+            for i in range(n_workers)
+        ]
+
+        # Spawned workers start without the TensorFlow runtime of this process, so the thread limits apply
+        context = mp.get_context("spawn")
+        next_trial = context.Value("i", 0)
+        results = context.Queue()
+
+        workers = [
+            context.Process(
+                target=_trial_worker,
+                args=(self, worker_id, dataset_fn, batch_size, cpu_slices[worker_id], n_trials, next_trial, results),
+                name=f"trial-worker-{worker_id}",
+                daemon=True
+            )
+            for worker_id in range(n_workers)
+        ]
+        for worker in workers:
+            worker.start()
+
+        trials = []
+        worker_checkpoints = { worker_id: [] for worker_id in range(n_workers) }
+        try:
+            while any(worker.is_alive() for worker in workers) or not results.empty():
+                try:
+                    result = results.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+
+                if "error" in result:
+                    raise RuntimeError(f"Trial worker {result['worker']} failed:\n{result['error']}")
+
+                trials.append(result)
+                worker_checkpoints[result["worker"]] = result.pop("checkpoints")
+                self._keep_best_checkpoints(worker_checkpoints)
+
+                print(f"Trial {result['trial']} (worker {result['worker']}): {self.monitor}={result['metrics'].get(self.monitor)} {result['hparams']}")
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+        return trials
+
+    def _keep_best_checkpoints(self, worker_checkpoints: dict[int, list[dict]]) -> None:
+        """Deletes every checkpoint reported by the workers that isn't in the best n_models overall"""
+        checkpoints = [checkpoint for reported in worker_checkpoints.values() for checkpoint in reported]
+        checkpoints.sort(key=lambda checkpoint: checkpoint["value"], reverse=self._maximize_monitor)
+
+        for checkpoint in checkpoints[self.n_models:]:
+            if os.path.exists(checkpoint["path"]):
+                os.remove(checkpoint["path"])
+
+        kept = { checkpoint["path"] for checkpoint in checkpoints[:self.n_models] }
+        for worker_id, reported in worker_checkpoints.items():
+            worker_checkpoints[worker_id] = [checkpoint for checkpoint in reported if checkpoint["path"] in kept]
 
     def _fit_random_model(self, train_dataset: tf.data.Dataset, validation_dataset: tf.data.Dataset, batch_size: int) -> pd.Series:
         """Fits a model with random hyperparameters and returns the best metrics"""
+        # Synchronous schedulers train many random models side by side
+        if isinstance(self.scheduler, SuccessiveHalvingScheduler):
+            return self._fit_random_brackets(train_dataset, validation_dataset, batch_size)
+
         # Generating random hyperparameters
-        hparams = self._get_random_hparams()
+        hparams, trial_id = self._next_trial()
         hp.hparams(hparams)
+        self.last_hparams = self._convert_hparams_dict(hparams)
 
         # Fitting model with random hyperparameters
-        return self._fit_model(hparams, train_dataset, validation_dataset, batch_size)
+        return self._fit_model(hparams, train_dataset, validation_dataset, batch_size, trial_id)
 
-    def _fit_model(self, hparams: dict[hp.HParam, Any], train_dataset: tf.data.Dataset, validation_dataset: tf.data.Dataset, batch_size: int) -> pd.Series:
+    def _fit_model(self, hparams: dict[hp.HParam, Any], train_dataset: tf.data.Dataset, validation_dataset: tf.data.Dataset, batch_size: int, trial_id: int = None) -> pd.Series:
         """Fits the model with the given hyperparameters and returns the best metrics"""
+        model = self._build_model(hparams)
+
+        callbacks = self._get_callbacks(hparams, batch_size)
+        epochs = 999
+        if self.scheduler is not None:
+            callbacks.append(self.scheduler.callback(trial_id))
+            epochs = self.scheduler.max_epochs
+
+        # Fitting model
+        try:
+            with metrics.timer("train_trial_seconds"):
+                history = model.fit(
+                    self._batched(train_dataset, batch_size),
+                    validation_data=self._batched(validation_dataset, batch_size),
+                    epochs=epochs,
+                    verbose=2,
+                    callbacks=callbacks
+                )
+        except Exception as e:
+            self._fail_trial(trial_id, e)
+            raise
+
+        history_df = pd.DataFrame(history.history)
+        best_metrics = self._best_metrics(history_df)
+        self._finish_trial(trial_id, history_df, best_metrics)
+        return best_metrics
+
+    def _fit_random_brackets(self, train_dataset: tf.data.Dataset, validation_dataset: tf.data.Dataset, batch_size: int) -> pd.Series:
+        """Runs the successive halving brackets of the scheduler with random hyperparameters and returns the best metrics"""
+        best_metrics, best_hparams = None, None
+
+        for n_configs, rungs in self.scheduler.brackets():
+            trials = []
+            for _ in range(n_configs):
+                hparams, trial_id = self._next_trial()
+                trials.append({
+                    "hparams": hparams,
+                    "id": trial_id,
+                    "model": self._build_model(hparams),
+                    "callbacks": _carry_state_across_fits(self._get_callbacks(hparams, batch_size)),
+                    "history": [],
+                    "stopped": False
+                })
+
+            try:
+                self._fit_bracket(trials, rungs, train_dataset, validation_dataset, batch_size)
+            except Exception as e:
+                for trial in trials:
+                    self._fail_trial(trial["id"], e)
+                raise
+
+            for trial in trials:
+                self.scheduler.record_trial(len(trial["history"]), trial["stopped"])
+
+                history_df = pd.DataFrame(trial["history"])
+                trial_metrics = self._best_metrics(history_df)
+                self._finish_trial(trial["id"], history_df, trial_metrics)
+                if best_metrics is None or self._is_better(trial_metrics[self.monitor], best_metrics[self.monitor]):
+                    best_metrics, best_hparams = trial_metrics, trial["hparams"]
+
+        hp.hparams(best_hparams)
+        self.last_hparams = self._convert_hparams_dict(best_hparams)
+        return best_metrics
+
+    def _fit_bracket(self, trials: list[dict], rungs: list[int], train_dataset: tf.data.Dataset, validation_dataset: tf.data.Dataset, batch_size: int) -> None:
+        """Trains the trials of a bracket rung by rung, only promoted trials go to the next rung"""
+        active = list(range(len(trials)))
+        for rung_index, rung in enumerate(rungs):
+            # Every active trial continues from where it stopped up to the rung epoch
+            for trial_index in active:
+                trial = trials[trial_index]
+                history = trial["model"].fit(
+                    self._batched(train_dataset, batch_size),
+                    validation_data=self._batched(validation_dataset, batch_size),
+                    initial_epoch=len(trial["history"]),
+                    epochs=rung,
+                    verbose=2,
+                    callbacks=trial["callbacks"]
+                )
+                trial["history"].extend(pd.DataFrame(history.history).to_dict("records"))
+
+            # Trials stopped by EarlyStopping before the rung can't go any further
+            contenders = [trial_index for trial_index in active if len(trials[trial_index]["history"]) == rung]
+            if rung_index == len(rungs) - 1 or len(contenders) == 0:
+                break
+
+            values = [trials[trial_index]["history"][-1][self.scheduler.monitor] for trial_index in contenders]
+            active = [contenders[i] for i in self.scheduler.promote(values)]
+            for trial_index in contenders:
+                trials[trial_index]["stopped"] = trial_index not in active
+
+    def _next_trial(self, max_attempts: int = 1000) -> tuple[dict[hp.HParam, Any], int | None]:
+        """Returns the hyperparameters of the next trial and its id in the ledger (None without a ledger)"""
+        if self.ledger is None:
+            return self._get_random_hparams(), None
+
+        pending = self.ledger.claim_pending()
+        if pending is not None:
+            trial_id, hparams_str = pending
+            hparams_by_name = { hparam.name: hparam for hparam in self._hp_params }
+            return { hparams_by_name[name]: value for name, value in hparams_str.items() }, trial_id
+
+        # Configs already claimed by this or any previous search are skipped, when every candidate of the
+        # sampler was already tried (or another worker claims it first) the config is sampled uniformly
+        for attempt in range(max_attempts):
+            hparams = None
+            if self.sampler is not None and attempt == 0:
+                completed = self.ledger.completed_trials(self.monitor)
+                hparams = self.sampler.sample(self._hp_params, completed, maximize=self._maximize_monitor, exclude=self._is_claimed)
+            if hparams is not None:
+                hparams = { hparam: self._round_real(hparam.name, value) for hparam, value in hparams.items() }
+            else:
+                hparams = self._get_random_hparams()
+
+            trial_id = self.ledger.start_trial(self._convert_hparams_dict(hparams))
+            if trial_id is not None:
+                return hparams, trial_id
+
+        raise RuntimeError(f"Couldn't find an untried config in {max_attempts} attempts, the search space may be exhausted")
+
+    def _finish_trial(self, trial_id: int | None, history_df: pd.DataFrame, best_metrics: pd.Series) -> None:
+        metrics.inc("train_trials", status="finished")
+        if trial_id is not None:
+            history = [{ name: float(value) for name, value in epoch.items() } for epoch in history_df.to_dict("records")]
+            self.ledger.finish_trial(trial_id, history, { name: float(value) for name, value in best_metrics.items() })
+
+    def _fail_trial(self, trial_id: int | None, error: BaseException) -> None:
+        metrics.inc("train_trials", status="failed")
+        if trial_id is not None:
+            self.ledger.fail_trial(trial_id, error)
+
+    def _build_model(self, hparams: dict[hp.HParam, Any], lr_scale: float = None) -> tf.keras.Model:
+        """Creates and compiles a model with the given hyperparameters, lr_scale defaults to the tuned one"""
         # Generating hparams
         random_hparams_str = self._convert_hparams_dict(hparams)
 
         # Creating model with random hparams
         model = self.model_factory(random_hparams_str)
 
+        # Bigger batches take fewer steps, so they need bigger ones
+        optimizer = tf.keras.optimizers.get(random_hparams_str["optimizer"] if "optimizer" in random_hparams_str else "adam")
+        if lr_scale is None:
+            lr_scale = self.tuned_batch[1] if self.tuned_batch is not None else 1.0
+        if lr_scale != 1.0:
+            optimizer.learning_rate = float(tf.keras.backend.get_value(optimizer.learning_rate)) * lr_scale
+
         # Compiling model
         model.compile(
-            optimizer=random_hparams_str["optimizer"] if "optimizer" in random_hparams_str else "adam",
+            optimizer=optimizer,
             loss=self.model_losses,
-            metrics=self.model_metrics
+            metrics=self.model_metrics,
+            jit_compile=self.jit_compile,
+            steps_per_execution=self.steps_per_execution
         )
+        return model
 
-        # Fitting model
-        history = model.fit(
-            train_dataset.batch(batch_size),
-            validation_data=validation_dataset.batch(batch_size),
-            epochs=999,
-            verbose=2,
-            callbacks=self._get_callbacks(hparams)
-        )
+    def _batched(self, dataset: tf.data.Dataset, batch_size: int) -> tf.data.Dataset:
+        """Returns the batches fed to fit, cast to float32 and int32 once per batch when cast_inputs is set"""
+        dataset = dataset.batch(batch_size)
+        if self.cast_inputs:
+            dataset = dataset.map(_cast_batch, num_parallel_calls=tf.data.AUTOTUNE)
+        return dataset.prefetch(tf.data.AUTOTUNE)
 
-        # Returning the best row in the history
-        history_df = pd.DataFrame(history.history)
-        return history_df.iloc[-self.early_stopping_patience]
+    def _best_metrics(self, history_df: pd.DataFrame) -> pd.Series:
+        """Returns the best row in the history"""
+        values = history_df[self.monitor]
+        return history_df.loc[values.idxmax() if self._maximize_monitor else values.idxmin()]
 
-    def _get_callbacks(self, hparams: dict[hp.HParam, Any]) -> list[tf.keras.callbacks.Callback]:
+    def _is_better(self, value: float, reference: float) -> bool:
+        return value > reference if self._maximize_monitor else value < reference
+
+    @property
+    def _maximize_monitor(self) -> bool:
+        return checkpoint_mode(self.monitor) == "max"
+
+    def _get_callbacks(self, hparams: dict[hp.HParam, Any], batch_size: int) -> list[tf.keras.callbacks.Callback]:
         """Returns a list of callbacks to be used during model training"""
         new_callbacks = []
         if self.tensorboard_log:
@@ -154,7 +506,14 @@ class ModelOptimizer:
         if self.extra_callbacks is not None:
             new_callbacks.extend(self.extra_callbacks)
 
-        return self._default_callbacks + new_callbacks
+        # Each trial gets its callbacks once, when it's created
+        trial = self._trial_counter
+        self._trial_counter += 1
+        if metrics.enabled() or (self.profile is not None and self.profile.trial == trial):
+            new_callbacks.append(MetricsCallback(trial, self.profile, self._input_batch_seconds))
+        new_callbacks.append(ThroughputCallback(batch_size, trial))
+
+        return self._build_default_callbacks() + new_callbacks
 
     def _get_hp_metrics(self) -> list[hp.Metric]:
         """Returns a list of all metrics to be monitored in a list of hp.Metric"""
@@ -174,7 +533,15 @@ class ModelOptimizer:
 
     def _get_random_hparams(self) -> dict[hp.HParam, Any]:
         """Returns a dictionary of random hyperparameters"""
-        return { hparam: hparam.domain.sample_uniform() for hparam in self._hp_params }
+        return { hparam: self._round_real(hparam.name, hparam.domain.sample_uniform()) for hparam in self._hp_params }
+
+    def _round_real(self, name: str, value: Any) -> Any:
+        """Rounds the value of a RealInterval hyperparameter to real_decimals, other values are returned as is"""
+        return round(value, self.real_decimals) if name in self._real_hparams else value
+
+    def _is_claimed(self, config: dict[str, Any]) -> bool:
+        """Tells if the ledger has the config once rounded, for the candidates of the sampler"""
+        return self.ledger.has_config({ name: self._round_real(name, value) for name, value in config.items() })
 
     def _convert_hparams_dict(self, hparams: dict[hp.HParam, Any]) -> dict[str, Any]:
         """Converts a dictionary of hyperparameters from hp.HParam to str"""
@@ -187,4 +554,83 @@ class ModelOptimizer:
             metric_name = hp_metric.as_proto().display_name
             if metric_name.startswith("val_") and metric_name != "val_loss":
                 model_name += f"-{{{metric_name}:.4f}}"
-        return f"{model_name}.h5"
+        return f"{model_name}.npz"
+
+class _CarryState(tf.keras.callbacks.Callback):
+    """Puts back the patience state EarlyStopping and ReduceLROnPlateau reset when a new fit of the same model starts.
+
+    Must come after them in the callback list, its on_train_begin runs after their reset.
+    """
+
+    ATTRIBUTES = ["wait", "best", "best_weights", "best_epoch", "cooldown_counter"]
+
+    def __init__(self, callbacks: list[tf.keras.callbacks.Callback]):
+        super().__init__()
+        self.callbacks = [
+            callback for callback in callbacks
+            if isinstance(callback, (tf.keras.callbacks.EarlyStopping, tf.keras.callbacks.ReduceLROnPlateau))
+        ]
+        self._states: list[dict] = None
+
+    def on_train_begin(self, logs=None):
+        if self._states is not None:
+            for callback, state in zip(self.callbacks, self._states):
+                callback.__dict__.update(state)
+
+    def on_train_end(self, logs=None):
+        self._states = [
+            { name: getattr(callback, name) for name in self.ATTRIBUTES if hasattr(callback, name) }
+            for callback in self.callbacks
+        ]
+
+def _carry_state_across_fits(callbacks: list[tf.keras.callbacks.Callback]) -> list[tf.keras.callbacks.Callback]:
+    """Returns the callbacks of a trial trained by several fit calls, whose patience counts across them"""
+    return callbacks + [_CarryState(callbacks)]
+
+def _cast_batch(*batch):
+    """Casts every tensor of a batch to float32 or int32, the dtypes the model computes with"""
+    return tf.nest.map_structure(lambda tensor: tf.cast(tensor, tf.float32 if tensor.dtype.is_floating else tf.int32), batch)
+
+def _trial_worker(
+    optimizer: ModelOptimizer,
+    worker_id: int,
+    dataset_fn: Callable[[], tuple[tf.data.Dataset, tf.data.Dataset]],
+    batch_size: int,
+    cpus: list[int],
+    n_trials: int | None,
+    next_trial,
+    results
+) -> None:
+    """Entry point of the worker processes of `ModelOptimizer.run_parallel`"""
+    try:
+        # Must happen before TensorFlow creates its thread pools, i.e. before any op runs
+        os.sched_setaffinity(0, cpus)
+        tf.config.threading.set_intra_op_parallelism_threads(len(cpus))
+        tf.config.threading.set_inter_op_parallelism_threads(min(2, len(cpus)))
+
+        # Workers save checkpoints in the same directory, so their names can't collide
+        optimizer.model_out_name = f"w{worker_id}-{optimizer.model_out_name}"
+
+        # Metrics are enabled when the parent's are, each worker exports its own files
+        with metrics.session(f"train-worker{worker_id}"):
+            train_dataset, validation_dataset = dataset_fn()
+
+            while True:
+                with next_trial.get_lock():
+                    if n_trials is not None and next_trial.value >= n_trials:
+                        break
+                    trial = next_trial.value
+                    next_trial.value += 1
+
+                best_metrics = optimizer.run_iteration(train_dataset, validation_dataset, batch_size, run_name_prefix=f"worker{worker_id}-iteration")
+                checkpoints = optimizer._best_checkpoints.checkpoints # pylint: disable=protected-access
+
+                results.put({
+                    "worker": worker_id,
+                    "trial": trial,
+                    "hparams": optimizer.last_hparams,
+                    "metrics": { name: float(value) for name, value in best_metrics.items() },
+                    "checkpoints": [{ "value": float(checkpoint["value"]), "path": checkpoint["path"] } for checkpoint in checkpoints]
+                })
+    except BaseException: # pylint: disable=broad-except
+        results.put({ "worker": worker_id, "error": traceback.format_exc() })
@@ -0,0 +1,120 @@
+import math
+from typing import Callable, Any
+
+import numpy as np
+from tensorboard.plugins.hparams import api as hp
+
+class TPESampler:
+    """Tree-structured Parzen Estimator that proposes hyperparameters from the results of past trials.
+
+    Past trials are split into the best gamma fraction and the rest, each hyperparameter gets one
+    density fitted on the good trials and one on the others, and of the candidates drawn from the good
+    densities the one with the highest good / other ratio is picked. Hyperparameters are modelled
+    independently, the ratio of a candidate is the product of the ratios of its values.
+    Until there are n_startup_trials results the hyperparameters are sampled uniformly.
+    """
+
+    def __init__(self, n_startup_trials: int = 10, gamma: float = 0.25, n_candidates: int = 24, seed: int = None):
+        self.n_startup_trials = n_startup_trials
+        self.gamma = gamma
+        self.n_candidates = n_candidates
+        self._rng = np.random.default_rng(seed)
+
+    def sample(
+        self,
+        hyperparams: list[hp.HParam],
+        trials: list[tuple[dict[str, Any], float]],
+        maximize: bool = False,
+        exclude: Callable[[dict[str, Any]], bool] = None
+    ) -> dict[hp.HParam, Any] | None:
+        """Proposes the next hyperparameters given the (config, monitored value) of past trials.
+
+        Candidates for which exclude(config) is True (e.g. configs already tried) are skipped, and
+        None is returned when every candidate is excluded.
+        """
+        if len(trials) < self.n_startup_trials:
+            hparams = { hparam: hparam.domain.sample_uniform() for hparam in hyperparams }
+            return None if exclude is not None and exclude(_names(hparams)) else hparams
+
+        trials = sorted(trials, key=lambda trial: trial[1], reverse=maximize)
+        n_good = max(1, math.ceil(self.gamma * len(trials)))
+        good, bad = [config for config, _ in trials[:n_good]], [config for config, _ in trials[n_good:]]
+
+        # Every hyperparameter draws n_candidates values, candidate i is made of the i-th value of each
+        values, scores = {}, np.zeros(self.n_candidates)
+        for hparam in hyperparams:
+            values[hparam], hparam_scores = self._sample_hparam(
+                hparam,
+                [config[hparam.name] for config in good if hparam.name in config],
+                [config[hparam.name] for config in bad if hparam.name in config]
+            )
+            scores += hparam_scores
+
+        for i in np.argsort(-scores):
+            hparams = { hparam: hparam_values[i] for hparam, hparam_values in values.items() }
+            if exclude is None or not exclude(_names(hparams)):
+                return hparams
+        return None
+
+    def _sample_hparam(self, hparam: hp.HParam, good: list, bad: list) -> tuple[list, np.ndarray]:
+        """Returns n_candidates values of a hyperparameter and their log(good density / other density)"""
+        domain = hparam.domain
+        if isinstance(domain, hp.Discrete):
+            return self._sample_discrete(domain.values, good, bad)
+        if isinstance(domain, hp.IntInterval):
+            candidates, scores = self._sample_interval(domain.min_value, domain.max_value, good, bad)
+            return [int(round(candidate)) for candidate in candidates], scores
+        if isinstance(domain, hp.RealInterval):
+            candidates, scores = self._sample_interval(domain.min_value, domain.max_value, good, bad)
+            return [float(candidate) for candidate in candidates], scores
+        return [domain.sample_uniform() for _ in range(self.n_candidates)], np.zeros(self.n_candidates)
+
+    def _sample_discrete(self, values: list, good: list, bad: list) -> tuple[list, np.ndarray]:
+        # Categorical densities with one prior observation of every value
+        p_good = np.array([1 + good.count(value) for value in values], dtype=np.float64)
+        p_bad = np.array([1 + bad.count(value) for value in values], dtype=np.float64)
+        p_good /= p_good.sum()
+        p_bad /= p_bad.sum()
+
+        candidates = self._rng.choice(len(values), size=self.n_candidates, p=p_good)
+        return [values[candidate] for candidate in candidates], np.log(p_good[candidates] / p_bad[candidates])
+
+    def _sample_interval(self, low: float, high: float, good: list, bad: list) -> tuple[np.ndarray, np.ndarray]:
+        good_density = _ParzenEstimator(low, high, good)
+        bad_density = _ParzenEstimator(low, high, bad)
+
+        candidates = good_density.sample(self._rng, self.n_candidates)
+        return candidates, good_density.log_pdf(candidates) - bad_density.log_pdf(candidates)
+
+class _ParzenEstimator:
+    """Mixture of a uniform prior and one gaussian per observation, samples are clipped to [low, high]"""
+
+    def __init__(self, low: float, high: float, observations: list):
+        self.low = low
+        self.high = high
+        self.mus = np.asarray(observations, dtype=np.float64)
+
+        # Scott's rule, wide enough to keep exploring around every observation
+        width = high - low
+        self.sigma = max(width * len(self.mus) ** (-1 / 5) if len(self.mus) > 0 else width, width / 100)
+
+    def sample(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        components = rng.integers(0, len(self.mus) + 1, size=n)
+        samples = np.empty(n, dtype=np.float64)
+
+        prior = components == len(self.mus)
+        samples[prior] = rng.uniform(self.low, self.high, size=prior.sum())
+        if len(self.mus) > 0:
+            samples[~prior] = rng.normal(self.mus[components[~prior]], self.sigma)
+        return np.clip(samples, self.low, self.high)
+
+    def log_pdf(self, x: np.ndarray) -> np.ndarray:
+        weight = 1 / (len(self.mus) + 1)
+        density = np.full(x.shape, weight / (self.high - self.low))
+        if len(self.mus) > 0:
+            z = (x[:, None] - self.mus[None, :]) / self.sigma
+            density += weight * np.sum(np.exp(-0.5 * z ** 2) / (self.sigma * math.sqrt(2 * math.pi)), axis=1)
+        return np.log(density)
+
+def _names(hparams: dict[hp.HParam, Any]) -> dict[str, Any]:
+    return { hparam.name: value for hparam, value in hparams.items() }
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import sqlite3
+from typing import Any
+
+class TrialLedger:
+    """SQLite file recording every hyperparameter trial, its history and its best metrics.
+
+    Each config can only be claimed once, so the same config is never trained twice, even by
+    parallel workers sharing the file. Trials that were running when a search died are put back
+    in the queue by `reset_interrupted` and trained first when the search resumes. The values of
+    the trials at the rungs of an ASHAScheduler are kept too, so every worker promotes on all of them.
+    """
+
+    def __init__(self, path: str, timeout: float = 60.0):
+        self.path = path
+        self.timeout = timeout
+        self._connection: sqlite3.Connection = None
+
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self._db as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS trials (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    config_key TEXT NOT NULL UNIQUE,
+                    hparams TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    epochs INTEGER,
+                    best_metrics TEXT,
+                    history TEXT,
+                    error TEXT,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS rung_values (
+                    trial_id INTEGER NOT NULL,
+                    rung INTEGER NOT NULL,
+                    value REAL NOT NULL,
+                    PRIMARY KEY (trial_id, rung)
+                )
+            """)
+
+    def __getstate__(self):
+        # Connections can't be pickled, each process opens its own
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        return state
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+        return self._connection
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM trials").fetchone()[0]
+
+    def has_config(self, hparams: dict[str, Any]) -> bool:
+        """Tells if the config was already claimed by a trial, finished or not"""
+        row = self._db.execute("SELECT 1 FROM trials WHERE config_key = ?", (config_key(hparams),)).fetchone()
+        return row is not None
+
+    def start_trial(self, hparams: dict[str, Any]) -> int | None:
+        """Claims a new config and returns the id of its trial, or None if the config was already claimed"""
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO trials (config_key, hparams, status, started_at) VALUES (?, ?, 'running', ?)",
+            (config_key(hparams), json.dumps(hparams), time.time())
+        )
+        return cursor.lastrowid if cursor.rowcount == 1 else None
+
+    def claim_pending(self) -> tuple[int, dict[str, Any]] | None:
+        """Claims a trial put back in the queue by `reset_interrupted` and returns its id and config"""
+        with self._db as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT id, hparams FROM trials WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE trials SET status = 'running', started_at = ? WHERE id = ?", (time.time(), row[0]))
+        return row[0], json.loads(row[1])
+
+    def finish_trial(self, trial_id: int, history: list[dict[str, float]], best_metrics: dict[str, float]) -> None:
+        """Records the per epoch history and best metrics of a trial"""
+        self._db.execute(
+            "UPDATE trials SET status = 'done', epochs = ?, best_metrics = ?, history = ?, finished_at = ? WHERE id = ?",
+            (len(history), json.dumps(best_metrics), json.dumps(history), time.time(), trial_id)
+        )
+
+    def fail_trial(self, trial_id: int, error: BaseException) -> None:
+        """Records that a trial failed, its config is not tried again"""
+        self._db.execute(
+            "UPDATE trials SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+            (repr(error), time.time(), trial_id)
+        )
+
+    def record_rung_value(self, trial_id: int, rung: int, value: float) -> list[float]:
+        """Records the value of a trial at a rung epoch and returns the values of every trial at that rung.
+
+        A trial trained again after an interruption replaces its value, and the values recorded by other
+        processes are returned with the new one, read in the same transaction.
+        """
+        with self._db as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT OR REPLACE INTO rung_values (trial_id, rung, value) VALUES (?, ?, ?)", (trial_id, rung, value))
+            rows = db.execute("SELECT value FROM rung_values WHERE rung = ?", (rung,)).fetchall()
+        return [row[0] for row in rows]
+
+    def reset_interrupted(self) -> int:
+        """Puts trials left running by a previous search back in the queue and returns how many there were.
+
+        Must only be called when no other process is using the ledger.
+        """
+        cursor = self._db.execute("UPDATE trials SET status = 'pending' WHERE status = 'running'")
+        return cursor.rowcount
+
+    def completed_trials(self, monitor: str) -> list[tuple[dict[str, Any], float]]:
+        """Returns the config and best monitored value of every finished trial"""
+        rows = self._db.execute("SELECT hparams, best_metrics FROM trials WHERE status = 'done' ORDER BY id").fetchall()
+        return [
+            (json.loads(hparams), json.loads(best_metrics)[monitor])
+            for hparams, best_metrics in rows
+            if monitor in json.loads(best_metrics)
+        ]
+
+def config_key(hparams: dict[str, Any]) -> str:
+    """Returns the canonical form of a config used to detect duplicates"""
+    return json.dumps(hparams, sort_keys=True)
@@ -0,0 +1,157 @@
+import math
+import numpy as np
+import tensorflow as tf
+
+from training.trialledger import TrialLedger
+
+class TrialScheduler:
+    """Base class of the schedulers that stop bad hyperparameter trials early.
+
+    Trials are compared with each other on the monitored metric at "rung" epochs. Besides deciding
+    which trials keep training, schedulers count the epochs they trained and the epochs they saved,
+    i.e. the epochs the trials they stopped would still have needed to reach max_epochs.
+    """
+
+    def __init__(self, max_epochs: int, reduction_factor: int, monitor: str = "val_loss", mode: str = "min"):
+        if mode not in ("min", "max"):
+            raise ValueError(f"Unknown mode {mode}, it must be 'min' or 'max'")
+
+        self.max_epochs = max_epochs
+        self.reduction_factor = reduction_factor
+        self.monitor = monitor
+        self.mode = mode
+
+        self.n_trials = 0
+        self.n_stopped = 0
+        self.epochs_trained = 0
+        self.epochs_saved = 0
+
+    def record_trial(self, epochs_trained: int, stopped: bool) -> None:
+        """Accounts for a finished trial, stopped tells if the scheduler is the one that stopped it"""
+        self.n_trials += 1
+        self.epochs_trained += epochs_trained
+        if stopped:
+            self.n_stopped += 1
+            self.epochs_saved += self.max_epochs - epochs_trained
+
+    def summary(self) -> str:
+        """Returns a one line report of the work done and saved so far"""
+        return (
+            f"{type(self).__name__}: {self.n_trials} trials, {self.n_stopped} stopped early, "
+            f"{self.epochs_trained} epochs trained, {self.epochs_saved} epochs saved"
+        )
+
+    def _best(self, values: list[float], keep: int) -> list[int]:
+        """Returns the indices of the best keep values"""
+        order = np.argsort(values)
+        if self.mode == "max":
+            order = order[::-1]
+        return order[:keep].tolist()
+
+class ASHAScheduler(TrialScheduler):
+    """Asynchronous successive halving, trials are stopped as they reach a rung without waiting for their peers.
+
+    A trial keeps training past a rung only if its value is in the best 1 / reduction_factor of all values
+    recorded at that rung so far. Rungs are at min_epochs * reduction_factor ** k epochs. With a ledger the
+    values are recorded in it, so parallel workers and resumed searches compare trials with all of them,
+    otherwise they are only kept by this process.
+    """
+
+    def __init__(
+        self,
+        min_epochs: int = 1,
+        max_epochs: int = 81,
+        reduction_factor: int = 3,
+        monitor: str = "val_loss",
+        mode: str = "min",
+        ledger: TrialLedger = None
+    ):
+        super().__init__(max_epochs, reduction_factor, monitor, mode)
+        self.min_epochs = min_epochs
+        self.ledger = ledger
+        self.rungs = _rung_epochs(min_epochs, max_epochs, reduction_factor)[:-1]
+        self._rung_values = { rung: [] for rung in self.rungs }
+
+    def callback(self, trial_id: int = None) -> tf.keras.callbacks.Callback:
+        """Returns the callback that applies the scheduler to one trial, trial_id is its id in the ledger"""
+        return _ASHACallback(self, trial_id)
+
+    def should_continue(self, epoch: int, value: float, trial_id: int = None) -> bool:
+        """Records the value of a trial that reached a rung epoch and tells if it should keep training"""
+        if self.ledger is not None and trial_id is not None:
+            values = self.ledger.record_rung_value(trial_id, epoch, value)
+        else:
+            values = self._rung_values[epoch]
+            values.append(value)
+
+        if self.mode == "min":
+            return value <= np.percentile(values, 100 / self.reduction_factor)
+        return value >= np.percentile(values, 100 - 100 / self.reduction_factor)
+
+class SuccessiveHalvingScheduler(TrialScheduler):
+    """Synchronous successive halving, n_configs trials are trained together one rung at a time.
+
+    After each rung only the best 1 / reduction_factor of the trials keep training, until max_epochs.
+    """
+
+    def __init__(self, n_configs: int = 27, min_epochs: int = 1, max_epochs: int = 27, reduction_factor: int = 3, monitor: str = "val_loss", mode: str = "min"):
+        super().__init__(max_epochs, reduction_factor, monitor, mode)
+        self.n_configs = n_configs
+        self.min_epochs = min_epochs
+
+    def brackets(self) -> list[tuple[int, list[int]]]:
+        """Returns the (number of configs, rung epochs) of every bracket of one iteration"""
+        return [(self.n_configs, _rung_epochs(self.min_epochs, self.max_epochs, self.reduction_factor))]
+
+    def promote(self, values: list[float]) -> list[int]:
+        """Returns the indices of the trials that move to the next rung"""
+        return self._best(values, max(1, len(values) // self.reduction_factor))
+
+class HyperbandScheduler(SuccessiveHalvingScheduler):
+    """Hyperband, runs successive halving brackets that trade the number of configs for their starting epochs.
+
+    The most aggressive bracket starts many configs at min_epochs, the most conservative one trains a
+    few configs straight to max_epochs, which hedges against metrics that are misleading early on.
+    """
+
+    def __init__(self, min_epochs: int = 1, max_epochs: int = 27, reduction_factor: int = 3, monitor: str = "val_loss", mode: str = "min"):
+        super().__init__(0, min_epochs, max_epochs, reduction_factor, monitor, mode)
+
+    def brackets(self) -> list[tuple[int, list[int]]]:
+        s_max = len(_rung_epochs(self.min_epochs, self.max_epochs, self.reduction_factor)) - 1
+
+        brackets = []
+        for s in range(s_max, -1, -1):
+            n_configs = math.ceil((s_max + 1) / (s + 1) * self.reduction_factor ** s)
+            start_epochs = max(self.min_epochs, self.max_epochs // self.reduction_factor ** s)
+            brackets.append((n_configs, _rung_epochs(start_epochs, self.max_epochs, self.reduction_factor)))
+        return brackets
+
+class _ASHACallback(tf.keras.callbacks.Callback):
+    def __init__(self, scheduler: ASHAScheduler, trial_id: int = None):
+        super().__init__()
+        self.scheduler = scheduler
+        self.trial_id = trial_id
+        self.epochs_trained = 0
+        self.stopped = False
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epochs_trained = epoch + 1
+        if self.epochs_trained in self.scheduler.rungs:
+            value = logs.get(self.scheduler.monitor)
+            if not self.scheduler.should_continue(self.epochs_trained, value, self.trial_id):
+                self.stopped = True
+                self.model.stop_training = True
+
+    def on_train_end(self, logs=None):
+        self.scheduler.record_trial(self.epochs_trained, self.stopped)
+
+def _rung_epochs(min_epochs: int, max_epochs: int, reduction_factor: int) -> list[int]:
+    """Returns min_epochs * reduction_factor ** k for every k until max_epochs, which is always the last rung"""
+    rungs = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= reduction_factor
+    rungs.append(max_epochs)
+    return rungs
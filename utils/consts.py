@@ -42,3 +42,7 @@ ALL_STATS = [
     "fk",
     "fd"
 ]
+
+# Agent and map codes the models use, the one-hot encoders of DatasetFactory sort their categories
+MODEL_AGENTS = sorted(ALL_AGENTS)
+MODEL_MAPS = sorted(ALL_MAPS)
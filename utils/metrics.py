@@ -0,0 +1,323 @@
+"""Counters, gauges and histograms of the hot paths, exported as JSON and as a Prometheus text file.
+
+Disabled by default, every call then returns after checking a flag. Enabled by `session`, which entry
+points open around their main with the directory given by --metrics-dir or the VALORANT_METRICS_DIR
+environment variable, e.g.:
+
+    VALORANT_METRICS_DIR=metrics python cli.py scrape -o data/comps.jsonl
+    python cli.py train -i data/comps.store --metrics-dir metrics --profile cprofile --profile-epochs 2 4
+
+Processes started by an entry point inherit the environment variable and export their own files.
+"""
+import os
+import json
+import time
+import bisect
+import argparse
+import threading
+import contextlib
+from dataclasses import dataclass
+
+ENV_VAR = "VALORANT_METRICS_DIR"
+
+# Prefix of every exported Prometheus metric
+NAMESPACE = "valorant"
+
+# Upper bounds in seconds of the histogram buckets, from sub-millisecond parses to minute long epochs
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+PROFILERS = ["cprofile", "tf"]
+
+class Histogram:
+    """Counts of observed values per bucket, with their sum, min and max"""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by interpolating inside its bucket"""
+        if self.count == 0:
+            return float("nan")
+
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count > 0 and seen + count >= rank:
+                low = self.buckets[i - 1] if i > 0 else self.min
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                low, high = max(low, self.min), min(high, self.max)
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def summary(self) -> dict:
+        """Histograms are created by their first observation, so they are never empty"""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.counts)),
+        }
+
+class Registry:
+    """Metrics by name and labels. Updates are thread safe and do nothing while disabled"""
+
+    def __init__(self):
+        self.enabled = False
+        self.counters: dict[tuple, float] = {}
+        self.gauges: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def timer(self, name: str, **labels) -> "Timer":
+        """Context manager observing its duration in seconds in the `name` histogram"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return Timer(self, name, labels)
+
+    def stages(self, name: str, **labels) -> "Stages":
+        if not self.enabled:
+            return _NULL_TIMER
+        return Stages(self, name, labels)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters, self.gauges, self.histograms = {}, {}, {}
+
+    def summary(self) -> dict:
+        """Returns every metric as {name: [{labels, value or histogram summary}]}"""
+        with self._lock:
+            metrics = {}
+            for kind, table in (("counter", self.counters), ("gauge", self.gauges), ("histogram", self.histograms)):
+                for (name, labels), value in sorted(table.items()):
+                    entry = metrics.setdefault(name, { "type": kind, "values": [] })
+                    entry["values"].append({ "labels": dict(labels), **(value.summary() if kind == "histogram" else { "value": value }) })
+            return metrics
+
+    def prometheus(self) -> str:
+        """Returns every metric in the Prometheus text exposition format, e.g. for the textfile collector"""
+        with self._lock:
+            lines = []
+            for (kind, suffix), table in ((("counter", "_total"), self.counters), (("gauge", ""), self.gauges)):
+                for name in sorted({ name for name, _ in table }):
+                    lines.append(f"# TYPE {NAMESPACE}_{name}{suffix} {kind}")
+                    for (metric, labels), value in sorted(table.items()):
+                        if metric == name:
+                            lines.append(f"{NAMESPACE}_{name}{suffix}{_labels(labels)} {value!r}")
+
+            for name in sorted({ name for name, _ in self.histograms }):
+                lines.append(f"# TYPE {NAMESPACE}_{name} histogram")
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip([*map(repr, histogram.buckets), "+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f"{NAMESPACE}_{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{NAMESPACE}_{name}_sum{_labels(labels)} {histogram.sum!r}")
+                    lines.append(f"{NAMESPACE}_{name}_count{_labels(labels)} {histogram.count}")
+            return "\n".join(lines) + "\n"
+
+    def export(self, out_dir: str, name: str) -> None:
+        """Writes <name>.json and <name>.prom in out_dir, each replaced in one step so readers never see half a file"""
+        os.makedirs(out_dir, exist_ok=True)
+        summary = json.dumps({ "name": name, "pid": os.getpid(), "exported_at": time.time(), "metrics": self.summary() }, indent=2)
+        for extension, content in (("json", summary), ("prom", self.prometheus())):
+            path = os.path.join(out_dir, f"{name}.{extension}")
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(f"{path}.tmp", path)
+
+class Timer:
+    def __init__(self, registry: Registry, name: str, labels: dict):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start = None
+        self.elapsed = None
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+        self.registry.observe(self.name, self.elapsed, **self.labels)
+
+class Stages:
+    """Times consecutive stages of a function: each `mark` observes the time since the previous one in the `name` histogram"""
+
+    def __init__(self, registry: Registry, name: str, labels: dict):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.last = time.perf_counter()
+
+    def mark(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.registry.observe(self.name, now - self.last, stage=stage, **self.labels)
+        self.last = now
+
+class _NullTimer:
+    elapsed = None
+
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def mark(self, stage: str) -> None:
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+# Registry of the process, used through the functions below
+REGISTRY = Registry()
+_session: tuple[str, str] = None
+
+def enabled() -> bool:
+    return REGISTRY.enabled
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    REGISTRY.inc(name, value, **labels)
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    REGISTRY.set(name, value, **labels)
+
+def observe(name: str, value: float, **labels) -> None:
+    REGISTRY.observe(name, value, **labels)
+
+def timer(name: str, **labels):
+    return REGISTRY.timer(name, **labels)
+
+def stages(name: str, **labels):
+    return REGISTRY.stages(name, **labels)
+
+@contextlib.contextmanager
+def session(name: str, out_dir: str = None):
+    """Enables the metrics if out_dir or VALORANT_METRICS_DIR is set, and exports them as <name>.json/.prom when leaving"""
+    global _session # pylint: disable=global-statement
+    out_dir = out_dir or os.environ.get(ENV_VAR)
+    if not out_dir:
+        yield
+        return
+
+    # Child processes, like the parallel trial workers, find the directory in their environment
+    os.environ[ENV_VAR] = out_dir
+    REGISTRY.enabled = True
+    _session = (out_dir, name)
+    try:
+        yield
+    finally:
+        flush()
+        REGISTRY.enabled = False
+        _session = None
+
+def flush() -> None:
+    """Exports the metrics of the current session, so long runs can be watched before they end"""
+    if _session is not None:
+        REGISTRY.export(*_session)
+
+@dataclass
+class ProfileWindow:
+    """Profiles epochs first_epoch to last_epoch (1-based, inclusive) of one trial, the trial-th fitted by this process"""
+    kind: str
+    out_dir: str
+    trial: int = 0
+    first_epoch: int = 1
+    last_epoch: int = 1
+
+    def __post_init__(self):
+        if self.kind not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{self.kind}', expected one of {PROFILERS}")
+        self._profiler = None
+
+    def covers(self, trial: int, epoch: int) -> bool:
+        return trial == self.trial and self.first_epoch <= epoch <= self.last_epoch
+
+    def start(self) -> None:
+        if self._profiler is not None:
+            return
+        os.makedirs(self.out_dir, exist_ok=True)
+        if self.kind == "cprofile":
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            import tensorflow as tf
+            tf.profiler.experimental.start(self.out_dir)
+            self._profiler = tf.profiler.experimental
+
+    def stop(self, name: str) -> None:
+        """Stops profiling and saves the cProfile stats as <name>.prof, tf.profiler writes its own trace"""
+        if self._profiler is None:
+            return
+        if self.kind == "cprofile":
+            self._profiler.disable()
+            self._profiler.dump_stats(os.path.join(self.out_dir, f"{name}.prof"))
+        else:
+            self._profiler.stop()
+        self._profiler = None
+
+def add_arguments(parser: argparse.ArgumentParser, profiling: bool = False):
+    """Adds --metrics-dir, and the profile window options if profiling"""
+    parser.add_argument("--metrics-dir", default=None, type=str, help=f"Enables the metrics and exports them there, defaults to ${ENV_VAR}")
+    if profiling:
+        parser.add_argument("--profile", default=None, choices=PROFILERS, help="Profiles a window of epochs of one trial")
+        parser.add_argument("--profile-dir", default="logs/profile", type=str, help="Directory of the profiles")
+        parser.add_argument("--profile-trial", default=0, type=int, help="Trial profiled, counted from 0 in each process")
+        parser.add_argument("--profile-epochs", nargs=2, default=[2, 2], type=int, metavar=("FIRST", "LAST"), help="Epochs profiled, counted from 1")
+
+def profile_window(args: argparse.Namespace) -> ProfileWindow | None:
+    if args.profile is None:
+        return None
+    return ProfileWindow(args.profile, args.profile_dir, args.profile_trial, *args.profile_epochs)
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+def _labels(labels: tuple) -> str:
+    if len(labels) == 0:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}"